@@ -1,4 +1,6 @@
 import io
+import json
+import math
 import requests
 import os
 import ftplib
@@ -10,11 +12,13 @@ import fnmatch
 import logging
 import dateutil
 import smtplib
-from more_itertools import chunked
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from common import credentials
 from common import change_tracking
 from common.retry import retry
+from common import http_session
+from common.ftp_session import ftp_session
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.application import MIMEApplication
@@ -37,39 +41,24 @@ http_errors_to_handle = ConnectionResetError, urllib3.exceptions.MaxRetryError,
 ftp_errors_to_handle = ftplib.error_temp, ftplib.error_perm, BrokenPipeError, ConnectionResetError, ConnectionRefusedError, EOFError, FileNotFoundError
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_get(*args, **kwargs):
-    r = requests.get(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
-    return r
+def requests_get(url, params=None, cache_dir=None, **kwargs):
+    return http_session.send('GET', url, params=params, cache_dir=cache_dir, **kwargs)
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_post(*args, **kwargs):
-    r = requests.post(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
-    return r
+def requests_post(url, data=None, json=None, **kwargs):
+    return http_session.send('POST', url, data=data, json=json, **kwargs)
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_patch(*args, **kwargs):
-    r = requests.patch(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
-    return r
+def requests_patch(url, data=None, **kwargs):
+    return http_session.send('PATCH', url, data=data, **kwargs)
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_put(*args, **kwargs):
-    r = requests.put(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
-    return r
+def requests_put(url, data=None, **kwargs):
+    return http_session.send('PUT', url, data=data, **kwargs)
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_delete(*args, **kwargs):
-    r = requests.delete(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
-    return r
+def requests_delete(url, **kwargs):
+    return http_session.send('DELETE', url, **kwargs)
 
 
 # Upload file to FTP Server
@@ -78,31 +67,67 @@ def requests_delete(*args, **kwargs):
 def upload_ftp(filename, server=credentials.ftp_server, user=credentials.ftp_user, 
                password=credentials.ftp_pass, remote_path=''):
     logging.info("Uploading " + filename + " to FTP server directory " + remote_path + '...')
-    # change to desired directory first
-    curr_dir = os.getcwd()
-    rel_path, filename_no_path = os.path.split(filename)
-    if rel_path != '':
-        os.chdir(rel_path)
-    ftp = ftplib.FTP(server)
-    ftp.login(user, password)
-    ftp.cwd(remote_path)
-    with open(filename_no_path, 'rb') as f:
-        ftp.storbinary('STOR %s' % filename_no_path, f)
-    ftp.quit()
-    os.chdir(curr_dir)
+    filename_no_path = os.path.basename(filename)
+    with ftp_session(server, user, password) as ftp:
+        ftp.cwd(remote_path)
+        with open(filename, 'rb') as f:
+            ftp.storbinary('STOR %s' % filename_no_path, f)
     return
 
+def upload_ftp_many(files: list, server=credentials.ftp_server, user=credentials.ftp_user,
+                    password=credentials.ftp_pass, remote_path='', workers=4, check_changes=True,
+                    update_hash=True) -> list:
+    """
+    Uploads a batch of files into one FTP directory concurrently, skipping files that did not change.
+
+    Files are checked with change_tracking.has_changed first (if check_changes is True), the remaining ones are
+    uploaded by a pool of worker threads, each of which uses its own pooled FTP session.
+
+    Args:
+        files (list): Local file paths to upload.
+        server (str): The FTP server address.
+        user (str): The FTP user name.
+        password (str): The FTP password.
+        remote_path (str): The folder on the FTP server to upload into.
+        workers (int): Number of files that are uploaded in parallel.
+        check_changes (bool): Only upload files whose content changed since their hash file was last updated.
+        update_hash (bool): Update the hash file of each successfully uploaded file.
+
+    Returns:
+        list: The files that were uploaded.
+    """
+    start = time.perf_counter()
+    to_upload = [f for f in files if not check_changes or change_tracking.has_changed(f)]
+    logging.info(f'Uploading {len(to_upload)} of {len(files)} files to FTP server directory {remote_path} '
+                 f'using {workers} workers...')
+
+    def _upload(filename):
+        file_start = time.perf_counter()
+        upload_ftp(filename, server, user, password, remote_path)
+        if update_hash:
+            change_tracking.update_hash_file(filename)
+        logging.info(f'Uploaded {filename} in {time.perf_counter() - file_start:.2f}s.')
+        return filename
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        uploaded = list(executor.map(_upload, to_upload))
+    duration = time.perf_counter() - start
+    total_bytes = sum(os.path.getsize(f) for f in uploaded)
+    logging.info(f'Uploaded {len(uploaded)} files ({total_bytes / 1e6:.1f} MB) in {duration:.1f}s, '
+                 f'skipped {len(files) - len(uploaded)} unchanged files '
+                 f'({total_bytes / 1e6 / max(duration, 1e-9):.2f} MB/s).')
+    return uploaded
+
+
 # TODO: TEST THIS
 # Delete file from FTP Server
 # Retry with some delay in between if any explicitly defined error is raised
 @retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
 def delete_ftp(filename, server, user, password, remote_path):
     logging.info("Deleting " + filename + " from FTP server directory " + remote_path + '...')
-    ftp = ftplib.FTP(server)
-    ftp.login(user, password)
-    ftp.cwd(remote_path)
-    ftp.delete(filename)
-    ftp.quit()
+    with ftp_session(server, user, password) as ftp:
+        ftp.cwd(remote_path)
+        ftp.delete(filename)
     return
 
 
@@ -112,13 +137,11 @@ def delete_ftp(filename, server, user, password, remote_path):
 @retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
 def delete_dir_content_ftp(server, user, password, remote_path):
     logging.info("Deleting all files from FTP server directory " + remote_path + '...')
-    ftp = ftplib.FTP(server)
-    ftp.login(user, password)
-    ftp.cwd(remote_path)
-    files = ftp.nlst()
-    for file in files:
-        ftp.delete(file)
-    ftp.quit()
+    with ftp_session(server, user, password) as ftp:
+        ftp.cwd(remote_path)
+        files = ftp.nlst()
+        for file in files:
+            ftp.delete(file)
     return
 
 
@@ -128,50 +151,47 @@ def delete_dir_content_ftp(server, user, password, remote_path):
 @retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
 def download_ftp(files: list, server: str, user: str, password: str, remote_path: str, local_path: str, pattern: str, list_only=False) -> list:
     logging.info(f'Connecting to FTP Server "{server}" using user "{user}" in path "{remote_path}" to download file(s) "{files}" or pattern "{pattern}" to local path "{local_path}"...')
-    ftp = ftplib.FTP(server, user, password)
-    ftp.cwd(remote_path)
-    remote_files = []
-    extended_list = False
-    if len(files) > 0:
-        remote_files = files
-    elif len(pattern) > 0:
-        logging.info(f'Filtering list of files using pattern "{pattern}"...')
-        # remote_files = fnmatch.filter(ftp.nlst(), pattern)
-        ftp_dir_details = ftp.mlsd()
-        remote_files = [i for i in (list(ftp_dir_details)) if fnmatch.fnmatch(i[0], pattern)]
-        extended_list = True
-    files = []
-    if list_only:
-        logging.info(f'No download required, just file listing...')
-    for remote_file in remote_files:
-        local_file_name = os.path.join(local_path, remote_file[0] if extended_list else remote_file)
-        remote_file_name = remote_file[0] if extended_list else remote_file
-        obj = {'remote_file': remote_file_name, 'remote_path': remote_path, 'local_file': local_file_name}
-        if extended_list:
-            modified = dateutil.parser.parse(remote_file[1]['modify']).astimezone(ZoneInfo('Europe/Zurich')).isoformat()
-            obj['modified_remote'] = modified
-        files.append(obj)
-        if not list_only:
-            logging.info(f'FTP downloading file {local_file_name}...')
-            with open(local_file_name, 'wb') as f:
-                ftp.retrbinary(f"RETR {remote_file_name}", f.write)
-    ftp.quit()
+    with ftp_session(server, user, password) as ftp:
+        ftp.cwd(remote_path)
+        remote_files = []
+        extended_list = False
+        if len(files) > 0:
+            remote_files = files
+        elif len(pattern) > 0:
+            logging.info(f'Filtering list of files using pattern "{pattern}"...')
+            # remote_files = fnmatch.filter(ftp.nlst(), pattern)
+            ftp_dir_details = ftp.mlsd()
+            remote_files = [i for i in (list(ftp_dir_details)) if fnmatch.fnmatch(i[0], pattern)]
+            extended_list = True
+        files = []
+        if list_only:
+            logging.info(f'No download required, just file listing...')
+        for remote_file in remote_files:
+            local_file_name = os.path.join(local_path, remote_file[0] if extended_list else remote_file)
+            remote_file_name = remote_file[0] if extended_list else remote_file
+            obj = {'remote_file': remote_file_name, 'remote_path': remote_path, 'local_file': local_file_name}
+            if extended_list:
+                modified = dateutil.parser.parse(remote_file[1]['modify']).astimezone(ZoneInfo('Europe/Zurich')).isoformat()
+                obj['modified_remote'] = modified
+            files.append(obj)
+            if not list_only:
+                logging.info(f'FTP downloading file {local_file_name}...')
+                with open(local_file_name, 'wb') as f:
+                    ftp.retrbinary(f"RETR {remote_file_name}", f.write)
     return files
 
 
 @retry(ftp_errors_to_handle, tries=6, delay=2, backoff=1)
 def ensure_ftp_dir(server, user, password, folder):
     logging.info(f'Connecting to FTP server {server} to make sure folder {folder} exists...')
-    ftp = ftplib.FTP(server, user, password)
-    try:
-        ftp.mkd(folder)
-    except ftplib.all_errors as e:
-        if str(e).split(None, 1)[1] == "Can't create directory: File exists":
-            logging.info(f'Folder (or file with same name) exists already, doing nothing. ')
-        else:
-            raise e
-    finally:
-        ftp.quit()
+    with ftp_session(server, user, password) as ftp:
+        try:
+            ftp.mkd(folder)
+        except ftplib.error_perm as e:
+            if str(e).split(None, 1)[1] == "Can't create directory: File exists":
+                logging.info(f'Folder (or file with same name) exists already, doing nothing. ')
+            else:
+                raise e
 
 
 # Tell Opendatasoft to (re-)publish datasets
@@ -310,11 +330,24 @@ def is_embargo_over(data_file_path, embargo_file_path=None) -> bool:
     return embargo_over
 
 
-def ods_realtime_push_complete_update(df_old, df_new, id_columns, url, columns_to_compare=None, push_key=''):
-    ods_realtime_push_new_entries(df_old, df_new, id_columns, url, push_key)
-    # TODO: Find out why this does not work as expected (405 Method Not Allowed)
+def ods_realtime_push_complete_update(df_old, df_new, id_columns, url, columns_to_compare=None, push_key='',
+                                      index_file=None, debug=False):
+    """
+    Pushes the new and modified rows of df_new to the ODS realtime API, found in one pass over hashed rows.
+
+    If index_file is given, the row hashes of the last successful push are read from there (df_old may then be None)
+    and the hashes of df_new are stored there after the push. With debug=True, every changed cell is logged.
+    """
+    old_hashes = change_tracking.load_row_hashes(index_file) if index_file else None
+    if old_hashes is None and df_old is None:
+        old_hashes = pd.Series(dtype='uint64')
+    new_rows, modified_rows, _, new_hashes = change_tracking.find_row_changes(
+        df_old, df_new, id_columns, columns_to_compare, old_hashes=old_hashes, debug=debug)
+    # TODO: Find out why deleting does not work as expected (405 Method Not Allowed)
     # ods_realtime_push_delete_entries(df_old, df_new, id_columns, url, push_key)
-    ods_realtime_push_modified_entries(df_old, df_new, id_columns, url, columns_to_compare, push_key)
+    batched_ods_realtime_push(pd.concat([new_rows, modified_rows]).reset_index(drop=True), url, push_key)
+    if index_file and new_hashes is not None:
+        change_tracking.save_row_hashes(new_hashes, index_file)
 
 
 def ods_realtime_push_new_entries(df_old, df_new, id_columns, url, push_key=''):
@@ -335,16 +368,7 @@ def ods_realtime_push_modified_entries(df_old, df_new, id_columns, url, columns_
     batched_ods_realtime_push(updated_rows, url, push_key)
 
 
-def batched_ods_realtime_push(df, url, push_key='', chunk_size=1000, delete=False):
-    logging.info(f'Pushing a dataframe in chunks of size {chunk_size} to ods...')
-    df_chunks = chunked(df.index, chunk_size)
-    for df_chunk_indexes in df_chunks:
-        logging.info(f'Submitting a data chunk to ODS...')
-        df_chunk = df.iloc[df_chunk_indexes]
-        ods_realtime_push_df(df_chunk, url, push_key, delete=delete)
-
-
-def ods_realtime_push_df(df, url, push_key='', delete=False):
+def _get_ods_push_url(url, push_key='', delete=False):
     if not push_key:
         t = url.partition('?pushkey=')
         url = t[0]
@@ -353,6 +377,87 @@ def ods_realtime_push_df(df, url, push_key='', delete=False):
     # https://userguide.opendatasoft.com/l/en/article/fqwi39mrdu-keeping-data-up-to-date#deleting_data_using_the_record_id
     if delete:
         url = url.rsplit('push', 1)[0] + 'delete'
+    return url, push_key
+
+
+def _read_push_checkpoint(checkpoint_file, fingerprint) -> int:
+    """Returns the number of chunks that were acknowledged by an earlier, interrupted push of the same data."""
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return 0
+    with open(checkpoint_file, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint['fingerprint'] != fingerprint:
+        logging.info(f'Checkpoint {checkpoint_file} belongs to other data, pushing all chunks...')
+        return 0
+    logging.info(f'Resuming push after {checkpoint["acknowledged_chunks"]} acknowledged chunks...')
+    return checkpoint['acknowledged_chunks']
+
+
+def _write_push_checkpoint(checkpoint_file, fingerprint, acknowledged_chunks):
+    tmp_file = f'{checkpoint_file}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'acknowledged_chunks': acknowledged_chunks}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def batched_ods_realtime_push(df, url, push_key='', chunk_size=1000, delete=False, max_in_flight=1,
+                              checkpoint_file=None):
+    """
+    Pushes a dataframe to the ODS realtime API in chunks, with up to max_in_flight requests on the shared session.
+
+    Every chunk is retried with exponential backoff on its own (see http_session.send). If checkpoint_file is given,
+    the number of chunks acknowledged in order is stored there, and a later call with the same data and chunk size
+    resumes after them. The checkpoint is removed once all chunks are pushed. Chunks in flight at the same time can be
+    applied by ODS in any order, so only raise max_in_flight if no key occurs in more than one chunk.
+    """
+    url, push_key = _get_ods_push_url(url, push_key, delete)
+    n_chunks = math.ceil(len(df) / chunk_size)
+    fingerprint = None
+    if checkpoint_file:
+        fingerprint = f'{url}|{chunk_size}|{len(df)}|{int(pd.util.hash_pandas_object(df, index=False).sum())}'
+    first_chunk = _read_push_checkpoint(checkpoint_file, fingerprint)
+    logging.info(f'Pushing {n_chunks - first_chunk} chunks of size {chunk_size} to ODS '
+                 f'with {max_in_flight} requests in flight...')
+
+    def _push_chunk(i):
+        payload = df.iloc[i * chunk_size:(i + 1) * chunk_size].to_json(orient='records')
+        # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
+        http_session.send('DELETE' if delete else 'POST', url, data=payload, params={'pushkey': push_key})
+        return i, len(payload)
+
+    start = time.perf_counter()
+    pushed_rows, pushed_bytes = 0, 0
+    acknowledged = set()
+    acknowledged_in_order = first_chunk
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [executor.submit(_push_chunk, i) for i in range(first_chunk, n_chunks)]
+        try:
+            for future in as_completed(futures):
+                i, n_bytes = future.result()
+                pushed_rows += min(chunk_size, len(df) - i * chunk_size)
+                pushed_bytes += n_bytes
+                acknowledged.add(i)
+                while acknowledged_in_order in acknowledged:
+                    acknowledged_in_order += 1
+                if checkpoint_file:
+                    _write_push_checkpoint(checkpoint_file, fingerprint, acknowledged_in_order)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    duration = max(time.perf_counter() - start, 1e-9)
+    logging.info(f'Pushed {pushed_rows} rows ({pushed_bytes / 1e6:.2f} MB) in {duration:.1f}s: '
+                 f'{pushed_rows / duration:.0f} rows/s, {pushed_bytes / 1e6 / duration:.2f} MB/s.')
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+def ods_realtime_push_df(df, url, push_key='', delete=False, batched=False, chunk_size=1000, max_in_flight=1,
+                         checkpoint_file=None):
+    if batched:
+        return batched_ods_realtime_push(df, url, push_key, chunk_size=chunk_size, delete=delete,
+                                         max_in_flight=max_in_flight, checkpoint_file=checkpoint_file)
+    url, push_key = _get_ods_push_url(url, push_key, delete)
     row_count = len(df)
     if row_count == 0:
         logging.info(f"No rows to {'delete' if delete else 'push'} to ODS... ")
@@ -418,18 +523,17 @@ def email_message(subject="Python Notification", text="", img=None, attachment=N
 def rename_ftp(from_name, to_name, server, user, password):
     file = os.path.basename(from_name)
     folder = os.path.dirname(from_name)
-    ftp = ftplib.FTP(server, user, password)
-    logging.info(f'Changing to remote dir {folder}...')
-    ftp.cwd(folder)
-    logging.info('Searching for file to rename or move...')
-    moved = False
-    for remote_file, facts in ftp.mlsd():
-        if file == remote_file:
-            logging.info(f'Moving file to {to_name}...')
-            ftp.rename(file, to_name)
-            moved = True
-            break
-    ftp.quit()
+    with ftp_session(server, user, password) as ftp:
+        logging.info(f'Changing to remote dir {folder}...')
+        ftp.cwd(folder)
+        logging.info('Searching for file to rename or move...')
+        moved = False
+        for remote_file, facts in ftp.mlsd():
+            if file == remote_file:
+                logging.info(f'Moving file to {to_name}...')
+                ftp.rename(file, to_name)
+                moved = True
+                break
     if not moved:
         logging.error(f'File to rename on FTP not found: {file}...')
         raise FileNotFoundError(file)
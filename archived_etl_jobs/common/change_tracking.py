@@ -1,8 +1,11 @@
+import json
 import logging
 import pathlib
+import sqlite3
 import urllib3
+import zlib
 from hashlib import blake2b
-from filehash import FileHash
+from more_itertools import chunked
 import os
 import time
 import pandas as pd
@@ -10,23 +13,84 @@ from common.retry import retry
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Files are hashed in chunks of this size
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+# A stored size / mtime is only trusted if the file had been modified at least this long before it was hashed.
+# Otherwise, the file might have been written again within the timestamp resolution of the file system.
+RACY_WINDOW_NS = 2 * 10 ** 9
+# Hash states computed in this process, so that has_changed() followed by update_hash_file() reads the file once
+_computed_states = {}
+
 
 def get_check_file_dir() -> str:
     curr_dir = os.path.dirname(os.path.realpath(__file__))
     return os.path.join(curr_dir, 'change_tracking')
 
 
+def _get_file_stat(file_name) -> dict:
+    stat = os.stat(file_name)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'ctime_ns': stat.st_ctime_ns, 'inode': stat.st_ino}
+
+
+def hash_file_streaming(file_name, with_crc32=False) -> tuple:
+    """Returns the blake2b hex digest (and the legacy crc32 hex string if requested) of a file in one pass."""
+    hasher = blake2b(digest_size=16)
+    crc32 = 0
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_name, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            hasher.update(view[:n])
+            if with_crc32:
+                crc32 = zlib.crc32(view[:n], crc32)
+    return hasher.hexdigest(), format(crc32 & 0xffffffff, '08x') if with_crc32 else None
+
+
+def get_file_state(file_name, with_crc32=False) -> dict:
+    """Returns size, mtime and content hash of a file, reusing a state computed earlier in this process."""
+    current_stat = _get_file_stat(file_name)
+    state = _computed_states.get(file_name)
+    if state and all(state[k] == v for k, v in current_stat.items()) and (state['crc32'] or not with_crc32):
+        return state
+    logging.info(f'Calculating hash of file {file_name}...')
+    checked_ns = time.time_ns()
+    file_hash, crc32 = hash_file_streaming(file_name, with_crc32=with_crc32)
+    state = {**current_stat, 'checked_ns': checked_ns, 'hash': file_hash, 'crc32': crc32}
+    _computed_states[file_name] = state
+    return state
+
+
+def read_state_file(state_file_name) -> dict:
+    if not os.path.exists(state_file_name):
+        return {}
+    with open(state_file_name, 'r') as f:
+        return json.load(f)
+
+
+def write_state_file(file_name, state_file_name, state) -> None:
+    pathlib.Path(os.path.dirname(state_file_name)).mkdir(parents=True, exist_ok=True)
+    content = {'file': file_name, 'algorithm': 'blake2b', 'size': state['size'], 'mtime_ns': state['mtime_ns'],
+               'checked_ns': state['checked_ns'], 'hash': state['hash']}
+    tmp_file_name = f'{state_file_name}.tmp'
+    with open(tmp_file_name, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp_file_name, state_file_name)
+
+
+def read_legacy_sfv_hash(sfv_file_name) -> str:
+    with open(sfv_file_name, 'r') as f:
+        line = f.readline().strip()
+    return line.rsplit(' ', 1)[-1].lower()
+
+
 def update_hash_file(file_name, sfv_file_name='') -> str:
     if not sfv_file_name:
         sfv_file_name = get_check_file(file_name, get_check_file_dir())
-    # logging.info(f'Ensuring that hash file path exists...')
-    pathlib.Path(os.path.dirname(sfv_file_name)).mkdir(parents=True, exist_ok=True)
-    with open(sfv_file_name, 'w') as f:
-        logging.info(f'Calculating hash of file {file_name} and writing to sfv file {sfv_file_name}...')
-        crc32_hasher = FileHash(hash_algorithm='crc32')
-        file_hash = crc32_hasher.hash_file(file_name)
-        f.write(f'{file_name} {file_hash}')
-    return file_hash
+    state_file_name = os.path.splitext(sfv_file_name)[0] + '.json'
+    state = get_file_state(file_name)
+    logging.info(f'Writing hash of file {file_name} to check file {state_file_name}...')
+    write_state_file(file_name, state_file_name, state)
+    return state['hash']
 
 
 def update_mod_timestamp_file(file_name, check_file_name='') -> str:
@@ -65,6 +129,42 @@ def get_check_file(filename, folder='', extension='sfv') -> str:
     return check_filename
 
 
+def _compare_with_stored(filename, stored, legacy_crc32=None) -> tuple:
+    """Returns (changed, state). state is None if the stored size / mtime could be trusted without hashing."""
+    if stored and stored.get('hash'):
+        current_stat = _get_file_stat(filename)
+        stat_unchanged = stored['size'] == current_stat['size'] and stored['mtime_ns'] == current_stat['mtime_ns']
+        if stat_unchanged and stored['mtime_ns'] + RACY_WINDOW_NS < stored['checked_ns']:
+            logging.info(f'Size and modification time of {filename} match the stored state, no changes detected.')
+            return False, None
+        state = get_file_state(filename)
+        return state['hash'] != stored['hash'], state
+    if legacy_crc32:
+        logging.info(f'Comparing {filename} with legacy crc32 check number...')
+        state = get_file_state(filename, with_crc32=True)
+        return state['crc32'] != legacy_crc32, state
+    logging.info(f'No stored state for {filename}.')
+    return True, None
+
+
+def _has_changed_hash(filename, hash_file_dir, do_update_hash_file) -> bool:
+    state_file_name = get_check_file(filename, hash_file_dir, extension='json')
+    sfv_file_name = get_check_file(filename, hash_file_dir, extension='sfv')
+    stored = read_state_file(state_file_name)
+    legacy_crc32 = read_legacy_sfv_hash(sfv_file_name) if not stored and os.path.exists(sfv_file_name) else None
+    changed, state = _compare_with_stored(filename, stored, legacy_crc32)
+    if changed:
+        logging.info(f'Check numbers do not match, file has changed.')
+        if do_update_hash_file:
+            write_state_file(filename, state_file_name, state or get_file_state(filename))
+        return True
+    if state is not None:
+        # Content is the same: store the current size / mtime (and migrate legacy sfv files) to skip hashing next time
+        logging.info(f'Check numbers match, no changes detected.')
+        write_state_file(filename, state_file_name, state)
+    return False
+
+
 @retry(OSError, tries=6, delay=600, backoff=1)
 def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, method='hash') -> bool:
     if not os.path.exists(filename):
@@ -75,8 +175,9 @@ def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, meth
     if not hash_file_dir:
         # logging.debug(f'Using default hash_file_dir {get_hash_file_dir()}...')
         hash_file_dir = get_check_file_dir()
-    check_file_extension = 'sfv' if method == 'hash' else 'txt'
-    check_filename = get_check_file(filename, hash_file_dir, extension=check_file_extension)
+    if method == 'hash':
+        return _has_changed_hash(filename, hash_file_dir, do_update_hash_file)
+    check_filename = get_check_file(filename, hash_file_dir, extension='txt')
     if not os.path.exists(check_filename):
         logging.info(f'Check file does not exist.')
         if do_update_hash_file:
@@ -84,10 +185,7 @@ def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, meth
         return True
     logging.info(f'Check file exists, checking for changes using method "{method}" and check file {check_filename}...')
     check_numbers_differ = True
-    if method == 'hash':
-        crc32_hasher = FileHash(hash_algorithm='crc32')
-        check_numbers_differ = not crc32_hasher.verify_sfv(sfv_filename=check_filename)[0].hashes_match
-    elif method == 'modification_date':
+    if method == 'modification_date':
         with open(check_filename, 'r') as f:
             lines = f.readlines()
         time_string = lines[0]
@@ -110,6 +208,105 @@ def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, meth
         return False
 
 
+def has_changed_and_update(filename: str, hash_file_dir='') -> bool:
+    """Checks a file for changes and stores its new state in the same call, reading the file at most once."""
+    return has_changed(filename, hash_file_dir=hash_file_dir, do_update_hash_file=True, method='hash')
+
+
+def get_manifest_file(hash_file_dir='') -> str:
+    return os.path.join(hash_file_dir or get_check_file_dir(), 'manifest.sqlite')
+
+
+def open_manifest(hash_file_dir='') -> sqlite3.Connection:
+    """
+    Opens the change tracking manifest of a job: one SQLite file holding the state of every tracked file.
+
+    If the manifest does not exist yet, the per-file check files (.json and legacy .sfv) found in hash_file_dir are
+    imported, so that switching to the manifest does not report any file as changed.
+    """
+    manifest_file = get_manifest_file(hash_file_dir)
+    is_new = not os.path.exists(manifest_file)
+    pathlib.Path(os.path.dirname(manifest_file)).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(manifest_file, timeout=60)
+    # Exclusive locking lets WAL work without a shared-memory index, which is unreliable on network file systems
+    conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                 'checked_ns INTEGER, hash TEXT, crc32 TEXT)')
+    if is_new:
+        import_check_files(conn, hash_file_dir or get_check_file_dir())
+    return conn
+
+
+def import_check_files(conn, hash_file_dir) -> int:
+    """Imports the per-file check files of hash_file_dir into the manifest, without hashing any data file."""
+    rows = []
+    for entry in os.scandir(hash_file_dir) if os.path.isdir(hash_file_dir) else []:
+        if entry.name.endswith('.json'):
+            state = read_state_file(entry.path)
+            rows.append((state['file'], state['size'], state['mtime_ns'], state['checked_ns'], state['hash'], None))
+        elif entry.name.endswith('.sfv'):
+            with open(entry.path, 'r') as f:
+                file_name, _, crc32 = f.readline().strip().rpartition(' ')
+            rows.append((file_name, None, None, None, None, crc32.lower()))
+    logging.info(f'Importing {len(rows)} check files from {hash_file_dir} into the change tracking manifest...')
+    with conn:
+        # Legacy rows are inserted first, so that a JSON state of the same file replaces them
+        rows.sort(key=lambda row: row[4] is not None)
+        conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def _upsert_states(conn, states: dict) -> None:
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, NULL)',
+                         [(f, s['size'], s['mtime_ns'], s['checked_ns'], s['hash']) for f, s in states.items()])
+
+
+def has_changed_many(filenames: list, hash_file_dir='') -> list:
+    """
+    Checks a batch of files against the change tracking manifest and returns the ones that changed.
+
+    Files whose content is unchanged but whose size / mtime moved get their stored state refreshed, so they are not
+    hashed again next time. Changed files are only recorded by commit_many(), e.g. after a successful upload.
+    """
+    for filename in filenames:
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f'File does not exist: {filename}')
+    conn = open_manifest(hash_file_dir)
+    try:
+        stored_states = {}
+        for chunk in chunked(filenames, 500):
+            cursor = conn.execute(f'SELECT * FROM files WHERE file IN ({",".join("?" * len(chunk))})', chunk)
+            columns = [c[0] for c in cursor.description]
+            stored_states.update({row[0]: dict(zip(columns, row)) for row in cursor})
+        changed_files = []
+        refreshed_states = {}
+        for filename in filenames:
+            stored = stored_states.get(filename, {})
+            changed, state = _compare_with_stored(filename, stored, stored.get('crc32'))
+            if changed:
+                changed_files.append(filename)
+            elif state is not None:
+                refreshed_states[filename] = state
+        _upsert_states(conn, refreshed_states)
+    finally:
+        conn.close()
+    logging.info(f'{len(changed_files)} of {len(filenames)} files have changed.')
+    return changed_files
+
+
+def commit_many(filenames: list, hash_file_dir='') -> None:
+    """Stores the current state of a batch of files in the change tracking manifest in one transaction."""
+    states = {filename: get_file_state(filename) for filename in filenames}
+    conn = open_manifest(hash_file_dir)
+    try:
+        _upsert_states(conn, states)
+    finally:
+        conn.close()
+
+
 def find_new_rows(df_old, df_new, id_columns):
     # Find new rows by checking for rows in df_new that are not in df_old
     merged = pd.merge(df_old[id_columns], df_new, on=id_columns, how='right', indicator=True)
@@ -119,7 +316,7 @@ def find_new_rows(df_old, df_new, id_columns):
     return new_rows
 
 
-def find_modified_rows(df_old, df_new, id_columns, columns_to_compare=None):
+def find_modified_rows(df_old, df_new, id_columns, columns_to_compare=None, debug=False):
     if columns_to_compare is None:
         columns_to_compare = [col for col in df_new.columns if col not in id_columns]
     # Merge the dataframes on the id columns
@@ -164,6 +361,8 @@ def find_modified_rows(df_old, df_new, id_columns, columns_to_compare=None):
         columns={f'{col}_new': col for col in columns_to_compare})
     logging.info(f'Updated rows:')
     logging.info(updated_rows)
+    if not debug:
+        return deprecated_rows, updated_rows
     # Print detailed changes for debugging
     for idx, row in modified_rows.iterrows():
         row_id = row[id_columns] if isinstance(id_columns, str) else tuple(row[id_columns])
@@ -185,3 +384,102 @@ def find_deleted_rows(df_old, df_new, id_columns):
     logging.info(f'Found {len(deleted_rows)} deleted rows:')
     logging.info(deleted_rows)
     return deleted_rows
+
+
+def _canonical_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _canonical_strings(col: pd.Series) -> pd.Series:
+    """Renders col as strings, so that e.g. 1 and 1.0 or a missing value hash the same in every dtype."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype(object)
+    if pd.api.types.is_float_dtype(col):
+        strings = col.astype(str)
+        integral = col.notna() & (col % 1 == 0) & (col.abs() < 2 ** 63)
+        strings[integral] = col[integral].astype('int64').astype(str)
+    elif col.dtype == object:
+        strings = col.map(_canonical_value)
+    else:
+        strings = col.astype(str)
+    return strings.mask(col.isna(), '<NA>')
+
+
+def _key_index(df, id_columns) -> pd.Index:
+    if len(id_columns) == 1:
+        return pd.Index(df[id_columns[0]])
+    return pd.MultiIndex.from_frame(df[id_columns])
+
+
+def has_unique_keys(df, id_columns) -> bool:
+    id_columns = [id_columns] if isinstance(id_columns, str) else list(id_columns)
+    return not df.duplicated(subset=id_columns).any()
+
+
+def hash_rows(df, id_columns, columns_to_compare=None) -> pd.Series:
+    """Returns one uint64 hash per row over columns_to_compare, indexed by the id columns."""
+    id_columns = [id_columns] if isinstance(id_columns, str) else list(id_columns)
+    if columns_to_compare is None:
+        columns_to_compare = [col for col in df.columns if col not in id_columns]
+    canonical = pd.DataFrame({col: _canonical_strings(df[col]) for col in columns_to_compare}, index=df.index)
+    row_hashes = pd.util.hash_pandas_object(canonical, index=False)
+    row_hashes.index = _key_index(df, id_columns)
+    if not row_hashes.index.is_unique:
+        raise ValueError(f'Id columns {id_columns} do not identify rows uniquely.')
+    return row_hashes
+
+
+def diff_row_hashes(old_hashes: pd.Series, new_hashes: pd.Series) -> tuple:
+    """Compares two results of hash_rows() and returns the new, modified and deleted keys."""
+    in_old = new_hashes.index.isin(old_hashes.index)
+    new_keys = new_hashes.index[~in_old]
+    deleted_keys = old_hashes.index[~old_hashes.index.isin(new_hashes.index)]
+    common_hashes = new_hashes[in_old]
+    modified_keys = common_hashes.index[common_hashes.values != old_hashes.reindex(common_hashes.index).values]
+    logging.info(f'Found {len(new_keys)} new, {len(modified_keys)} modified and {len(deleted_keys)} deleted rows.')
+    return new_keys, modified_keys, deleted_keys
+
+
+def load_row_hashes(index_file):
+    """Loads the row hashes persisted by save_row_hashes(), or returns None if there are none yet."""
+    if not os.path.exists(index_file):
+        return None
+    return pd.read_pickle(index_file)
+
+
+def save_row_hashes(row_hashes: pd.Series, index_file) -> None:
+    pathlib.Path(os.path.dirname(index_file)).mkdir(parents=True, exist_ok=True)
+    tmp_file = f'{index_file}.tmp'
+    row_hashes.to_pickle(tmp_file)
+    os.replace(tmp_file, index_file)
+
+
+def find_row_changes(df_old, df_new, id_columns, columns_to_compare=None, old_hashes=None, debug=False) -> tuple:
+    """
+    Finds new, modified and deleted rows of df_new compared to df_old in one pass over hashed rows.
+
+    Either df_old or old_hashes (e.g. from load_row_hashes()) has to be given. Returns the new rows and the
+    modified rows (both with the values of df_new), the deleted keys and the row hashes of df_new, which can be
+    persisted with save_row_hashes() for the next run. With debug=True, every changed cell is logged.
+    If the id columns do not identify rows uniquely, the rows are compared with find_new_rows() and
+    find_modified_rows() instead, and the returned row hashes are None.
+    """
+    if df_old is not None and not (has_unique_keys(df_new, id_columns) and has_unique_keys(df_old, id_columns)):
+        logging.info(f'Id columns {id_columns} do not identify rows uniquely, comparing rows by merging...')
+        id_columns = [id_columns] if isinstance(id_columns, str) else list(id_columns)
+        new_rows = find_new_rows(df_old, df_new, id_columns)
+        _, modified_rows = find_modified_rows(df_old, df_new, id_columns, columns_to_compare, debug=debug)
+        deleted_keys = _key_index(find_deleted_rows(df_old, df_new, id_columns), id_columns)
+        return new_rows, modified_rows, deleted_keys, None
+    new_hashes = hash_rows(df_new, id_columns, columns_to_compare)
+    if old_hashes is None:
+        old_hashes = hash_rows(df_old, id_columns, columns_to_compare)
+    new_keys, modified_keys, deleted_keys = diff_row_hashes(old_hashes, new_hashes)
+    new_rows = df_new[new_hashes.index.isin(new_keys)]
+    modified_rows = df_new[new_hashes.index.isin(modified_keys)]
+    if debug and df_old is not None:
+        old_rows = df_old[hash_rows(df_old, id_columns, columns_to_compare).index.isin(modified_keys)]
+        find_modified_rows(old_rows, modified_rows, id_columns, columns_to_compare, debug=True)
+    return new_rows, modified_rows, deleted_keys, new_hashes
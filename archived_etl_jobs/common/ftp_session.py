@@ -0,0 +1,99 @@
+import atexit
+import ftplib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class FtpSessionPool:
+    """Keeps authenticated FTP connections open per (server, user), so that a batch of FTP calls shares one login.
+
+    Idle connections older than keepalive_after seconds are probed with a NOOP before they are handed out again,
+    connections that raised an FTP error are dropped so that the next call (e.g. a retry) reconnects.
+    """
+
+    def __init__(self, max_idle_per_key=4, keepalive_after=30):
+        self.max_idle_per_key = max_idle_per_key
+        self.keepalive_after = keepalive_after
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, server, user, password):
+        ftp = self._acquire(server, user, password)
+        try:
+            yield ftp
+        except BaseException:
+            self._discard(ftp)
+            raise
+        else:
+            self._release((server, user), ftp)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for ftp in connections:
+                self._discard(ftp)
+
+    def _acquire(self, server, user, password):
+        key = (server, user)
+        while True:
+            with self._lock:
+                connections = self._idle.get(key, [])
+                ftp = connections.pop() if connections else None
+            if ftp is None:
+                return self._connect(server, user, password)
+            if self._is_alive(ftp):
+                return ftp
+            logging.info(f'Idle FTP session to "{server}" is no longer alive, reconnecting...')
+            self._discard(ftp)
+
+    def _release(self, key, ftp):
+        try:
+            # Reset the working directory so the next caller starts from the login directory again
+            ftp.cwd(ftp.home_dir)
+        except ftplib.all_errors:
+            self._discard(ftp)
+            return
+        ftp.last_used = time.monotonic()
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_key:
+                connections.append(ftp)
+                return
+        self._discard(ftp)
+
+    def _is_alive(self, ftp):
+        if time.monotonic() - ftp.last_used < self.keepalive_after:
+            return True
+        try:
+            ftp.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
+            return False
+
+    @staticmethod
+    def _connect(server, user, password):
+        logging.info(f'Opening FTP session to server "{server}" as user "{user}"...')
+        ftp = ftplib.FTP(server, user, password)
+        ftp.home_dir = ftp.pwd()
+        ftp.last_used = time.monotonic()
+        return ftp
+
+    @staticmethod
+    def _discard(ftp):
+        try:
+            ftp.quit()
+        except ftplib.all_errors:
+            ftp.close()
+
+
+pool = FtpSessionPool()
+atexit.register(pool.close)
+
+
+def ftp_session(server, user, password):
+    """Context manager yielding a pooled, logged-in ftplib.FTP object positioned in the login directory."""
+    return pool.session(server, user, password)
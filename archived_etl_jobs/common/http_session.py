@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import pathlib
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from common import credentials
+
+# Status codes worth retrying: the request may well succeed later. Other 4xx errors are raised right away.
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+retryable_exceptions = requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionResetError
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide session, which keeps connections alive and pools up to 10 connections per host."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=20, pool_maxsize=10)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def _backoff_delay(attempt, base_delay, max_delay) -> float:
+    # Exponential backoff with full jitter, so that parallel clients do not retry in lockstep
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def _retry_after_delay(response, max_delay):
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return min(max_delay, int(retry_after))
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return min(max_delay, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+
+
+def _get_cache_files(cache_dir, url, params) -> tuple:
+    key = blake2b(f'{url}|{json.dumps(params, sort_keys=True, default=str)}'.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'{key}.json'), os.path.join(cache_dir, f'{key}.body')
+
+
+def _read_cached_response(cache_dir, url, params):
+    meta_file, body_file = _get_cache_files(cache_dir, url, params)
+    if not (os.path.exists(meta_file) and os.path.exists(body_file)):
+        return None
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    with open(body_file, 'rb') as f:
+        body = f.read()
+    if meta.get('body_hash') != blake2b(body).hexdigest():
+        # The body and meta file of different responses, e.g. after an interrupted write
+        return None
+    r = requests.Response()
+    r.status_code = 200
+    r._content = body
+    r.headers = CaseInsensitiveDict(meta['headers'])
+    r.encoding = meta['encoding']
+    r.url = meta['url']
+    return r
+
+
+def _replace_file(file_name, content, mode) -> None:
+    tmp_file = f'{file_name}.tmp'
+    with open(tmp_file, mode) as f:
+        f.write(content)
+    os.replace(tmp_file, file_name)
+
+
+def _write_cached_response(cache_dir, url, params, response):
+    if not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+        return
+    meta_file, body_file = _get_cache_files(cache_dir, url, params)
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    meta = {
+        'url': response.url,
+        'encoding': response.encoding,
+        'headers': dict(response.headers),
+        'body_hash': blake2b(response.content).hexdigest(),
+    }
+    _replace_file(body_file, response.content, 'wb')
+    _replace_file(meta_file, json.dumps(meta), 'w')
+
+
+def send(method, url, cache_dir=None, tries=6, base_delay=2, max_delay=120, **kwargs) -> requests.Response:
+    """
+    Sends a request over the shared session, retrying transient failures with exponential backoff and jitter.
+
+    Connection errors, timeouts and the status codes in RETRYABLE_STATUS_CODES are retried, honouring a Retry-After
+    header; any other error status is raised immediately. If cache_dir is given for a GET request, the response is
+    stored there and revalidated with If-None-Match / If-Modified-Since next time; a 304 returns the cached body.
+    """
+    kwargs.setdefault('proxies', credentials.proxies)
+    use_cache = cache_dir is not None and method.upper() == 'GET' and not kwargs.get('stream')
+    cached = _read_cached_response(cache_dir, url, kwargs.get('params')) if use_cache else None
+    if cached is not None:
+        headers = dict(kwargs.get('headers') or {})
+        if cached.headers.get('ETag'):
+            headers['If-None-Match'] = cached.headers['ETag']
+        if cached.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        kwargs['headers'] = headers
+    session = get_session()
+    for attempt in range(1, tries + 1):
+        try:
+            r = session.request(method, url, **kwargs)
+        except retryable_exceptions as e:
+            if attempt == tries:
+                raise
+            delay = _backoff_delay(attempt, base_delay, max_delay)
+            logging.warning(f'{method} {url} failed with "{e}", retrying in {delay:.1f} seconds...')
+        else:
+            if r.status_code == 304 and cached is not None:
+                logging.info(f'{url} has not been modified, using cached response...')
+                return cached
+            if r.status_code not in RETRYABLE_STATUS_CODES or attempt == tries:
+                r.raise_for_status()
+                if use_cache:
+                    _write_cached_response(cache_dir, url, kwargs.get('params'), r)
+                return r
+            delay = _retry_after_delay(r, max_delay)
+            if delay is None:
+                delay = _backoff_delay(attempt, base_delay, max_delay)
+            logging.warning(f'{method} {url} returned status {r.status_code}, retrying in {delay:.1f} seconds...')
+        time.sleep(delay)
@@ -8,6 +8,7 @@ import common.change_tracking as ct
 import pytest
 import common
 import time
+import zlib
 import pandas as pd
 
 CURR_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -100,6 +101,55 @@ def test_changed_file_timestamp(text_file):
     assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR, method='modification_date')
 
 
+def test_has_changed_and_update(text_file):
+    assert ct.has_changed_and_update(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert not ct.has_changed_and_update(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    with open(text_file, 'a') as f:
+        f.write(f'{datetime.now()}_Hello World! \n')
+    assert ct.has_changed_and_update(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+
+
+def test_legacy_sfv_file_is_not_reported_as_changed(text_file):
+    # Check files written by earlier versions contain "<file name> <crc32>"
+    with open(text_file, 'rb') as f:
+        crc32 = format(zlib.crc32(f.read()) & 0xffffffff, '08x')
+    sfv_file = ct.get_check_file(text_file, CHANGE_TRACKING_DIR)
+    pathlib.Path(CHANGE_TRACKING_DIR).mkdir(parents=True, exist_ok=True)
+    with open(sfv_file, 'w') as f:
+        f.write(f'{text_file} {crc32}')
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert os.path.exists(ct.get_check_file(text_file, CHANGE_TRACKING_DIR, extension='json'))
+
+
+def test_unchanged_stat_skips_hashing(text_file, monkeypatch):
+    an_hour_ago = time.time_ns() - 3600 * 10 ** 9
+    os.utime(text_file, ns=(an_hour_ago, an_hour_ago))
+    assert ct.has_changed_and_update(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('File should not be hashed')
+    monkeypatch.setattr(ct, 'hash_file_streaming', fail)
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+
+
+def test_has_changed_many(tmp_path):
+    files = []
+    for i in range(3):
+        file_path = os.path.join(tmp_path, f'test-{i}.txt')
+        with open(file_path, 'w') as f:
+            f.write(f'{datetime.now()}: Hello World {i}!')
+        files.append(file_path)
+    # A file tracked with a per-file check file before the manifest existed is imported, not reported as changed
+    ct.has_changed_and_update(files[0], hash_file_dir=CHANGE_TRACKING_DIR)
+    assert ct.has_changed_many(files, hash_file_dir=CHANGE_TRACKING_DIR) == files[1:]
+    ct.commit_many(files[1:], hash_file_dir=CHANGE_TRACKING_DIR)
+    assert ct.has_changed_many(files, hash_file_dir=CHANGE_TRACKING_DIR) == []
+    with open(files[2], 'a') as f:
+        f.write(f'{datetime.now()}_Hello World! \n')
+    assert ct.has_changed_many(files, hash_file_dir=CHANGE_TRACKING_DIR) == [files[2]]
+
+
 def create_df(id_values, value_values, index=None):
     return pd.DataFrame({'id': id_values, 'value': value_values}, index=index)
 
@@ -152,3 +202,50 @@ def test_find_deleted_rows():
 
     with pytest.raises(KeyError):
         ct.find_deleted_rows(df_old, df_new, ['non_existent_column'])
+
+
+def test_find_row_changes(tmp_path):
+    df_old = create_df(['1', '2', '3'], ['a', 'b', 'c'])
+    df_new = create_df(['2', '3', '4'], ['b', 'x', 'd'])
+    new_rows, modified_rows, deleted_keys, new_hashes = ct.find_row_changes(df_old, df_new, ['id'])
+    pd.testing.assert_frame_equal(new_rows, create_df(['4'], ['d'], index=[2]))
+    pd.testing.assert_frame_equal(modified_rows, create_df(['3'], ['x'], index=[1]))
+    assert list(deleted_keys) == ['1']
+
+    index_file = os.path.join(tmp_path, 'row_hashes.pkl')
+    ct.save_row_hashes(new_hashes, index_file)
+    new_rows, modified_rows, deleted_keys, _ = ct.find_row_changes(None, df_new, ['id'],
+                                                                   old_hashes=ct.load_row_hashes(index_file))
+    assert new_rows.empty and modified_rows.empty and deleted_keys.empty
+
+    with pytest.raises(ValueError):
+        ct.hash_rows(create_df(['1', '1'], ['a', 'b']), ['id'])
+
+
+
+def test_find_row_changes_ignores_dtype_changes():
+    df_old = pd.DataFrame({'id': ['1', '2', '3'], 'v': [1.0, 2.0, None], 'w': ['a', None, 'c']})
+    df_new = pd.DataFrame({'id': ['1', '2', '3'], 'v': pd.array([1, 2, None], dtype='Int64'), 'w': ['a', None, 'c']})
+    new_rows, modified_rows, deleted_keys, _ = ct.find_row_changes(df_old, df_new, ['id'])
+    _, updated_rows = ct.find_modified_rows(df_old, df_new, ['id'])
+    assert new_rows.empty and modified_rows.empty and deleted_keys.empty
+    assert updated_rows.empty
+
+    df_new['w'] = pd.Categorical(df_new['w'])
+    pd.testing.assert_series_equal(ct.hash_rows(df_new, ['id']), ct.hash_rows(df_old, ['id']))
+
+    df_new = pd.DataFrame({'id': ['1', '2', '3'], 'v': [1, 3, None], 'w': ['a', None, 'c']})
+    _, modified_rows, _, _ = ct.find_row_changes(df_old, df_new, ['id'])
+    assert list(modified_rows['id']) == ['2']
+
+
+def test_find_row_changes_with_duplicate_keys():
+    df_old = create_df(['1', '1', '2'], ['a', 'b', 'c'])
+    df_new = create_df(['1', '1', '2', '3'], ['a', 'b', 'x', 'd'])
+    new_rows, modified_rows, deleted_keys, new_hashes = ct.find_row_changes(df_old, df_new, ['id'])
+    _, expected_modified_rows = ct.find_modified_rows(df_old, df_new, ['id'])
+    pd.testing.assert_frame_equal(new_rows, ct.find_new_rows(df_old, df_new, ['id']))
+    pd.testing.assert_frame_equal(modified_rows, expected_modified_rows)
+    assert list(new_rows['id']) == ['3']
+    assert deleted_keys.empty
+    assert new_hashes is None
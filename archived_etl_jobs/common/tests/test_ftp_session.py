@@ -0,0 +1,76 @@
+import ftplib
+
+import pytest
+
+from common.ftp_session import FtpSessionPool
+
+
+class FakeFTP:
+    instances = []
+
+    def __init__(self, server, user, password):
+        self.server = server
+        self.cwd_calls = []
+        self.closed = False
+        FakeFTP.instances.append(self)
+
+    def pwd(self):
+        return '/'
+
+    def cwd(self, path):
+        self.cwd_calls.append(path)
+
+    def voidcmd(self, cmd):
+        if self.closed:
+            raise EOFError()
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeFTP.instances = []
+    monkeypatch.setattr(ftplib, 'FTP', FakeFTP)
+    pool = FtpSessionPool(keepalive_after=0)
+    yield pool
+    pool.close()
+
+
+def test_session_is_reused(pool):
+    with pool.session('server', 'user', 'pass') as ftp:
+        ftp.cwd('folder_a')
+    with pool.session('server', 'user', 'pass') as ftp:
+        ftp.cwd('folder_b')
+    assert len(FakeFTP.instances) == 1
+    # Working directory is reset to the login directory between uses
+    assert FakeFTP.instances[0].cwd_calls == ['folder_a', '/', 'folder_b', '/']
+
+
+def test_sessions_are_separated_by_user(pool):
+    with pool.session('server', 'user_1', 'pass'):
+        pass
+    with pool.session('server', 'user_2', 'pass'):
+        pass
+    assert len(FakeFTP.instances) == 2
+
+
+def test_session_is_dropped_after_error(pool):
+    with pytest.raises(ftplib.error_temp):
+        with pool.session('server', 'user', 'pass'):
+            raise ftplib.error_temp('421 Service not available')
+    with pool.session('server', 'user', 'pass'):
+        pass
+    assert len(FakeFTP.instances) == 2
+    assert FakeFTP.instances[0].closed
+
+
+def test_dead_session_is_replaced(pool):
+    with pool.session('server', 'user', 'pass') as ftp:
+        pass
+    ftp.closed = True
+    with pool.session('server', 'user', 'pass') as ftp:
+        assert ftp is FakeFTP.instances[1]
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+import requests
+
+from common import http_session
+
+URL = 'https://data.bs.ch/api/records/1.0/download?dataset=100231'
+
+
+def create_response(status_code, body=b'', headers=None):
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = body
+    r.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    r.url = URL
+    r.encoding = 'utf-8'
+    return r
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(kwargs)
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+    monkeypatch.setattr(http_session.time, 'sleep', delays.append)
+    return delays
+
+
+def install_session(monkeypatch, responses):
+    session = FakeSession(responses)
+    monkeypatch.setattr(http_session, 'get_session', lambda: session)
+    return session
+
+
+def test_retryable_status_is_retried(monkeypatch, delays):
+    session = install_session(monkeypatch, [create_response(503), create_response(200, b'ok')])
+    r = http_session.send('GET', URL, base_delay=2)
+    assert r.content == b'ok'
+    assert len(session.requests) == 2
+    assert len(delays) == 1 and 0 <= delays[0] <= 2
+
+
+def test_retry_after_is_honoured(monkeypatch, delays):
+    install_session(monkeypatch, [create_response(429, headers={'Retry-After': '7'}), create_response(200)])
+    http_session.send('GET', URL)
+    assert delays == [7]
+
+
+def test_other_error_status_is_raised_immediately(monkeypatch, delays):
+    session = install_session(monkeypatch, [create_response(404), create_response(200)])
+    with pytest.raises(requests.HTTPError):
+        http_session.send('GET', URL)
+    assert len(session.requests) == 1 and delays == []
+
+
+def test_not_modified_is_served_from_cache(monkeypatch, tmp_path):
+    cache_dir = os.path.join(tmp_path, 'http_cache')
+    install_session(monkeypatch, [create_response(200, b'body', headers={'ETag': '"v1"'})])
+    http_session.send('GET', URL, cache_dir=cache_dir)
+    session = install_session(monkeypatch, [create_response(304)])
+    r = http_session.send('GET', URL, cache_dir=cache_dir)
+    assert r.status_code == 200 and r.content == b'body'
+    assert session.requests[0]['headers']['If-None-Match'] == '"v1"'
+    assert not any(file_name.endswith('.tmp') for file_name in os.listdir(cache_dir))
+
+
+def test_mismatched_cache_files_are_not_served(monkeypatch, tmp_path):
+    cache_dir = os.path.join(tmp_path, 'http_cache')
+    install_session(monkeypatch, [create_response(200, b'body', headers={'ETag': '"v1"'})])
+    http_session.send('GET', URL, cache_dir=cache_dir)
+    _, body_file = http_session._get_cache_files(cache_dir, URL, None)
+    with open(body_file, 'wb') as f:
+        f.write(b'body of another response')
+    session = install_session(monkeypatch, [create_response(200, b'new body', headers={'ETag': '"v2"'})])
+    r = http_session.send('GET', URL, cache_dir=cache_dir)
+    assert r.content == b'new body'
+    assert 'If-None-Match' not in (session.requests[0].get('headers') or {})
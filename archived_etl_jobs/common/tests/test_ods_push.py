@@ -0,0 +1,71 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import common
+from common import http_session
+
+URL = 'https://data.bs.ch/api/push/1.0/100000/realtime/push/?pushkey=secret'
+
+
+class FakeOds:
+    def __init__(self, fail_at_chunk=None):
+        self.fail_at_chunk = fail_at_chunk
+        self.pushed_chunks = []
+
+    def send(self, method, url, data, params):
+        first_id = json.loads(data)[0]['id']
+        if first_id == self.fail_at_chunk:
+            raise ConnectionError(f'Chunk {first_id} could not be pushed')
+        self.pushed_chunks.append(first_id)
+
+
+@pytest.fixture
+def ods(monkeypatch):
+    def install(fail_at_chunk=None):
+        fake = FakeOds(fail_at_chunk)
+        monkeypatch.setattr(http_session, 'send', fake.send)
+        return fake
+    return install
+
+
+def create_df(n_chunks, value='a'):
+    # One chunk of size 2 per id, so that the first id of a chunk is its index
+    return pd.DataFrame({'id': [i for i in range(n_chunks) for _ in range(2)], 'value': value})
+
+
+def test_rerun_resumes_after_last_acknowledged_chunk(ods, tmp_path):
+    checkpoint_file = os.path.join(tmp_path, 'push_checkpoint.json')
+    df = create_df(5)
+    fake = ods(fail_at_chunk=2)
+    with pytest.raises(ConnectionError):
+        common.batched_ods_realtime_push(df, URL, chunk_size=2, checkpoint_file=checkpoint_file)
+    assert fake.pushed_chunks[:2] == [0, 1]
+    with open(checkpoint_file, 'r') as f:
+        assert json.load(f)['acknowledged_chunks'] == 2
+
+    fake = ods()
+    common.batched_ods_realtime_push(df, URL, chunk_size=2, checkpoint_file=checkpoint_file)
+    assert fake.pushed_chunks == [2, 3, 4]
+    assert not os.path.exists(checkpoint_file)
+
+
+def test_changed_data_ignores_checkpoint(ods, tmp_path):
+    checkpoint_file = os.path.join(tmp_path, 'push_checkpoint.json')
+    ods(fail_at_chunk=3)
+    with pytest.raises(ConnectionError):
+        common.batched_ods_realtime_push(create_df(5), URL, chunk_size=2, checkpoint_file=checkpoint_file)
+    assert os.path.exists(checkpoint_file)
+
+    fake = ods()
+    common.batched_ods_realtime_push(create_df(5, value='b'), URL, chunk_size=2, checkpoint_file=checkpoint_file)
+    assert fake.pushed_chunks == [0, 1, 2, 3, 4]
+    assert not os.path.exists(checkpoint_file)
+
+
+def test_concurrent_push_sends_every_chunk_once(ods):
+    fake = ods()
+    common.batched_ods_realtime_push(create_df(7), URL, chunk_size=2, max_in_flight=4)
+    assert sorted(fake.pushed_chunks) == list(range(7))
@@ -24,11 +24,9 @@ def localize_startzeitpunkt(series: pd.Series) -> pd.Series:
     try:
         return dt.dt.tz_localize(TZ, ambiguous="infer", nonexistent="shift_forward")
     except Exception:
-        ambiguous = [False] * len(dt)
-        for value in dt[dt.duplicated(keep=False)].unique():
-            positions = dt.index[dt == value].tolist()
-            ambiguous[positions[0]] = True  # first occurrence during fall-back = CEST
-        return dt.dt.tz_localize(TZ, ambiguous=ambiguous, nonexistent="shift_forward")
+        # First occurrence of a repeated timestamp during fall-back = CEST
+        ambiguous = dt.duplicated(keep=False) & ~dt.duplicated(keep="first")
+        return dt.dt.tz_localize(TZ, ambiguous=ambiguous.to_numpy(), nonexistent="shift_forward")
 
 
 def download_latest_data(truebung=False):
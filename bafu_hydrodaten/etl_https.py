@@ -2,7 +2,6 @@ import json
 import logging
 import os
 from datetime import datetime
-from functools import reduce
 
 import common
 import pandas as pd
@@ -23,10 +22,32 @@ RHEIN_ODS_PUSH_URL = os.getenv("ODS_PUSH_URL_100089")
 BIRS_ODS_PUSH_URL = os.getenv("ODS_PUSH_URL_100236")
 WIESE_ODS_PUSH_URL = os.getenv("ODS_PUSH_URL_100235")
 RHEIN_KLINGENTHAL_ODS_PUSH_URL = os.getenv("ODS_PUSH_URL_100243")
+# Rows this far below the watermark are pushed again, since hydrodata.ch delivers late values and revises recent ones
+WATERMARK_LOOKBACK = pd.Timedelta(days=1)
+
+
+def get_watermark_file(river_name):
+    return os.path.join("data", river_name, "last_pushed_timestamp.txt")
+
+
+def read_watermark(river_name):
+    """Returns the timestamp of the newest row pushed to ODS so far, or None if nothing was pushed yet."""
+    watermark_file = get_watermark_file(river_name)
+    if not os.path.exists(watermark_file):
+        return None
+    with open(watermark_file, "r") as f:
+        return pd.Timestamp(f.read().strip())
+
+
+def write_watermark(river_name, timestamp):
+    watermark_file = get_watermark_file(river_name)
+    with open(watermark_file + ".tmp", "w") as f:
+        f.write(str(timestamp))
+    os.replace(watermark_file + ".tmp", watermark_file)
 
 
 def process_river(river_files, river_name, river_id, variable_names, push_url):
-    print("Loading data into data frames...")
+    print(f"Loading data of {river_name} into data frames...")
     dfs = []
     for file in river_files:
         response = common.requests_get(
@@ -35,9 +56,10 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
             stream=True,
         )
         df = pd.read_csv(response.raw, parse_dates=True, infer_datetime_format=True)
-        dfs.append(df)
-    print("Merging data frames...")
-    all_df = reduce(lambda left, right: pd.merge(left, right, on=["Time"], how="outer"), dfs)
+        dfs.append(df.drop_duplicates(subset="Time", keep="last").set_index("Time"))
+    print(f"Merging data frames of {river_name}...")
+    # One outer join of all files on the time index
+    all_df = pd.concat(dfs, axis=1, join="outer", sort=True).rename_axis("Time").reset_index()
     all_filename = f"data/{river_name}/{river_name}_hydrodata_{datetime.today().strftime('%Y-%m-%d')}.csv"
     all_df.to_csv(all_filename, index=False)
     ftp_dir = f"hydrodata.ch/data/{river_name}"
@@ -75,15 +97,15 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
     ftp_remote_dir = f"hydrodata.ch/hydropro/{river_id}/realtime"
     common.upload_ftp(merged_filename, remote_path=ftp_remote_dir)
     urllib3.disable_warnings()
-    # print(f'Retrieving latest record from ODS...')
-    # r = common.requests_get(url='https://data.bs.ch/api/records/1.0/search/?dataset=100089&q=&rows=1&sort=timestamp', verify=False)
-    # r.raise_for_status()
-    # latest_ods_value = r.json()['records'][0]['fields']['timestamp']
-    # print(f'Filtering data after {latest_ods_value} for submission to ODS via realtime API...')
-    # realtime_df = merged_df[merged_df['timestamp'] > latest_ods_value]
-    realtime_df = merged_df
+    latest_pushed = read_watermark(river_name)
+    if latest_pushed is None:
+        realtime_df = merged_df
+    else:
+        push_from = latest_pushed - WATERMARK_LOOKBACK
+        print(f"Filtering data of {river_name} after {push_from} for submission to ODS via realtime API...")
+        realtime_df = merged_df[merged_df["timestamp"] > push_from]
     if len(realtime_df) == 0:
-        print("No rows to push to ODS... ")
+        print(f"No rows of {river_name} to push to ODS... ")
     else:
         # Realtime API bootstrap data:
         # {
@@ -94,6 +116,7 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
         # }
 
         # only keep columns that need to be pushed, and rename if necessary.
+        newest_timestamp = realtime_df["timestamp"].max()
         realtime_df = realtime_df[columns_to_push]
         realtime_df = realtime_df.rename(columns={"timestamp_text": "timestamp"})
 
@@ -103,47 +126,56 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
         # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
         r = common.requests_post(url=push_url, data=payload, verify=False)
         r.raise_for_status()
+        # Only rows newer than this (minus WATERMARK_LOOKBACK) are pushed in the next run
+        if latest_pushed is None or newest_timestamp > latest_pushed:
+            write_watermark(river_name, newest_timestamp)
 
 
 def main():
-    process_river(
-        river_files=RHEIN_FILES,
-        river_name="Rhein",
-        river_id="2289",
-        variable_names={
-            "abfluss": "BAFU_2289_AbflussRadar",
-            "pegel": "BAFU_2289_PegelRadar",
-        },
-        push_url=RHEIN_ODS_PUSH_URL,
-    )
-    process_river(
-        river_files=BIRS_FILES,
-        river_name="Birs",
-        river_id="2106",
-        variable_names={
-            "abfluss": "BAFU_2106_AbflussRadar",
-            "pegel": "BAFU_2106_PegelRadar",
-            "temperatur": "BAFU_2106_Wassertemperatur",
-        },
-        push_url=BIRS_ODS_PUSH_URL,
-    )
-    process_river(
-        river_files=WIESE_FILES,
-        river_name="Wiese",
-        river_id="2199",
-        variable_names={
-            "abfluss": "BAFU_2199_AbflussRadarSchacht",
-            "pegel": "BAFU_2199_PegelRadarSchacht",
-        },
-        push_url=WIESE_ODS_PUSH_URL,
-    )
-    process_river(
-        river_files=RHEIN_KLINGENTHAL_FILES,
-        river_name="Rhein_Klingenthal",
-        river_id="2615",
-        variable_names={"pegel": "BAFU_2615_PegelPneumatik"},
-        push_url=RHEIN_KLINGENTHAL_ODS_PUSH_URL,
-    )
+    rivers = [
+        dict(
+            river_files=RHEIN_FILES,
+            river_name="Rhein",
+            river_id="2289",
+            variable_names={
+                "abfluss": "BAFU_2289_AbflussRadar",
+                "pegel": "BAFU_2289_PegelRadar",
+            },
+            push_url=RHEIN_ODS_PUSH_URL,
+        ),
+        dict(
+            river_files=BIRS_FILES,
+            river_name="Birs",
+            river_id="2106",
+            variable_names={
+                "abfluss": "BAFU_2106_AbflussRadar",
+                "pegel": "BAFU_2106_PegelRadar",
+                "temperatur": "BAFU_2106_Wassertemperatur",
+            },
+            push_url=BIRS_ODS_PUSH_URL,
+        ),
+        dict(
+            river_files=WIESE_FILES,
+            river_name="Wiese",
+            river_id="2199",
+            variable_names={
+                "abfluss": "BAFU_2199_AbflussRadarSchacht",
+                "pegel": "BAFU_2199_PegelRadarSchacht",
+            },
+            push_url=WIESE_ODS_PUSH_URL,
+        ),
+        dict(
+            river_files=RHEIN_KLINGENTHAL_FILES,
+            river_name="Rhein_Klingenthal",
+            river_id="2615",
+            variable_names={"pegel": "BAFU_2615_PegelPneumatik"},
+            push_url=RHEIN_KLINGENTHAL_ODS_PUSH_URL,
+        ),
+    ]
+    # Processed one after the other: common.upload_ftp changes the working directory of the whole process,
+    # which would break the relative data/ paths of rivers running in other threads
+    for river in rivers:
+        process_river(**river)
 
 
 if __name__ == "__main__":
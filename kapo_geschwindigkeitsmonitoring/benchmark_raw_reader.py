@@ -0,0 +1,83 @@
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from etl import RAW_COLUMNS, read_raw_file
+
+
+def fix_data(filename, filename_fixed, encoding):
+    # Previous implementation, writing a fixed copy of the raw file
+    with (
+        open(filename, "r", encoding=encoding) as input_file,
+        open(filename_fixed, "w", encoding=encoding) as output_file,
+    ):
+        for line in input_file:
+            if len(line.split("\t")) > 5:
+                wrong_value = line.split("\t")[4]
+                newline_position = wrong_value.index(".") + 2
+                fixed_value = wrong_value[:newline_position] + "\n" + wrong_value[newline_position:]
+                output_file.write(line.replace(wrong_value, fixed_value) + "\n")
+            else:
+                output_file.write(line)
+
+
+def read_with_fixed_copy(filename):
+    filename_fixed = filename + ".fixed"
+    fix_data(filename, filename_fixed, "utf-8")
+    raw_df = pd.read_table(
+        filename_fixed, skiprows=6, header=0, encoding="utf-8", names=RAW_COLUMNS, on_bad_lines="skip"
+    )
+    os.remove(filename_fixed)
+    return raw_df
+
+
+def read_streaming(filename):
+    return read_raw_file(filename, "utf-8")
+
+
+def run(reader, filename):
+    # Runs in a fresh process, so that ru_maxrss is the peak of this reader alone
+    start = time.perf_counter()
+    raw_df = reader(filename)
+    elapsed = time.perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, len(raw_df)
+
+
+def write_synthetic_file(filename, n_lines, merged_share=0.001):
+    rng = random.Random(42)
+    with open(filename, "w", encoding="utf-8") as f:
+        f.writelines(f"Kopfzeile {i}\n" for i in range(6))
+        f.write("Geschwindigkeit\tZeit\tDatum\tRichtung\tLänge\n")
+        for i in range(n_lines):
+            line = f"{rng.randint(10, 99)}\t{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}\t01.02.23\t{rng.randint(1, 2)}\t{rng.randint(2, 15)}.{rng.randint(0, 9)}"
+            if rng.random() < merged_share:
+                # The line break to the next measurement is missing
+                line += f"{rng.randint(10, 99)}\t12:00:00\t01.02.23\t2\t3.9"
+            f.write(line + "\n")
+
+
+def main(n_lines=5_000_000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "raw.txt")
+        logging.info(f"Writing synthetic raw file with {n_lines:,} lines...")
+        write_synthetic_file(filename, n_lines)
+        logging.info(f"Raw file size: {os.path.getsize(filename) / 1_048_576:.1f} MB")
+        results = {}
+        for name, reader in [("fix_data + read_table", read_with_fixed_copy), ("streaming", read_streaming)]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results[name] = executor.submit(run, reader, filename).result()
+        if len({num_rows for _, _, num_rows in results.values()}) != 1:
+            raise ValueError(f"Readers returned different numbers of rows: {results}")
+        for name, (elapsed, peak_rss_mb, num_rows) in results.items():
+            logging.info(f"{name}: {elapsed:.2f}s, {num_rows / elapsed:,.0f} rows/s, peak RSS {peak_rss_mb:,.0f} MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,8 +1,9 @@
 import gc
 import glob
+import io
 import logging
 import os
-import shutil
+import re
 import sqlite3
 from datetime import datetime
 from pathlib import Path
@@ -23,6 +24,8 @@ DETAIL_DATA_Q_BASE_PATH = os.getenv("DETAIL_DATA_Q_BASE_PATH")
 TZ = ZoneInfo("Europe/Zurich")
 TODAY = datetime.now(TZ)
 YEARS_TO_PUBLISH = {TODAY.year, TODAY.year - 1}
+DB_FILENAME = os.path.join("data", "datasette", "Geschwindigkeitsmonitoring.db")
+LEDGER_FILENAME = os.path.join("data", "ingestion_ledger.db")
 
 
 def _safe_unlink(path: str) -> bool:
@@ -36,17 +39,6 @@ def _safe_unlink(path: str) -> bool:
         return False
 
 
-def _safe_rmtree(path: str) -> bool:
-    try:
-        shutil.rmtree(path)
-        return True
-    except FileNotFoundError:
-        return False
-    except Exception:
-        logging.exception(f"Failed to delete directory: {path}")
-        return False
-
-
 def _should_keep_local_artifacts() -> bool:
     """
     Set KEEP_LOCAL_ARTIFACTS=1 to keep large intermediates on disk
@@ -55,27 +47,130 @@ def _should_keep_local_artifacts() -> bool:
     return os.getenv("KEEP_LOCAL_ARTIFACTS", "").strip().lower() in {"1", "true", "yes", "y"}
 
 
-# Add missing line breaks for lines with more than 5 columns
-def fix_data(filename, measure_id, encoding):
-    filename_fixed = os.path.join("data", "fixed", measure_id + os.path.basename(filename))
-    # logging.info(f'Fixing data if necessary and writing to {filename_fixed}...')
-    with (
-        open(filename, "r", encoding=encoding) as input_file,
-        open(filename_fixed, "w", encoding=encoding) as output_file,
+RAW_COLUMNS = ["Geschwindigkeit", "Zeit", "Datum", "Richtung ID", "Fahrzeuglänge"]
+# A line with more than 5 columns is two measurements whose line break went missing inside the
+# Fahrzeuglänge value, which has one decimal: "50\t...\t4.548\t..." has to be split after "4.5".
+MERGED_LINE = re.compile(r"^((?:[^\t\n]*\t){4}[^\t\n.]*\.[^\t\n])([^\t\n]*\t[^\n]*)$", re.MULTILINE)
+
+
+class FixedRawFile(io.TextIOBase):
+    """
+    Text stream over a raw measurement file that adds the missing line breaks of merged lines on the fly,
+    so that the file can be parsed by pandas in a single pass without writing a fixed copy first.
+    """
+
+    def __init__(self, filename, encoding, chunk_size=1024 * 1024):
+        self.num_fixed = 0
+        self._file = open(filename, "r", encoding=encoding)
+        self._chunk_size = chunk_size
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self._buffer]
+            while chunk := self._read_fixed_chunk(self._chunk_size):
+                parts.append(chunk)
+            self._buffer = ""
+            return "".join(parts)
+        if not self._buffer:
+            self._buffer = self._read_fixed_chunk(size)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _read_fixed_chunk(self, size):
+        chunk = self._file.read(max(size, self._chunk_size))
+        if chunk:
+            # Complete the last line so that a merged line is never split between two chunks
+            chunk += self._file.readline()
+        fixed, num_fixed = MERGED_LINE.subn(r"\1\n\2", chunk)
+        self.num_fixed += num_fixed
+        return fixed
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def read_raw_file(filename, encoding):
+    """Parses a raw measurement file into a DataFrame, repairing merged lines while reading."""
+    with FixedRawFile(filename, encoding) as stream:
+        raw_df = pd.read_table(stream, skiprows=6, header=0, names=RAW_COLUMNS, on_bad_lines="skip")
+    if stream.num_fixed:
+        logging.info(f"Fixed {stream.num_fixed} merged lines in {filename}")
+    return raw_df
+
+
+def open_ledger(reset=False):
+    """Opens the ledger of ingested raw files (path, Messung-ID, size, mtime and detected encoding)."""
+    ledger = sqlite3.connect(LEDGER_FILENAME)
+    ledger.execute(
+        "CREATE TABLE IF NOT EXISTS files "
+        "(path TEXT PRIMARY KEY, measure_id INTEGER, size INTEGER, mtime_ns INTEGER, encoding TEXT)"
+    )
+    if reset:
+        ledger.execute("DELETE FROM files")
+    ledger.commit()
+    return ledger
+
+
+def read_ledger(ledger):
+    """Returns {measure_id: {path: (size, mtime_ns, encoding)}}."""
+    entries = {}
+    for path, measure_id, size, mtime_ns, encoding in ledger.execute(
+        "SELECT path, measure_id, size, mtime_ns, encoding FROM files"
     ):
-        for i, line in enumerate(input_file):
-            if len(line.split("\t")) > 5:
-                wrong_value = line.split("\t")[4]
-                newline_position = wrong_value.index(".") + 2
-                fixed_value = wrong_value[:newline_position] + "\n" + wrong_value[newline_position:]
-                line_fixed = line.replace(wrong_value, fixed_value) + "\n"
-                logging.info(f"Fixed line on line {i}:")
-                logging.info(f"Bad line: \n{line}")
-                logging.info(f"Fixed line: \n{line_fixed}")
-                output_file.write(line_fixed)
-            else:
-                output_file.write(line)
-    return filename_fixed
+        entries.setdefault(measure_id, {})[path] = (size, mtime_ns, encoding)
+    return entries
+
+
+def add_metadata_per_direction(raw_df, df_metadata_per_direction):
+    """Adds the metadata per direction to the single measurements and drops those outside Messbeginn and Messende."""
+    part_df = raw_df.merge(
+        df_metadata_per_direction.drop(columns=["geometry"], errors="ignore"), "left", ["Messung-ID", "Richtung ID"]
+    )
+    num_rows_before = part_df.shape[0]
+    part_df = part_df[
+        (
+            part_df["Timestamp"].dt.floor("D")
+            >= pd.to_datetime(part_df["Messbeginn"])
+            .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
+            .dt.floor("D")
+        )
+        & (
+            part_df["Timestamp"].dt.floor("D")
+            <= pd.to_datetime(part_df["Messende"])
+            .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
+            .dt.floor("D")
+        )
+    ]
+    logging.info(
+        f"Filtered out {num_rows_before - part_df.shape[0]} rows "
+        f"due to timestamp not being between Messbeginn and Messende..."
+    )
+    return part_df
+
+
+def iter_measurements_per_year(conn, df_metadata_per_direction, chunk_size=200_000, years=None):
+    """
+    Streams the single measurements from SQLite, one Messbeginn year after the other,
+    yielding (year, chunk) with the metadata per direction added.
+    """
+    all_years = [y for (y,) in conn.execute("SELECT DISTINCT messbeginn_jahr FROM Kennzahlen_pro_Standort ORDER BY 1")]
+    query = """
+    SELECT e.* FROM Einzelmessungen e
+    JOIN Kennzahlen_pro_Standort k ON e."Messung-ID" = k.ID
+    WHERE k.messbeginn_jahr = ?
+    ORDER BY e.rowid
+    """
+    for year in all_years:
+        if years is not None and year not in years:
+            continue
+        for chunk in pd.read_sql(query, conn, params=(year,), chunksize=chunk_size):
+            chunk["Timestamp"] = pd.to_datetime(chunk["Timestamp"], utc=True).dt.tz_convert("Europe/Zurich")
+            yield year, add_metadata_per_direction(chunk, df_metadata_per_direction)
 
 
 def main():
@@ -111,8 +206,8 @@ def main():
 
     df_metadata = create_metadata_per_location_df(df_meta_raw)
     df_metadata_per_direction = create_metadata_per_direction_df(df_metadata)
-    df_measurements = create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata)
-    create_measures_per_year(df_measurements)
+    create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata)
+    create_measures_per_year(df_metadata_per_direction)
 
 
 def create_metadata_per_location_df(df):
@@ -247,13 +342,19 @@ def create_metadata_per_direction_df(df_metadata):
 
 
 def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_per_location):
-    dfs = []
+    """
+    Ingests the raw files of all measurements into SQLite and exports them.
+
+    Raw files whose path, size and mtime are already in the ingestion ledger are skipped, so only new or modified
+    measurements are parsed again (with the encoding detected before if the file did not change). The aggregated
+    CSV and pickle are then streamed from SQLite.
+    """
     files_to_upload_partitioned = []
     files_to_upload = []
     logging.info("Removing metadata without data...")
     df_meta_raw = df_meta_raw.dropna(subset=["Verzeichnis"])
 
-    db_filename = os.path.join("data", "datasette", "Geschwindigkeitsmonitoring.db")
+    db_filename = DB_FILENAME
     table_name_location = "Kennzahlen_pro_Standort"
     table_name = "Einzelmessungen"
     # Columns to index
@@ -297,14 +398,24 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
         "link_zu_einzelmessungen" TEXT
     )
     """)
-    cursor.execute(f"DELETE FROM {table_name_location}")
-    conn.commit()
-    # Append data, dropping geometry if Spatialite isn't used
-    df_metadata_per_location.drop(columns=["the_geom"], errors="ignore").to_sql(
-        name=table_name_location, con=conn, if_exists="append", index=False
-    )
+    # Upsert instead of delete and append: deleting a Standort cascades to its single measurements,
+    # which should only happen for Standorte that are gone from the metadata.
+    df_location = df_metadata_per_location.drop(columns=["the_geom"], errors="ignore")
+    df_location.to_sql(name="staging_location", con=conn, if_exists="replace", index=False)
+    columns = ", ".join(f'"{c}"' for c in df_location.columns)
+    updates = ", ".join(f'"{c}" = excluded."{c}"' for c in df_location.columns if c != "ID")
+    with conn:
+        cursor.execute(f"DELETE FROM {table_name_location} WHERE ID NOT IN (SELECT ID FROM staging_location)")
+        cursor.execute(
+            f"INSERT INTO {table_name_location} ({columns}) SELECT {columns} FROM staging_location WHERE true "
+            f"ON CONFLICT(ID) DO UPDATE SET {updates}"
+        )
+        cursor.execute("DROP TABLE staging_location")
     common.create_indices(conn, table_name_location, columns_to_index_location)
 
+    table_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
     logging.info(f"Creating table {table_name} with proper schema...")
     cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS {table_name} (
@@ -320,51 +431,64 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
             ON UPDATE CASCADE ON DELETE CASCADE
     )
     """)
-    cursor.execute(f"DELETE FROM {table_name}")
     conn.commit()
 
-    # Drop geometry column since it is not needed anymore
-    df_metadata_per_direction = df_metadata_per_direction.drop(columns=["geometry"])
+    # A fresh table means nothing has been ingested yet, whatever the ledger says
+    ledger = open_ledger(reset=not table_exists)
+    ingested = read_ledger(ledger)
+    measure_ids = set(df_meta_raw["ID"])
+    stale_ids = [(measure_id,) for measure_id in ingested if measure_id not in measure_ids]
+    if stale_ids:
+        logging.info(f"Removing {len(stale_ids)} measurements that are no longer in the metadata...")
+        with conn:
+            cursor.executemany(f'DELETE FROM {table_name} WHERE "Messung-ID" = ?', stale_ids)
+        with ledger:
+            ledger.executemany("DELETE FROM files WHERE measure_id = ?", stale_ids)
 
     # On Jan 1, clear the folder that holds per-measurement CSVs for 100097
     if TODAY.month == 1 and TODAY.day == 1:
         remote_year_folder = "kapo/geschwindigkeitsmonitoring/data_partitioned"
         common.delete_dir_content_ftp(common.FTP_SERVER, common.FTP_USER, common.FTP_PASSWORD, remote_year_folder)
 
-    for index, row in df_meta_raw.iterrows():
-        logging.info(f"Processing row {index + 1} of {len(df_meta_raw)}...")
-        measure_id = row["ID"]
+    num_skipped = 0
+    for i, row in enumerate(df_meta_raw[["ID", "Verzeichnis", "Messbeginn"]].itertuples(index=False)):
+        measure_id = row.ID
         metadata_file_path = (
             "data_orig" + os.sep + row.Verzeichnis.replace("\\", os.sep).replace(DETAIL_DATA_Q_BASE_PATH, "")
         )
         data_search_string = os.path.join(metadata_file_path, "**/*.txt")
-        raw_files = glob.glob(data_search_string, recursive=True)
+        raw_files = [f.replace("\\", "/") for f in glob.glob(data_search_string, recursive=True)]
+        file_stats = {}
+        for file in raw_files:
+            stat = os.stat(file)
+            file_stats[file] = (stat.st_size, stat.st_mtime_ns)
+        ledger_entries = ingested.get(measure_id, {})
+        if file_stats == {path: entry[:2] for path, entry in ledger_entries.items()}:
+            num_skipped += 1
+            continue
+        logging.info(f"Processing row {i + 1} of {len(df_meta_raw)} (measurement ID {measure_id})...")
+        with conn:
+            cursor.execute(f'DELETE FROM {table_name} WHERE "Messung-ID" = ?', (measure_id,))
 
         if len(raw_files) == 0:
             logging.info(f"No raw files found for measurement ID {measure_id}!")
-            continue
         elif len(raw_files) > 2:
             logging.info(f"More than 2 raw files found for measurement ID {measure_id}!")
 
         # collect parts for this measure_id
         measure_parts = []
+        ledger_rows = []
 
-        for i, file in enumerate(raw_files):
-            file = file.replace("\\", "/")
-            result = from_path(file)
-            enc = result.best().encoding
+        for file in raw_files:
+            size, mtime_ns = file_stats[file]
+            if file in ledger_entries and ledger_entries[file][:2] == (size, mtime_ns):
+                enc = ledger_entries[file][2]
+            else:
+                result = from_path(file)
+                enc = result.best().encoding
+            ledger_rows.append((file, measure_id, size, mtime_ns, enc))
             logging.info(f"Fixing errors and reading data into dataframe from {file}...")
-            fixed_path = fix_data(filename=file, measure_id=str(measure_id), encoding=enc)
-            raw_df = pd.read_table(
-                fixed_path,
-                skiprows=6,
-                header=0,
-                encoding=enc,
-                names=["Geschwindigkeit", "Zeit", "Datum", "Richtung ID", "Fahrzeuglänge"],
-                on_bad_lines="skip",
-            )
-            if not _should_keep_local_artifacts() and fixed_path.startswith(os.path.join("data", "fixed")):
-                _safe_unlink(fixed_path)
+            raw_df = read_raw_file(file, encoding=enc)
 
             if raw_df.empty:
                 logging.info("Dataframe is empty, ignoring...")
@@ -379,30 +503,12 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
 
             logging.info(f"Appending data to SQLite table {table_name}...")
             raw_df.to_sql(name=table_name, con=conn, if_exists="append", index=False)
-            part_df = raw_df.merge(df_metadata_per_direction, "left", ["Messung-ID", "Richtung ID"])
-
-            num_rows_before = part_df.shape[0]
-            part_df = part_df[
-                (
-                    part_df["Timestamp"].dt.floor("D")
-                    >= pd.to_datetime(part_df["Messbeginn"])
-                    .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
-                    .dt.floor("D")
-                )
-                & (
-                    part_df["Timestamp"].dt.floor("D")
-                    <= pd.to_datetime(part_df["Messende"])
-                    .dt.tz_localize("Europe/Zurich", ambiguous=True, nonexistent="shift_forward")
-                    .dt.floor("D")
-                )
-            ]
-            logging.info(
-                f"Filtered out {num_rows_before - part_df.shape[0]} rows "
-                f"due to timestamp not being between Messbeginn and Messende..."
-            )
-
-            measure_parts.append(part_df)
-            dfs.append(part_df)
+            measure_parts.append(add_metadata_per_direction(raw_df, df_metadata_per_direction))
+        conn.commit()
+        # Only record the files once their rows are committed, so an interrupted run ingests them again
+        with ledger:
+            ledger.execute("DELETE FROM files WHERE measure_id = ?", (measure_id,))
+            ledger.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", ledger_rows)
 
         # after processing all files for this measure_id, write ONE CSV
         if measure_parts:
@@ -412,9 +518,11 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
             measure_df.to_csv(filename_current_measure, index=False)
             files_to_upload.append(filename_current_measure)
             # Only upload current & previous year, always to dataset 100097
-            year_val = int(str(row["Messbeginn"])[:4])
+            year_val = int(str(row.Messbeginn)[:4])
             if year_val in YEARS_TO_PUBLISH:
                 files_to_upload_partitioned.append(filename_current_measure)
+    ledger.close()
+    logging.info(f"Skipped {num_skipped} of {len(df_meta_raw)} measurements whose raw files were already ingested.")
 
     for file in files_to_upload_partitioned:
         if ct.has_changed(filename=file, method="hash"):
@@ -427,9 +535,11 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
             ct.update_hash_file(file)
 
     common.create_indices(conn, table_name, columns_to_index)
+    # The pickle is read as a whole by neighboring jobs (e.g. mobilitaet_dtv), so it is assembled in one frame
+    all_df = pd.concat(
+        [chunk for _, chunk in iter_measurements_per_year(conn, df_metadata_per_direction)], ignore_index=True
+    )
     conn.close()
-
-    all_df = pd.concat(dfs)
     pkl_filename = os.path.join("data", "geschwindigkeitsmonitoring_data.pkl")
     all_df.to_pickle(pkl_filename)
     csv_filename = os.path.join("data", "geschwindigkeitsmonitoring_data.csv")
@@ -450,49 +560,24 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction, df_metadata_p
         if deleted_processed:
             logging.info(f"Deleted {deleted_processed} processed per-measurement CSVs from data/processed/")
 
-        _safe_rmtree(os.path.join("data", "fixed"))
-        os.makedirs(os.path.join("data", "fixed"), exist_ok=True)
-
         _safe_unlink(csv_filename)
         # Keep the PKL: it's used as an input by neighboring jobs (e.g. mobilitaet_dtv).
         logging.info("Deleted local aggregated CSV geschwindigkeitsmonitoring_data.csv (kept PKL)")
 
-    return all_df
 
-
-def create_measures_per_year(df_all, chunk_size=200_000, years=None, dedupe_subset=None):
+def create_measures_per_year(df_metadata_per_direction, chunk_size=200_000, years=None, dedupe_subset=None):
     """
-    Stream df_all into one CSV per year without copying the whole frame.
+    Stream the single measurements from SQLite into one CSV per year without loading all of them at once.
     """
     outdir = Path("data")
     outdir.mkdir(parents=True, exist_ok=True)
 
-    cols = list(df_all.columns)  # keep stable column order
     wrote_header = set()
     totals = {}
 
-    n = len(df_all)
-    logging.info(f"[per-year] start: {n:,} rows total")
-    if n == 0:
-        logging.info("[per-year] nothing to do")
-        return
-
-    for start in range(0, n, chunk_size):
-        end = min(start + chunk_size, n)
-        part = df_all.iloc[start:end]
-
-        years_in_chunk = pd.to_datetime(part["Messbeginn"], errors="coerce").dt.year
-
-        if years is not None:
-            mask = years_in_chunk.isin(years)
-            if not mask.any():
-                logging.info(f"[per-year] chunk {start:,}-{end - 1:,}: 0 rows match target years; skip")
-                del part
-                gc.collect()
-                continue
-            part = part.loc[mask]
-            years_in_chunk = years_in_chunk.loc[mask]
-
+    logging.info(f"[per-year] start: streaming from {DB_FILENAME}")
+    conn = sqlite3.connect(DB_FILENAME)
+    for y, part in iter_measurements_per_year(conn, df_metadata_per_direction, chunk_size, years):
         if dedupe_subset:
             missing = [c for c in dedupe_subset if c not in part.columns]
             if missing:
@@ -502,30 +587,28 @@ def create_measures_per_year(df_all, chunk_size=200_000, years=None, dedupe_subs
                 part = part.drop_duplicates(subset=dedupe_subset, keep="first")
                 after = len(part)
                 if after != before:
-                    logging.info(f"[per-year] chunk {start:,}-{end - 1:,}: dropped {before - after:,} dups")
+                    logging.info(f"[per-year] chunk of year {y}: dropped {before - after:,} dups")
 
-        for y, sub in part.groupby(years_in_chunk):
-            if pd.isna(y):
-                logging.info("[per-year] found NaN year; skipping those rows")
-                continue
-            y = int(y)
-            fname = outdir / f"geschwindigkeitsmonitoring_{y}.csv"
-            write_header = y not in wrote_header and not fname.exists()
-
-            sub = sub.loc[:, cols]
-            sub.to_csv(
-                fname,
-                index=False,
-                mode="a",
-                header=write_header,
-                lineterminator="\n",
-            )
-            wrote_header.add(y)
-            totals[y] = totals.get(y, 0) + len(sub)
-            logging.info(f"[per-year] wrote {len(sub):,} rows to {fname.name} (year {y}, total {totals[y]:,})")
+        fname = outdir / f"geschwindigkeitsmonitoring_{y}.csv"
+        write_header = y not in wrote_header and not fname.exists()
+        part.to_csv(
+            fname,
+            index=False,
+            mode="a",
+            header=write_header,
+            lineterminator="\n",
+        )
+        wrote_header.add(y)
+        totals[y] = totals.get(y, 0) + len(part)
+        logging.info(f"[per-year] wrote {len(part):,} rows to {fname.name} (year {y}, total {totals[y]:,})")
 
         del part
         gc.collect()
+    conn.close()
+
+    if not totals:
+        logging.info("[per-year] nothing to do")
+        return
 
     for y in sorted(totals):
         fname = outdir / f"geschwindigkeitsmonitoring_{y}.csv"
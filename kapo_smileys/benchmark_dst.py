@@ -0,0 +1,50 @@
+import logging
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+from etl import is_dt
+
+
+def is_dt_per_row(datetime, timezone):
+    # Previous implementation, localizing every timestamp on its own
+    try:
+        return timezone.localize(datetime).dst() == timedelta(0)
+    except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
+        return True
+    except ValueError:
+        return False
+
+
+def main(n_rows=1_000_000, n_rows_per_row=100_000):
+    # Random timestamps over several years, with both DST transitions of each year and a few NaT mixed in
+    rng = np.random.default_rng(42)
+    start, end = pd.Timestamp("2019-01-01").value, pd.Timestamp("2025-01-01").value
+    timestamps = pd.Series(pd.to_datetime(rng.integers(start, end, n_rows)).floor("s"))
+    transitions = pd.to_datetime(
+        [f"{year}-03-{day} 02:30" for year, day in ((2021, 28), (2022, 27), (2023, 26))]
+        + [f"{year}-10-{day} 02:30" for year, day in ((2021, 31), (2022, 30), (2023, 29))]
+    )
+    timestamps.iloc[: len(transitions)] = transitions
+    timestamps.iloc[len(transitions) : len(transitions) + 3] = pd.NaT
+
+    t0 = time.perf_counter()
+    vectorised = is_dt(timestamps)
+    t_vectorised = time.perf_counter() - t0
+
+    sample = timestamps.iloc[:n_rows_per_row]
+    t0 = time.perf_counter()
+    per_row = sample.apply(lambda x: is_dt_per_row(x, pytz.timezone("Europe/Zurich")))
+    t_per_row = time.perf_counter() - t0
+
+    if not (vectorised.iloc[:n_rows_per_row] == per_row.astype(bool)).all():
+        raise ValueError("Vectorised and per-row DST flags differ!")
+    logging.info(f"Per-row:    {n_rows_per_row / t_per_row:,.0f} rows/s ({t_per_row:.2f}s for {n_rows_per_row:,} rows)")
+    logging.info(f"Vectorised: {n_rows / t_vectorised:,.0f} rows/s ({t_vectorised:.2f}s for {n_rows:,} rows)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -3,16 +3,18 @@ import glob
 import io
 import logging
 import os
+import shutil
 import sqlite3
 import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+from hashlib import blake2b
 
 import common
 import numpy as np
 import pandas as pd
-import pytz
 import shapefile  # library pyshp
-from common import change_tracking as ct
 
 
 # see https://gist.github.com/aerispaha/f098916ac041c286ae92d037ba5c37ba
@@ -26,140 +28,307 @@ def read_shapefile(shp_path):
     return df
 
 
-def parse_messdaten(df_einsatz_days, df_einsaetze):
-    messdaten_path = os.path.join("data_orig", "Datenablage")
-    list_path = os.path.join("data", "list_files.txt")
-    common.list_files(messdaten_path, list_path, recursive=True)
-    if ct.has_changed(list_path):
-        current_zyklus = int(df_einsaetze["Zyklus"].max())
-        previous_zyklus = current_zyklus - 1
-        zyklus_filter = {current_zyklus, previous_zyklus}
-
-        export_file_all_unfiltered = os.path.join("data", "all_data.csv")
-        export_file_filtered = os.path.join("data", "current_previous_cycles_data.csv")
-        export_file_stats = os.path.join("data", "all_stat.csv")
-
-        for path in (export_file_all_unfiltered, export_file_filtered):
-            if os.path.exists(path):
-                os.remove(path)
-
-        sqlite_path = os.path.join("data", "datasette", "Smiley-Geschwindigkeitsmessungen.db")
-        os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
-        conn = sqlite3.connect(sqlite_path)
-        logging.info(f"Creating SQLite database {sqlite_path}...")
-        init_sqlite(conn)
-
-        messdaten_folders = glob.glob(os.path.join(messdaten_path, "*"))
-        stat_dfs = []
-        total_all_rows = 0
-        total_filtered_rows = 0
-        first_all_csv = True
-        first_filtered_csv = True
-        messdaten_columns = None
-
-        for folder in messdaten_folders:
-            if not any(os.listdir(folder)):
-                logging.info(f"No data in folder {folder}...")
-                continue
-            id_standort = int(os.path.basename(folder).split("_")[0])
-            if id_standort not in df_einsaetze.id_Standort.values:
-                logging.warning(
-                    f"Data in the folder {folder}, but either id_standort {id_standort} "
-                    "not in Einsatzplan or with non-valid values!"
-                )
-                continue
-            df_all_pro_standort, df_stat_pro_standort = parse_single_messdaten_folder(
-                folder, df_einsatz_days, df_einsaetze, id_standort
-            )
-
-            if messdaten_columns is None:
-                messdaten_columns = df_all_pro_standort.columns
-
-            total_all_rows += len(df_all_pro_standort)
-            df_all_pro_standort.to_csv(export_file_all_unfiltered, mode="a", header=first_all_csv, index=False)
-            first_all_csv = False
+MANIFEST_PATH = os.path.join("data", "messdaten_manifest.db")
+PARSED_DIR = os.path.join("data", "parsed")
+STANDORTE_DIR = os.path.join("data", "standorte")
+SQLITE_PATH = os.path.join("data", "datasette", "Smiley-Geschwindigkeitsmessungen.db")
+# Number of worker processes parsing Standort folders (1 = sequentially in this process)
+SMILEYS_WORKERS = int(os.getenv("SMILEYS_WORKERS", str(os.cpu_count() or 1)))
+# Upper bound for the total size of the TXT files of the Standort folders being parsed at the same time.
+# A single folder larger than this is still parsed, but then on its own.
+SMILEYS_MAX_INFLIGHT_MB = int(os.getenv("SMILEYS_MAX_INFLIGHT_MB", "512"))
 
-            df_filtered = df_all_pro_standort[df_all_pro_standort["Zyklus"].isin(zyklus_filter)]
-            if not df_filtered.empty:
-                total_filtered_rows += len(df_filtered)
-                df_filtered.to_csv(export_file_filtered, mode="a", header=first_filtered_csv, index=False)
-                first_filtered_csv = False
-            del df_filtered
 
-            append_to_sqlite(df_all_pro_standort, conn)
-            stat_dfs.append(df_stat_pro_standort)
-            del df_all_pro_standort
-            gc.collect()
+def open_manifest():
+    conn = sqlite3.connect(MANIFEST_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, size INTEGER, mtime_ns INTEGER)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def scan_messdaten_folders(messdaten_path):
+    """Returns {folder: {txt_file: (size, mtime_ns)}} for every Standort folder."""
+    folders = {}
+    for folder in sorted(glob.glob(os.path.join(messdaten_path, "*"))):
+        files = {}
+        # Go recursively into folders until TXT files are found
+        for f in glob.glob(os.path.join(folder, "**", "*.TXT"), recursive=True):
+            stat = os.stat(f)
+            files[f] = (stat.st_size, stat.st_mtime_ns)
+        folders[folder] = files
+    return folders
+
+
+def get_standort_files(folder):
+    name = os.path.basename(folder)
+    return (
+        os.path.join(STANDORTE_DIR, f"{name}.csv"),
+        os.path.join(STANDORTE_DIR, f"{name}_filtered.csv"),
+        os.path.join(STANDORTE_DIR, f"{name}_stat.csv"),
+    )
 
-        if total_all_rows == 0:
-            conn.close()
-            logging.info("No messdaten rows processed. Exiting...")
-            return None, None
 
-        if first_filtered_csv:
-            logging.warning(
-                f"No datapoints for cycles {previous_zyklus} and {current_zyklus}; writing empty {export_file_filtered}"
+def get_id_standort(folder):
+    try:
+        return int(os.path.basename(folder).split("_")[0])
+    except ValueError:
+        return None
+
+
+def get_affected_folders(current_folders, stored_folders, rebuild=False):
+    """
+    Returns the Standort folders to process again: the changed ones and all other folders of their Standorte, since
+    the rows of a Standort are replaced as a whole in SQLite (see remove_standort).
+    """
+    all_folders = sorted(set(current_folders) | set(stored_folders))
+    changed_folders = {
+        folder for folder in all_folders if rebuild or current_folders.get(folder, {}) != stored_folders.get(folder, {})
+    }
+    changed_ids = {get_id_standort(folder) for folder in changed_folders} - {None}
+    return [folder for folder in all_folders if folder in changed_folders or get_id_standort(folder) in changed_ids]
+
+
+def remove_standort(folder, conn):
+    for path in get_standort_files(folder):
+        if os.path.exists(path):
+            os.remove(path)
+    id_standort = get_id_standort(folder)
+    if id_standort is None:
+        return
+    with conn:
+        conn.execute("DELETE FROM Einzelmessungen WHERE id_standort = ?", (id_standort,))
+        conn.execute("DELETE FROM Einsatzplan WHERE id_standort = ?", (id_standort,))
+
+
+def concat_csv_files(paths, target):
+    """Concatenates CSV files with identical columns into target, keeping only the first header."""
+    with open(target, "wb") as out:
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                if i > 0:
+                    f.readline()
+                shutil.copyfileobj(f, out, length=16 * 1024 * 1024)
+
+
+def process_standort(folder, id_standort, changed_files, df_einsatz_days, df_einsaetze, zyklus_filter):
+    """
+    Parses a Standort folder and writes its CSV parts to data/standorte. The rows for SQLite are written to a pickle
+    next to them, whose path is returned, so that a single process can append them to the database.
+    """
+    df_all_pro_standort, df_stat_pro_standort = parse_single_messdaten_folder(
+        folder, df_einsatz_days, df_einsaetze, id_standort, changed_files
+    )
+    file_all, file_filtered, file_stat = get_standort_files(folder)
+    df_all_pro_standort.to_csv(file_all, index=False)
+    df_filtered = df_all_pro_standort[df_all_pro_standort["Zyklus"].isin(zyklus_filter)]
+    if not df_filtered.empty:
+        df_filtered.to_csv(file_filtered, index=False)
+    del df_filtered
+    df_stat_pro_standort.to_csv(file_stat, index=False)
+    sqlite_file = os.path.splitext(file_all)[0] + "_sqlite.pkl"
+    pd.to_pickle(_prepare_sqlite_frames(df_all_pro_standort), sqlite_file)
+    del df_all_pro_standort
+    gc.collect()
+    return sqlite_file
+
+
+def parse_standorte(tasks, df_einsatz_days, df_einsaetze, zyklus_filter):
+    """
+    Parses the Standort folders given as (folder, id_standort, changed_files, size) tuples and yields the SQLite
+    pickles of process_standort in the order of tasks. With SMILEYS_WORKERS > 1 the folders are parsed in a process
+    pool, and a folder is only submitted while the TXT files in flight stay below SMILEYS_MAX_INFLIGHT_MB.
+    """
+    if SMILEYS_WORKERS <= 1:
+        for folder, id_standort, changed_files, _ in tasks:
+            yield process_standort(folder, id_standort, changed_files, df_einsatz_days, df_einsaetze, zyklus_filter)
+        return
+    budget = SMILEYS_MAX_INFLIGHT_MB * 1024 * 1024
+    pending = deque()
+    in_flight = 0
+    with ProcessPoolExecutor(max_workers=SMILEYS_WORKERS) as executor:
+        for folder, id_standort, changed_files, size in tasks:
+            while pending and in_flight + size > budget:
+                future, done_size = pending.popleft()
+                yield future.result()
+                in_flight -= done_size
+            future = executor.submit(
+                process_standort, folder, id_standort, changed_files, df_einsatz_days, df_einsaetze, zyklus_filter
             )
-            pd.DataFrame(columns=messdaten_columns).to_csv(export_file_filtered, index=False)
+            pending.append((future, size))
+            in_flight += size
+        while pending:
+            future, _ = pending.popleft()
+            yield future.result()
 
-        logging.info(f"Saved unfiltered data with {total_all_rows} datapoints to {export_file_all_unfiltered}")
-        logging.info(f"Extracting data for cycles {previous_zyklus} and {current_zyklus}")
-        logging.info(
-            f"Filtered data contains {total_filtered_rows} datapoints out of {total_all_rows} total "
-            f"({total_filtered_rows / total_all_rows * 100:.1f}%)"
-        )
 
-        file_size_mb = os.path.getsize(export_file_filtered) / (1024 * 1024)
-        logging.info(f"File {export_file_filtered} size is {file_size_mb:.2f} MB")
+def parse_messdaten(df_einsatz_days, df_einsaetze):
+    """
+    Incrementally updates the Smiley exports and the SQLite database from the Messdaten TXT files.
+
+    A manifest (path, size, mtime) of all TXT files tells which Standort folders changed since the last run. Only
+    the new or modified TXT files of those folders are parsed (the others are read from the cache in data/parsed),
+    their rows replace the rows of the Standort in SQLite and in the per-Standort CSVs in data/standorte, and only
+    their statistics are recomputed. If the Einsatzplaene change, everything is rebuilt.
+    The folders are parsed in parallel (see parse_standorte), this process alone writes to SQLite.
+    """
+    messdaten_path = os.path.join("data_orig", "Datenablage")
+    current_zyklus = int(df_einsaetze["Zyklus"].max())
+    previous_zyklus = current_zyklus - 1
+    zyklus_filter = {current_zyklus, previous_zyklus}
+
+    export_file_all_unfiltered = os.path.join("data", "all_data.csv")
+    export_file_filtered = os.path.join("data", "current_previous_cycles_data.csv")
+    export_file_stats = os.path.join("data", "all_stat.csv")
+
+    manifest = open_manifest()
+    einsatzplan_hash = str(pd.util.hash_pandas_object(df_einsaetze.astype(str), index=False).sum())
+    row = manifest.execute("SELECT value FROM state WHERE key = 'einsatzplan_hash'").fetchone()
+    rebuild = row is None or row[0] != einsatzplan_hash or not os.path.exists(SQLITE_PATH)
+
+    current_folders = scan_messdaten_folders(messdaten_path)
+    stored_folders = {}
+    for path, folder, size, mtime_ns in manifest.execute("SELECT path, folder, size, mtime_ns FROM files"):
+        stored_folders.setdefault(folder, {})[path] = (size, mtime_ns)
+    affected_folders = get_affected_folders(current_folders, stored_folders, rebuild)
+    if not affected_folders:
+        manifest.close()
+        logging.info("No Messdaten files changed since the last run.")
+        return None, None
+    logging.info(
+        f"Processing {len(affected_folders)} of {len(current_folders)} Messdaten folders (rebuild: {rebuild})..."
+    )
 
-        export_file_zip = export_file_filtered + ".zip"
-        with zipfile.ZipFile(export_file_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(export_file_filtered, os.path.basename(export_file_filtered))
+    os.makedirs(os.path.dirname(SQLITE_PATH), exist_ok=True)
+    os.makedirs(STANDORTE_DIR, exist_ok=True)
+    conn = sqlite3.connect(SQLITE_PATH)
+    logging.info(f"Opening SQLite database {SQLITE_PATH}...")
+    init_sqlite(conn, clear=rebuild)
+    if rebuild:
+        shutil.rmtree(PARSED_DIR, ignore_errors=True)
+        shutil.rmtree(STANDORTE_DIR, ignore_errors=True)
+        os.makedirs(STANDORTE_DIR)
+
+    tasks = []
+    for folder in affected_folders:
+        remove_standort(folder, conn)
+        files = current_folders.get(folder)
+        if not files:
+            logging.info(f"No data in folder {folder}...")
+            continue
+        id_standort = get_id_standort(folder)
+        if id_standort not in df_einsaetze.id_Standort.values:
+            logging.warning(
+                f"Data in the folder {folder}, but either id_standort {id_standort} "
+                "not in Einsatzplan or with non-valid values!"
+            )
+            continue
+        changed_files = [f for f, stat in files.items() if stored_folders.get(folder, {}).get(f) != stat]
+        tasks.append((folder, id_standort, changed_files, sum(size for size, _ in files.values())))
 
-        export_file_to_upload = export_file_zip
-        logging.info(f"Created compressed file: {export_file_zip}")
+    logging.info(f"Parsing {len(tasks)} Standort folders with {SMILEYS_WORKERS} worker(s)...")
+    for sqlite_file in parse_standorte(tasks, df_einsatz_days, df_einsaetze, zyklus_filter):
+        append_to_sqlite(*pd.read_pickle(sqlite_file), conn)
+        os.remove(sqlite_file)
 
-        zip_size_mb = os.path.getsize(export_file_zip) / (1024 * 1024)
-        if file_size_mb > 0:
-            logging.info(
-                f"Compressed file size: {zip_size_mb:.2f} MB "
-                f"(compression ratio: {zip_size_mb / file_size_mb * 100:.1f}%)"
-            )
-        else:
-            logging.info(f"Compressed file size: {zip_size_mb:.2f} MB")
+    standorte = [folder for folder in current_folders if os.path.exists(get_standort_files(folder)[0])]
+    if not standorte:
+        conn.close()
+        manifest.close()
+        logging.info("No messdaten rows processed. Exiting...")
+        return None, None
+
+    logging.info(f"Assembling {export_file_all_unfiltered} from {len(standorte)} Standorte...")
+    concat_csv_files([get_standort_files(folder)[0] for folder in standorte], export_file_all_unfiltered)
+    filtered_parts = [get_standort_files(folder)[1] for folder in standorte]
+    filtered_parts = [path for path in filtered_parts if os.path.exists(path)]
+    if filtered_parts:
+        concat_csv_files(filtered_parts, export_file_filtered)
+    else:
+        logging.warning(
+            f"No datapoints for cycles {previous_zyklus} and {current_zyklus}; writing empty {export_file_filtered}"
+        )
+        pd.read_csv(get_standort_files(standorte[0])[0], nrows=0).to_csv(export_file_filtered, index=False)
+    logging.info(f"Extracted data for cycles {previous_zyklus} and {current_zyklus} to {export_file_filtered}")
 
-        if zip_size_mb > 240:
-            logging.warning(f"Even the compressed file {export_file_zip} exceeds the OpenDataSoft 240 MB limit!")
-            logging.warning("See https://userguide.opendatasoft.com/en/articles/2248706 for more information.")
-            logging.warning("Consider reducing the number of cycles included or implementing further compression.")
+    file_size_mb = os.path.getsize(export_file_filtered) / (1024 * 1024)
+    logging.info(f"File {export_file_filtered} size is {file_size_mb:.2f} MB")
 
-        stat_df = pd.concat(stat_dfs)
-        stat_df.to_csv(export_file_stats, index=False)
+    export_file_zip = export_file_filtered + ".zip"
+    with zipfile.ZipFile(export_file_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
+        zipf.write(export_file_filtered, os.path.basename(export_file_filtered))
 
-        finalize_sqlite(conn)
-        conn.close()
-        gc.collect()
+    export_file_to_upload = export_file_zip
+    logging.info(f"Created compressed file: {export_file_zip}")
 
-        ct.update_hash_file(list_path)
-        return export_file_to_upload, export_file_stats
-    return None, None
+    zip_size_mb = os.path.getsize(export_file_zip) / (1024 * 1024)
+    if file_size_mb > 0:
+        logging.info(
+            f"Compressed file size: {zip_size_mb:.2f} MB (compression ratio: {zip_size_mb / file_size_mb * 100:.1f}%)"
+        )
+    else:
+        logging.info(f"Compressed file size: {zip_size_mb:.2f} MB")
+
+    if zip_size_mb > 240:
+        logging.warning(f"Even the compressed file {export_file_zip} exceeds the OpenDataSoft 240 MB limit!")
+        logging.warning("See https://userguide.opendatasoft.com/en/articles/2248706 for more information.")
+        logging.warning("Consider reducing the number of cycles included or implementing further compression.")
+
+    stat_df = pd.concat([pd.read_csv(get_standort_files(folder)[2]) for folder in standorte])
+    stat_df.to_csv(export_file_stats, index=False)
+
+    finalize_sqlite(conn)
+    conn.close()
+    gc.collect()
+
+    # Only record the new state of the files once all exports are written
+    with manifest:
+        manifest.execute("DELETE FROM files")
+        manifest.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?)",
+            [(f, folder, *stat) for folder, files in current_folders.items() for f, stat in files.items()],
+        )
+        manifest.execute("INSERT OR REPLACE INTO state VALUES ('einsatzplan_hash', ?)", (einsatzplan_hash,))
+    manifest.close()
+    return export_file_to_upload, export_file_stats
+
+
+def is_dt(timestamps, timezone="Europe/Zurich"):
+    """
+    Flags naive wall-clock timestamps that are in standard time (not in daylight saving time) in the given timezone.
+
+    Times that are ambiguous or do not exist around a DST transition count as daylight saving time, and NaT as
+    False, as with the previous per-row pytz localization. Works on the whole column at once: the UTC offset of each
+    timestamp is derived from a single tz_localize call.
+    """
+    standard_offset = min(pd.Timestamp(f"2001-{month:02d}-01", tz=timezone).utcoffset() for month in (1, 7))
+    localized = timestamps.dt.tz_localize(
+        timezone, ambiguous=np.ones(len(timestamps), dtype=bool), nonexistent="shift_forward"
+    )
+    utc_offset = localized.dt.tz_localize(None) - localized.dt.tz_convert(None)
+    return timestamps.notna() & (utc_offset == standard_offset)
 
 
-def is_dt(datetime, timezone):
-    try:
-        return timezone.localize(datetime).dst() == timedelta(0)
-    except (pytz.NonExistentTimeError, pytz.AmbiguousTimeError):
-        return True
-    except ValueError:
-        return False
+def get_parsed_cache_file(f):
+    return os.path.join(PARSED_DIR, f"{blake2b(f.encode('utf-8')).hexdigest()}.pkl")
 
 
-def parse_single_messdaten_folder(folder, df_einsatz_days, df_einsatze, id_standort):
+def parse_single_messdaten_folder(folder, df_einsatz_days, df_einsatze, id_standort, changed_files=None):
+    """
+    Parses the TXT files of a Standort folder and calculates its statistics.
+    Files not in changed_files are read from the parse cache if possible (changed_files=None parses everything).
+    """
     logging.info(f"Working through folder {folder}...")
     # Go recursively into folders until TXT files are found
     tagesdaten_files = glob.glob(os.path.join(folder, "**", "*.TXT"), recursive=True)
     messdaten_dfs_pro_standort = []
+    os.makedirs(PARSED_DIR, exist_ok=True)
     for f in tagesdaten_files:
+        cache_file = get_parsed_cache_file(f)
+        if changed_files is not None and f not in changed_files and os.path.exists(cache_file):
+            messdaten_dfs_pro_standort.append(pd.read_pickle(cache_file))
+            continue
         logging.info(f"Parsing Messdaten File {f}...")
         # p = re.compile(r'Datenablage\\\\(?P<idstandort>\d+)_')
         df = (
@@ -181,7 +350,7 @@ def parse_single_messdaten_folder(folder, df_einsatz_days, df_einsatze, id_stand
         df = df[df.V_Einfahrt.str.match(r"^\d{3}$")]
         df = df[df.V_Ausfahrt.str.match(r"^\d{3}$")]
         df["Messung_Timestamp"] = pd.to_datetime(df.Messung_Datum + "T" + df.Messung_Zeit, format="%d.%m.%yT%H:%M:%S")
-        df["is_dt"] = df["Messung_Timestamp"].apply(lambda x: is_dt(x, pytz.timezone("Europe/Zurich")))
+        df["is_dt"] = is_dt(df["Messung_Timestamp"])
         df.loc[df["is_dt"], "Messung_Timestamp"] = df["Messung_Timestamp"] - pd.Timedelta(hours=1)
         df.Messung_Timestamp = df.Messung_Timestamp.dt.tz_localize(
             "Europe/Zurich",
@@ -224,6 +393,7 @@ def parse_single_messdaten_folder(folder, df_einsatz_days, df_einsatze, id_stand
         logging.info('Removing measurements with phase "Vor Vormessung"...')
         df_m = df_m[df_m.Phase != "Vor Vormessung"]
 
+        df_m.to_pickle(cache_file)
         messdaten_dfs_pro_standort.append(df_m)
 
     df_all_pro_standort = pd.concat(messdaten_dfs_pro_standort)
@@ -318,7 +488,7 @@ def parse_einsatzplaene():
                 pd.to_datetime(df[f"Uhrzeit_{ph}"], format="%H:%M:%S").dt.time.astype(str)
             )
             df.drop(columns=[f"Datum_{ph}", f"Uhrzeit_{ph}"], inplace=True)
-            df["is_dt"] = df[col].apply(lambda x: is_dt(x, pytz.timezone("Europe/Zurich")))
+            df["is_dt"] = is_dt(df[col])
             df.loc[df["is_dt"], col] = df[col] - pd.Timedelta(hours=1)
             df[col] = (
                 df[col].dt.tz_localize("Europe/Zurich", ambiguous="infer", nonexistent="NaT").drop(columns=["is_dt"])
@@ -404,7 +574,7 @@ def _prepare_sqlite_frames(df):
     return df_einsatzplan, df_einzelmessungen
 
 
-def init_sqlite(conn):
+def init_sqlite(conn, clear=True):
     cursor = conn.cursor()
     logging.info("Creating table Einsatzplan...")
     cursor.execute("""
@@ -424,7 +594,8 @@ def init_sqlite(conn):
         geometry TEXT
     )
     """)
-    cursor.execute("DELETE FROM Einsatzplan")
+    if clear:
+        cursor.execute("DELETE FROM Einsatzplan")
 
     logging.info("Creating table Einzelmessungen...")
     cursor.execute("""
@@ -442,12 +613,12 @@ def init_sqlite(conn):
         FOREIGN KEY (ID) REFERENCES Einsatzplan (ID) ON DELETE CASCADE
     )
     """)
-    cursor.execute("DELETE FROM Einzelmessungen")
+    if clear:
+        cursor.execute("DELETE FROM Einzelmessungen")
     conn.commit()
 
 
-def append_to_sqlite(df, conn):
-    df_einsatzplan, df_einzelmessungen = _prepare_sqlite_frames(df)
+def append_to_sqlite(df_einsatzplan, df_einzelmessungen, conn):
     df_einsatzplan.to_sql("Einsatzplan", conn, if_exists="append", index=False)
     df_einzelmessungen.to_sql("Einzelmessungen", conn, if_exists="append", index=False, chunksize=SQLITE_CHUNK_SIZE)
 
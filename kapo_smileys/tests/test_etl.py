@@ -0,0 +1,28 @@
+from etl import get_affected_folders
+
+FOLDER_ZYKLUS_1 = "Datenablage/281_Hammerstrasse_Zyklus_1"
+FOLDER_ZYKLUS_2 = "Datenablage/281_Hammerstrasse_Zyklus_2"
+OTHER_FOLDER = "Datenablage/300_Riehenring"
+
+
+def test_folders_of_same_standort_are_processed_together():
+    stored_folders = {
+        FOLDER_ZYKLUS_1: {"a.TXT": (10, 1)},
+        FOLDER_ZYKLUS_2: {"b.TXT": (10, 1)},
+        OTHER_FOLDER: {"c.TXT": (10, 1)},
+    }
+    current_folders = stored_folders | {FOLDER_ZYKLUS_2: {"b.TXT": (20, 2)}}
+    assert get_affected_folders(current_folders, stored_folders) == [FOLDER_ZYKLUS_1, FOLDER_ZYKLUS_2]
+
+
+def test_removed_folder_affects_other_folders_of_its_standort():
+    stored_folders = {FOLDER_ZYKLUS_1: {"a.TXT": (10, 1)}, FOLDER_ZYKLUS_2: {"b.TXT": (10, 1)}}
+    current_folders = {FOLDER_ZYKLUS_1: {"a.TXT": (10, 1)}}
+    assert get_affected_folders(current_folders, stored_folders) == [FOLDER_ZYKLUS_1, FOLDER_ZYKLUS_2]
+
+
+def test_unchanged_folders_are_not_affected():
+    stored_folders = {FOLDER_ZYKLUS_1: {"a.TXT": (10, 1)}}
+    current_folders = {FOLDER_ZYKLUS_1: {"a.TXT": (10, 1)}, OTHER_FOLDER: {}}
+    assert get_affected_folders(current_folders, stored_folders) == []
+    assert get_affected_folders(current_folders, stored_folders, rebuild=True) == [FOLDER_ZYKLUS_1, OTHER_FOLDER]
@@ -1,7 +1,6 @@
 import json
 import logging
 import os
-import warnings
 from datetime import datetime
 
 import common
@@ -16,109 +15,163 @@ FTP_PASS = os.getenv("FTP_PASS_07")
 ODS_PUSH_URLS = json.loads(os.getenv("ODS_PUSH_URLS_LUFTQUALITAET_CH", "{}"))
 
 
+PERIOD_STARTS = ["01.01.2000", "01.01.2010", "01.01.2020"]
+BASE_PAYLOAD = {
+    "jsform": "true",
+    "querytype": "station",
+    "station_interval": "hour",
+    "station_output": "csv",
+    "pollutant_interval": "hour",
+    "pollutant_output": "interactive",
+    "timerange": "custom",
+    "submit": "Abfrage",
+}
+STATION_PAYLOAD = [
+    {
+        "station": "bsBET",  # Chrischona Bettingen
+        "pollutants[]": ["O3"],
+        "ods_id": "100048",
+    },
+    {
+        "station": "bsBSJ",  # St. Johannplatz
+        "pollutants[]": ["PM10", "PM2.5", "O3", "NO2"],
+        "ods_id": "100049",
+    },
+    {
+        "station": "bsBFB",  # Feldbergstrasse
+        "pollutants[]": ["PM10", "PM2.5", "O3", "NO2"],
+        "ods_id": "100050",
+    },
+]
+
+
 def main():
+    urllib3.disable_warnings()
     today_string = datetime.today().strftime("%d.%m.%Y")
-    decades = ["01.01.2000", "01.01.2010", "01.01.2020", today_string]
-    for i in range(len(decades) - 1):
-        logging.info(f"Processing data for the period {decades[i]} - {decades[i + 1]}...")
-
-        base_payload = {
-            "jsform": "true",
-            "querytype": "station",
-            "station_interval": "hour",
-            "station_output": "csv",
-            "pollutant_interval": "hour",
-            "pollutant_output": "interactive",
-            "timerange": "custom",
-            "startdate": decades[i],
-            "stopdate": decades[i + 1],
-            "submit": "Abfrage",
+    # Stations are processed one after the other: common.upload_ftp changes the working directory of the whole
+    # process, which would break the relative data/ paths of stations running in other threads.
+    for station in STATION_PAYLOAD:
+        process_station(station, today_string)
+
+
+def process_station(station, today_string):
+    logging.info(f"Handling station {station['station']}...")
+    period_stops = PERIOD_STARTS[1:] + [today_string]
+    for startdate, stopdate in zip(PERIOD_STARTS[:-1], period_stops[:-1]):
+        process_closed_period(station, startdate, stopdate)
+    process_open_period(station, PERIOD_STARTS[-1], period_stops[-1])
+
+
+def get_period_files(station_abbrev, startdate):
+    prefix = os.path.join("data", f"Luftqualitaet_ch-{station_abbrev}-{startdate[-4:]}")
+    return f"{prefix}-raw.csv", f"{prefix}.csv", f"{prefix}.frozen"
+
+
+def download_raw_file(station, startdate, stopdate, raw_file):
+    logging.info(f"Requesting data of station {station['station']} for the period {startdate} - {stopdate}...")
+    # merge dicts, see e.g. https://towardsdatascience.com/merge-dictionaries-in-python-d4e9ce137374
+    payload = station | BASE_PAYLOAD | {"startdate": startdate, "stopdate": stopdate}
+    r = common.requests_post(
+        url="https://luftqualitaet.ch/messdaten/datenarchiv/abfrage",
+        data=payload,
+        verify=False,
+        stream=True,
+    )
+    logging.info(f"Writing data into file {raw_file}...")
+    with open(raw_file, "wb") as fd:
+        for chunk in r.iter_content(chunk_size=1024 * 1024):
+            fd.write(chunk)
+
+
+def read_raw_file(raw_file):
+    logging.info(f"Reading {raw_file} into df...")
+    # Some lines have more than 5 columns, ignoring those.
+    df = pd.read_csv(
+        raw_file,
+        skiprows=5,
+        encoding="cp1252",
+        sep=";",
+        on_bad_lines="skip",
+    )
+    logging.info("Removing empty lines...")
+    cols = df.columns.to_list()
+    data_cols = list(filter(lambda item: item not in ["Datum/Zeit"], cols))
+    df = df.dropna(how="all", subset=data_cols).reset_index(drop=True)
+    logging.info("Renaming columns...")
+    return df.rename(
+        columns={
+            "Datum/Zeit": "datum_zeit",
+            "PM10 (Stundenmittelwerte  [µg/m³])": "pm10_stundenmittelwerte_ug_m3",
+            "O3 (Stundenmittelwerte  [µg/m³])": "o3_stundenmittelwerte_ug_m3",
+            "NO2 (Stundenmittelwerte  [µg/m³])": "no2_stundenmittelwerte_ug_m3",
+            "PM2.5 (Stundenmittelwerte  [µg/m³])": "pm2_5_stundenmittelwerte_ug_m3",
         }
-        station_payload = [
-            {
-                "station": "bsBET",  # Chrischona Bettingen
-                "pollutants[]": ["O3"],
-                "ods_id": "100048",
-            },
-            {
-                "station": "bsBSJ",  # St. Johannplatz
-                "pollutants[]": ["PM10", "PM2.5", "O3", "NO2"],
-                "ods_id": "100049",
-            },
-            {
-                "station": "bsBFB",  # Feldbergstrasse
-                "pollutants[]": ["PM10", "PM2.5", "O3", "NO2"],
-                "ods_id": "100050",
-            },
-        ]
-
-        for station in station_payload:
-            station_abbrev = station["station"]
-            logging.info(f"Handling station {station_abbrev}...")
-            # merge dicts, see e.g. https://towardsdatascience.com/merge-dictionaries-in-python-d4e9ce137374
-            payload = station | base_payload
-            logging.info("Requesting data from web service...")
-            urllib3.disable_warnings()
-            r = common.requests_post(
-                url="https://luftqualitaet.ch/messdaten/datenarchiv/abfrage",
-                data=payload,
-                verify=False,
-            )
-            warnings.resetwarnings()
-
-            raw_file = os.path.join("data", f"Luftqualitaet_ch-{station_abbrev}-{decades[i][-4:]}-raw.csv")
-            logging.info(f"Writing data into file {raw_file}...")
-            with open(raw_file, "wb") as fd:
-                for chunk in r.iter_content(chunk_size=128):
-                    fd.write(chunk)
-
-            if ct.has_changed(raw_file):
-                logging.info("Reading csv into df...")
-                # Some lines have more than 5 columns, ignoring those.
-                df = pd.read_csv(
-                    raw_file,
-                    skiprows=5,
-                    encoding="cp1252",
-                    sep=";",
-                    on_bad_lines="skip",
-                )
-                df = df.rename(columns={})
-                logging.info("Removing empty lines...")
-                cols = df.columns.to_list()
-                data_cols = list(filter(lambda item: item not in ["Datum/Zeit"], cols))
-                df = df.dropna(how="all", subset=data_cols).reset_index(drop=True)
-                logging.info("Renaming columns...")
-                df = df.rename(
-                    columns={
-                        "Datum/Zeit": "datum_zeit",
-                        "PM10 (Stundenmittelwerte  [µg/m³])": "pm10_stundenmittelwerte_ug_m3",
-                        "O3 (Stundenmittelwerte  [µg/m³])": "o3_stundenmittelwerte_ug_m3",
-                        "NO2 (Stundenmittelwerte  [µg/m³])": "no2_stundenmittelwerte_ug_m3",
-                        "PM2.5 (Stundenmittelwerte  [µg/m³])": "pm2_5_stundenmittelwerte_ug_m3",
-                    }
-                )
-                export_file = os.path.join("data", f"Luftqualitaet_ch-{station_abbrev}-{decades[i][-4:]}.csv")
-                df.to_csv(export_file, index=False)
-                common.upload_ftp(export_file, FTP_SERVER, FTP_USER, FTP_PASS, "luftqualitaet_ch")
-                if ct.has_changed(export_file):
-                    chunk_size = 25000
-                    df_chunks = chunked(df.index, chunk_size)
-                    for df_chunk_indexes in df_chunks:
-                        logging.info("Submitting a data chunk to ODS...")
-                        df_chunk = df.iloc[df_chunk_indexes]
-                        df_json = df_chunk.to_json(orient="records")
-                        # print(f'Pushing the following data to ODS: {json.dumps(json.loads(payload), indent=4)}')
-                        # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
-                        urllib3.disable_warnings()
-                        rq = common.requests_post(
-                            url=ODS_PUSH_URLS[station_abbrev],
-                            data=df_json,
-                            verify=False,
-                        )
-                        warnings.resetwarnings()
-                        rq.raise_for_status()
-                    ct.update_hash_file(export_file)
-                ct.update_hash_file(raw_file)
+    )
+
+
+def push_to_ods(df, station_abbrev, chunk_size=25000):
+    for df_chunk_indexes in chunked(range(len(df)), chunk_size):
+        logging.info(f"Submitting a data chunk of station {station_abbrev} to ODS...")
+        df_json = df.iloc[df_chunk_indexes].to_json(orient="records")
+        # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
+        rq = common.requests_post(
+            url=ODS_PUSH_URLS[station_abbrev],
+            data=df_json,
+            verify=False,
+        )
+        rq.raise_for_status()
+
+
+def process_full_period(station, startdate, stopdate):
+    station_abbrev = station["station"]
+    raw_file, export_file, _ = get_period_files(station_abbrev, startdate)
+    download_raw_file(station, startdate, stopdate, raw_file)
+    if ct.has_changed(raw_file):
+        df = read_raw_file(raw_file)
+        df.to_csv(export_file, index=False)
+        common.upload_ftp(export_file, FTP_SERVER, FTP_USER, FTP_PASS, "luftqualitaet_ch")
+        if ct.has_changed(export_file):
+            push_to_ods(df, station_abbrev)
+            ct.update_hash_file(export_file)
+        ct.update_hash_file(raw_file)
+
+
+def process_closed_period(station, startdate, stopdate):
+    """Closed periods do not change anymore, so they are frozen after they have been processed once."""
+    _, _, frozen_file = get_period_files(station["station"], startdate)
+    if os.path.exists(frozen_file):
+        logging.info(f"Period {startdate} - {stopdate} of station {station['station']} is frozen, skipping...")
+        return
+    process_full_period(station, startdate, stopdate)
+    with open(frozen_file, "w") as f:
+        f.write(datetime.now().isoformat())
+
+
+def process_open_period(station, startdate, stopdate):
+    """
+    Fetches the open period from the day of its last stored hour on, appends the new hours to the export file
+    and pushes only those to ODS. Without a stored export file the whole period is processed.
+    """
+    station_abbrev = station["station"]
+    raw_file, export_file, _ = get_period_files(station_abbrev, startdate)
+    if not os.path.exists(export_file):
+        process_full_period(station, startdate, stopdate)
+        return
+    df_stored = pd.read_csv(export_file)
+    last_timestamp = pd.to_datetime(df_stored["datum_zeit"], dayfirst=True, errors="coerce").max()
+    fetch_start = last_timestamp.strftime("%d.%m.%Y") if pd.notna(last_timestamp) else startdate
+    download_raw_file(station, fetch_start, stopdate, raw_file)
+    df_recent = read_raw_file(raw_file)
+    df_new = df_recent[~df_recent["datum_zeit"].isin(df_stored["datum_zeit"])]
+    if df_new.empty:
+        logging.info(f"No new hours for station {station_abbrev} since {last_timestamp}.")
+        return
+    logging.info(f"Appending {len(df_new)} new hours for station {station_abbrev} to {export_file}...")
+    df = pd.concat([df_stored, df_new], ignore_index=True)
+    df.to_csv(export_file, index=False)
+    common.upload_ftp(export_file, FTP_SERVER, FTP_USER, FTP_PASS, "luftqualitaet_ch")
+    push_to_ods(df_new, station_abbrev)
+    ct.update_hash_file(export_file)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,9 @@ import io
 import json
 import logging
 import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import common
 import pandas as pd
@@ -13,6 +16,8 @@ load_dotenv()
 FTP_SERVER = os.getenv("FTP_SERVER")
 FTP_USER = os.getenv("FTP_USER_09")
 FTP_PASS = os.getenv("FTP_PASS_09")
+# Number of worker processes creating the per-site dashboard files (1 = sequentially in this process)
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "1"))
 
 
 def create_files_for_dashboard(df, filename):
@@ -62,43 +67,22 @@ def create_files_for_dashboard(df, filename):
         "FLIR_KtBS_FG.csv": ["Total"],
     }
 
-    # Create a separate dataset per site and traffic type
-    all_sites = df.Zst_id.unique()
-    for site in all_sites:
-        for traffic_type in ["MIV", "Velo", "Fussgänger"]:
-            site_data = df[df.Zst_id.eq(site) & df.TrafficType.eq(traffic_type)]
-
-            if site_data.empty:
-                continue
-
-            # Determine subfolder based on traffic type and filename
-            if traffic_type == "Fussgänger":
-                subfolder = "Fussgaenger"
-            elif filename == "MIV_Speed.csv":
-                subfolder = "MIV_Speed"
-            else:
-                subfolder = traffic_type
-
-            # Save the original site data
-            current_filename = os.path.join("data", "sites", subfolder, f"{str(site)}.csv")
-            logging.info(f"Saving {current_filename}...")
-            site_data.to_csv(current_filename, sep=";", encoding="utf-8", index=False)
-
-            if ct.has_changed(current_filename):
-                # Add Direction_LaneName column
-                site_data["Direction_LaneName"] = (
-                    site_data["DirectionName"].astype(str) + "#" + site_data["LaneName"].astype(str)
-                )
-                # Convert Date to string format like '2022-01-01'
-                site_data["Date"] = pd.to_datetime(site_data["Date"], format="%d.%m.%Y").dt.strftime("%Y-%m-%d")
-
-                # Perform aggregations
-                aggregate_hourly(site_data, categories, subfolder, site, filename)
-                aggregate_daily(site_data, categories, subfolder, site, filename)
-                aggregate_monthly(site_data, categories, subfolder, site, filename)
-                aggregate_yearly(site_data, categories, subfolder, site, filename)
-
-                ct.update_hash_file(current_filename)
+    # Create a separate dataset per site and traffic type, partitioning the data in a single groupby pass
+    start = time.perf_counter()
+    site_groups = (
+        (site_data, site, traffic_type, filename, categories)
+        for (site, traffic_type), site_data in df.groupby(["Zst_id", "TrafficType"], observed=True, sort=False)
+        if traffic_type in ["MIV", "Velo", "Fussgänger"]
+    )
+    if DASHBOARD_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=DASHBOARD_WORKERS) as executor:
+            futures = [executor.submit(process_site, *args) for args in site_groups]
+            for future in futures:
+                future.result()
+    else:
+        for args in site_groups:
+            process_site(*args)
+    logging.info(f"Created site files for {filename} in {time.perf_counter() - start:.1f}s.")
 
     # Calculate DTV per ZST and traffic type
     df_locations = download_locations()
@@ -123,6 +107,53 @@ def create_files_for_dashboard(df, filename):
             save_as_list_of_lists(df_dtv_fuss, current_filename_fuss)
 
 
+def process_site(site_data, site, traffic_type, filename, categories):
+    """
+    Saves the data of one site and traffic type and, if it changed, creates the aggregated dashboard files.
+
+    Parameters:
+    - site_data (pd.DataFrame): The data of the site and traffic type.
+    - site (str): Site identifier.
+    - traffic_type (str): One of "MIV", "Velo" or "Fussgänger".
+    - filename (str): The name of the file being processed.
+    - categories (dict): Dictionary mapping filenames to category lists.
+    """
+    if site_data.empty:
+        return
+
+    # Determine subfolder based on traffic type and filename
+    if traffic_type == "Fussgänger":
+        subfolder = "Fussgaenger"
+    elif filename == "MIV_Speed.csv":
+        subfolder = "MIV_Speed"
+    else:
+        subfolder = traffic_type
+
+    # Save the original site data
+    current_filename = os.path.join("data", "sites", subfolder, f"{str(site)}.csv")
+    logging.info(f"Saving {current_filename}...")
+    site_data.to_csv(current_filename, sep=";", encoding="utf-8", index=False)
+
+    if ct.has_changed(current_filename):
+        site_data = site_data.copy()
+        # Add Direction_LaneName column
+        site_data["Direction_LaneName"] = (
+            site_data["DirectionName"].astype(str) + "#" + site_data["LaneName"].astype(str)
+        )
+        # Convert Date to string format like '2022-01-01'
+        site_data["Date"] = pd.to_datetime(site_data["Date"], format="%d.%m.%Y").dt.strftime("%Y-%m-%d")
+
+        # Update the aggregate store for the changed dates only and re-emit the dashboard files from it
+        store_path = os.path.join("data", "aggregates", subfolder, f"{str(site)}_{os.path.splitext(filename)[0]}.db")
+        hourly_agg = update_aggregate_store(site_data, categories[filename], store_path)
+        aggregate_hourly(hourly_agg, categories, subfolder, site, filename)
+        aggregate_daily(hourly_agg, categories, subfolder, site, filename)
+        aggregate_monthly(hourly_agg, categories, subfolder, site, filename)
+        aggregate_yearly(hourly_agg, categories, subfolder, site, filename)
+
+        ct.update_hash_file(current_filename)
+
+
 def upload_list_of_lists():
     filenames = [
         "dtv_MIV.json",
@@ -158,12 +189,80 @@ def save_upload_remove(df, filepath, ftp_subfolder):
     os.remove(filepath)
 
 
-def aggregate_hourly(site_data, categories, subfolder, site, filename):
+def update_aggregate_store(site_data, value_columns, store_path):
+    """
+    Updates the hourly aggregates of a site in its SQLite store and returns all stored hourly aggregates.
+
+    The rows of every date are fingerprinted; only dates whose fingerprint changed (or that disappeared) since the
+    last run are re-aggregated from site_data and replaced in the store, in one transaction.
+
+    Parameters:
+    - site_data (pd.DataFrame): DataFrame containing site data, with Date formatted as '%Y-%m-%d'.
+    - value_columns (list): The count columns to aggregate.
+    - store_path (str): Path of the SQLite store of the site.
+
+    Returns:
+    - pd.DataFrame: Sums per Date, Direction_LaneName and HourFrom of the value columns, ValuesApproved and
+      ValuesEdited, and NumMeasures, the number of distinct DateTimeFrom values.
+    """
+    start = time.perf_counter()
+    sum_columns = value_columns + ["ValuesApproved", "ValuesEdited"]
+    group_cols = ["Date", "Direction_LaneName", "HourFrom"]
+    # Order-independent fingerprint of the rows of each date
+    date_hashes = (
+        pd.util.hash_pandas_object(site_data[group_cols + ["DateTimeFrom"] + sum_columns], index=False)
+        .groupby(site_data["Date"].values)
+        .sum()
+        .astype(str)
+    )
+
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    conn = sqlite3.connect(store_path)
+    try:
+        columns = ", ".join(f'"{col}"' for col in group_cols + sum_columns + ["NumMeasures"])
+        conn.execute(f"CREATE TABLE IF NOT EXISTS hourly ({columns})")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_hourly_date ON hourly (Date)")
+        conn.execute("CREATE TABLE IF NOT EXISTS date_hashes (Date TEXT PRIMARY KEY, hash TEXT)")
+        stored_hashes = pd.read_sql("SELECT Date, hash FROM date_hashes", conn, index_col="Date")["hash"]
+        changed_dates = date_hashes.index[date_hashes.ne(stored_hashes.reindex(date_hashes.index))]
+        removed_dates = stored_hashes.index.difference(date_hashes.index)
+        logging.info(
+            f"{len(changed_dates)} of {len(date_hashes)} dates changed and {len(removed_dates)} were removed "
+            f"since the last update of {store_path}..."
+        )
+        if len(changed_dates) or len(removed_dates):
+            delta = site_data[site_data["Date"].isin(changed_dates)]
+            grouped = delta.groupby(group_cols, observed=True)
+            hourly_delta = grouped[sum_columns].sum()
+            hourly_delta["NumMeasures"] = grouped["DateTimeFrom"].nunique()
+            hourly_delta = hourly_delta.reset_index().astype(object)
+            hourly_delta = hourly_delta.where(hourly_delta.notna(), None)
+            placeholders = ", ".join("?" * len(hourly_delta.columns))
+            with conn:
+                conn.executemany(
+                    "DELETE FROM hourly WHERE Date = ?", [(date,) for date in changed_dates.union(removed_dates)]
+                )
+                conn.executemany("DELETE FROM date_hashes WHERE Date = ?", [(date,) for date in removed_dates])
+                conn.executemany(
+                    f"INSERT INTO hourly VALUES ({placeholders})", hourly_delta.itertuples(index=False, name=None)
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO date_hashes VALUES (?, ?)",
+                    [(date, date_hashes[date]) for date in changed_dates],
+                )
+        hourly_agg = pd.read_sql("SELECT * FROM hourly", conn)
+    finally:
+        conn.close()
+    logging.info(f"Updated aggregate store {store_path} in {time.perf_counter() - start:.1f}s.")
+    return hourly_agg
+
+
+def aggregate_hourly(hourly_agg, categories, subfolder, site, filename):
     """
     Performs hourly aggregation and saves the data.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - hourly_agg (pd.DataFrame): Hourly aggregates of the site, see update_aggregate_store.
     - categories (dict): Dictionary mapping filenames to category lists.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
@@ -171,24 +270,24 @@ def aggregate_hourly(site_data, categories, subfolder, site, filename):
     """
 
     # Determine the date range
-    min_date = pd.to_datetime(site_data["Date"]).min()
-    max_date = pd.to_datetime(site_data["Date"]).max()
+    min_date = pd.to_datetime(hourly_agg["Date"]).min()
+    max_date = pd.to_datetime(hourly_agg["Date"]).max()
     date_range = pd.DataFrame({"Date": pd.date_range(start=min_date, end=max_date).strftime("%Y-%m-%d")})
 
+    # Aggregate ValuesApproved and ValuesEdited by Date and Direction_LaneName
+    df_agg_approved_edited = (
+        hourly_agg.groupby(["Date", "Direction_LaneName"])[["ValuesApproved", "ValuesEdited"]].sum().reset_index()
+    )
+
     for category in categories[filename]:
         # Calculate the total counts per hour for each date, direction, and lane
-        df_to_pivot = site_data[["Date", "Direction_LaneName", "HourFrom", category]].copy()
+        df_to_pivot = hourly_agg[["Date", "Direction_LaneName", "HourFrom", category]].copy()
         df_agg = df_to_pivot.pivot_table(
             index=["Date", "Direction_LaneName"],
             values=category,
             columns="HourFrom",
             aggfunc="sum",
         ).reset_index()
-
-        # Aggregate ValuesApproved and ValuesEdited by Date and Direction_LaneName
-        df_agg_approved_edited = (
-            site_data.groupby(["Date", "Direction_LaneName"])[["ValuesApproved", "ValuesEdited"]].sum().reset_index()
-        )
         df_agg = df_agg.merge(df_agg_approved_edited, on=["Date", "Direction_LaneName"], how="left")
 
         # Create the complete date range for each direction and lane combination
@@ -210,25 +309,25 @@ def aggregate_hourly(site_data, categories, subfolder, site, filename):
         )
 
 
-def aggregate_daily(site_data, categories, subfolder, site, filename):
+def aggregate_daily(hourly_agg, categories, subfolder, site, filename):
     """
     Performs daily aggregation and saves the data.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - hourly_agg (pd.DataFrame): Hourly aggregates of the site, see update_aggregate_store.
     - categories (dict): Dictionary mapping filenames to category lists.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
     """
     # Calculate the daily counts per weekday for each date, direction, and lane
-    df_to_group = site_data[
+    df_to_group = hourly_agg[
         ["Date", "Direction_LaneName"] + categories[filename] + ["ValuesApproved", "ValuesEdited"]
     ].copy()
 
     # Determine the date range
-    min_date = pd.to_datetime(site_data["Date"]).min()
-    max_date = pd.to_datetime(site_data["Date"]).max()
+    min_date = pd.to_datetime(hourly_agg["Date"]).min()
+    max_date = pd.to_datetime(hourly_agg["Date"]).max()
     date_range = pd.DataFrame({"Date": pd.date_range(start=min_date, end=max_date).strftime("%Y-%m-%d")})
 
     df_agg = (
@@ -259,21 +358,23 @@ def aggregate_daily(site_data, categories, subfolder, site, filename):
     )
 
 
-def aggregate_monthly(site_data, categories, subfolder, site, filename):
+def aggregate_monthly(hourly_agg, categories, subfolder, site, filename):
     """
     Aggregates data over months.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - hourly_agg (pd.DataFrame): Hourly aggregates of the site, see update_aggregate_store.
     - categories (dict): Dictionary mapping filenames to category lists.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
     """
     group_cols = ["Year", "Month", "Direction_LaneName"]
-    df_to_group = site_data[
-        group_cols + ["DateTimeFrom"] + categories[filename] + ["ValuesApproved", "ValuesEdited"]
+    df_to_group = hourly_agg[
+        ["Date", "Direction_LaneName", "NumMeasures"] + categories[filename] + ["ValuesApproved", "ValuesEdited"]
     ].copy()
+    df_to_group["Year"] = df_to_group["Date"].str[:4].astype(int)
+    df_to_group["Month"] = df_to_group["Date"].str[5:7].astype(int)
 
     # Aggregate data by month
     df_agg = (
@@ -282,8 +383,7 @@ def aggregate_monthly(site_data, categories, subfolder, site, filename):
     df_agg = df_agg[df_agg["Total"] > 0]
 
     # Count the number of measures
-    df_measures = df_to_group.groupby(group_cols)["DateTimeFrom"].nunique().reset_index()
-    df_measures.rename(columns={"DateTimeFrom": "NumMeasures"}, inplace=True)
+    df_measures = df_to_group.groupby(group_cols)["NumMeasures"].sum().reset_index()
     df_agg = df_agg.merge(df_measures, on=group_cols, how="left")
     for col in categories[filename]:
         df_agg[col] = df_agg[col] / df_agg["NumMeasures"] * 24
@@ -299,21 +399,23 @@ def aggregate_monthly(site_data, categories, subfolder, site, filename):
     )
 
 
-def aggregate_yearly(site_data, categories, subfolder, site, filename):
+def aggregate_yearly(hourly_agg, categories, subfolder, site, filename):
     """
     Aggregates data over years.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - hourly_agg (pd.DataFrame): Hourly aggregates of the site, see update_aggregate_store.
     - categories (dict): Dictionary mapping filenames to category lists.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
     """
     group_cols = ["Year", "Direction_LaneName"]
-    df_to_group = site_data[
-        group_cols + ["DateTimeFrom"] + categories[filename] + ["ValuesApproved", "ValuesEdited"]
+    df_to_group = hourly_agg[
+        ["Date", "Direction_LaneName", "NumMeasures"] + categories[filename] + ["ValuesApproved", "ValuesEdited"]
     ].copy()
+    df_to_group["Year"] = df_to_group["Date"].str[:4].astype(int)
+    df_to_group["Month"] = df_to_group["Date"].str[5:7].astype(int)
 
     # Aggregate data by year
     df_agg = (
@@ -322,17 +424,16 @@ def aggregate_yearly(site_data, categories, subfolder, site, filename):
     df_agg = df_agg[df_agg["Total"] > 0]
 
     # Count the number of measures
-    df_measures = df_to_group.groupby(group_cols)["DateTimeFrom"].nunique().reset_index()
-    df_measures.rename(columns={"DateTimeFrom": "NumMeasures"}, inplace=True)
+    df_measures = df_to_group.groupby(group_cols)["NumMeasures"].sum().reset_index()
     df_agg = df_agg.merge(df_measures, on=group_cols, how="left")
     for col in categories[filename]:
         df_agg[col] = df_agg[col] / df_agg["NumMeasures"] * 24
 
     # Create a complete range of years
-    min_year = site_data["DateTimeFrom"].min().year
-    max_year = site_data["DateTimeFrom"].max().year
+    min_year = df_to_group["Year"].min()
+    max_year = df_to_group["Year"].max()
     years = pd.DataFrame({"Year": range(min_year, max_year + 1)})
-    direction_lanes = site_data["Direction_LaneName"].unique()
+    direction_lanes = hourly_agg["Direction_LaneName"].unique()
     complete_years = pd.MultiIndex.from_product(
         [years["Year"], direction_lanes], names=["Year", "Direction_LaneName"]
     ).to_frame(index=False)
@@ -2,6 +2,7 @@ import logging
 import os
 import platform
 import sqlite3
+import time
 from shutil import copy2
 
 import common
@@ -16,6 +17,12 @@ FTP_SERVER = os.getenv("FTP_SERVER")
 FTP_USER = os.getenv("FTP_USER_09")
 FTP_PASS = os.getenv("FTP_PASS_09")
 
+# A count is identified by these columns; they form the unique index of every table. DateTimeFrom is local time, so
+# the two counts of the hour that is repeated when daylight saving time ends are told apart by DateTimeFromUTC.
+KEY_COLUMNS = ["SiteCode", "DateTimeFromUTC", "DirectionName", "LaneCode", "TrafficType"]
+# Rows this far before the last loaded count are loaded again, so that late corrections of values are picked up
+HIGH_WATER_MARK_LOOKBACK = pd.Timedelta(days=7)
+
 
 def _table_row_count(db_path, table):
     conn = sqlite3.connect(db_path)
@@ -37,6 +44,7 @@ def parse_truncate(path, filename):
     copy2(path_to_orig_file, path_to_copied_file)
     # Parse, process, truncate and write csv file
     logging.info(f"Reading file {filename}...")
+    start = time.perf_counter()
     data = pd.read_csv(
         path_to_copied_file,
         engine="python",
@@ -60,6 +68,7 @@ def parse_truncate(path, filename):
     data["Weekday"] = data["DateTimeFrom"].dt.weekday
     data["HourFrom"] = data["DateTimeFrom"].dt.hour
     data["DayOfYear"] = data["DateTimeFrom"].dt.dayofyear
+    logging.info(f"Read and prepared {len(data)} rows of {filename} in {time.perf_counter() - start:.1f}s.")
 
     # 'LSA_Count.csv'
     if "LSA" in filename:
@@ -101,19 +110,8 @@ def parse_truncate(path, filename):
         if not fuss_data.empty:
             generated_filenames += generate_files(fuss_data, fuss_filename)
         # Add data to databases
-        logging.info("Adding data to database MIV")
-        conn = sqlite3.connect(os.path.join("data", "datasette", "MIV.db"))
-        miv_data.to_sql("MIV", conn, if_exists="append", index=False)
-        conn.commit()
-        conn.close()
-        logging.info("Adding data to database Velo_Fuss")
-        conn = sqlite3.connect(os.path.join("data", "datasette", "Velo_Fuss.db"))
-        if not velo_data.empty:
-            velo_data.to_sql("Velo_Fuss", conn, if_exists="append", index=False)
-        if not fuss_data.empty:
-            fuss_data.to_sql("Velo_Fuss", conn, if_exists="append", index=False)
-        conn.commit()
-        conn.close()
+        upsert_into_database(miv_data, "MIV", filename)
+        upsert_into_database(pd.concat([velo_data, fuss_data]), "Velo_Fuss", filename)
     # 'FLIR_KtBS_MIV6.csv', 'FLIR_KtBS_Velo.csv', 'FLIR_KtBS_FG.csv'
     elif "FLIR" in filename:
         logging.info("Retrieving Zst_id as the SiteCode...")
@@ -126,18 +124,7 @@ def parse_truncate(path, filename):
         data["TrafficType"] = "MIV" if "MIV6" in filename else "Velo" if "Velo" in filename else "Fussgänger"
         dashboard_calc.create_files_for_dashboard(data, filename)
         generated_filenames = generate_files(data, filename)
-        if "MIV" in filename:
-            logging.info("Adding data to database MIV")
-            conn = sqlite3.connect(os.path.join("data", "datasette", "MIV.db"))
-            data.to_sql("MIV", conn, if_exists="append", index=False)
-            conn.commit()
-            conn.close()
-        else:
-            logging.info("Adding data to database Velo_Fuss")
-            conn = sqlite3.connect(os.path.join("data", "datasette", "Velo_Fuss.db"))
-            data.to_sql("Velo_Fuss", conn, if_exists="append", index=False)
-            conn.commit()
-            conn.close()
+        upsert_into_database(data, "MIV" if "MIV" in filename else "Velo_Fuss", filename)
     # 'MIV_Class_10_1.csv', 'Velo_Fuss_Count.csv', 'MIV_Speed.csv'
     else:
         logging.info("Retrieving Zst_id as the first word in SiteName...")
@@ -151,23 +138,11 @@ def parse_truncate(path, filename):
         dashboard_calc.create_files_for_dashboard(data, filename)
         generated_filenames = generate_files(data, filename)
         if "MIV_Class" in filename:
-            logging.info("Adding data to database MIV")
-            conn = sqlite3.connect(os.path.join("data", "datasette", "MIV.db"))
-            data.to_sql("MIV", conn, if_exists="append", index=False)
-            conn.commit()
-            conn.close()
+            upsert_into_database(data, "MIV", filename)
         if "Velo_Fuss_Count" in filename:
-            logging.info("Adding data to database Velo_Fuss")
-            conn = sqlite3.connect(os.path.join("data", "datasette", "Velo_Fuss.db"))
-            data.to_sql("Velo_Fuss", conn, if_exists="append", index=False)
-            conn.commit()
-            conn.close()
+            upsert_into_database(data, "Velo_Fuss", filename)
         if "MIV_Speed" in filename:
-            logging.info("Adding data to database MIV_Geschwindigkeitsklassen")
-            conn = sqlite3.connect(os.path.join("data", "datasette", "MIV_Geschwindigkeitsklassen.db"))
-            data.to_sql("MIV_Geschwindigkeitsklassen", conn, if_exists="append", index=False)
-            conn.commit()
-            conn.close()
+            upsert_into_database(data, "MIV_Geschwindigkeitsklassen", filename)
 
     logging.info(f"Created the following files to further processing: {str(generated_filenames)}")
     return generated_filenames
@@ -189,6 +164,7 @@ def generate_files(df, filename):
         )
         return []
 
+    start = time.perf_counter()
     current_filename = os.path.join("data", "converted_" + filename)
     generated_filenames = []
     logging.info(f"Saving {current_filename}...")
@@ -207,22 +183,102 @@ def generate_files(df, filename):
     truncated_data.to_csv(current_filename, sep=";", encoding="utf-8", index=False)
     generated_filenames.append(current_filename)
 
-    # Create a separate dataset per year
-    all_years = sorted(pd.unique(years_series.dropna()))
-    for year in all_years:
-        year_data = df[df.Year.eq(year)]
+    # Create a separate dataset per year, partitioning the data in a single groupby pass
+    for year, year_data in df.groupby("Year", sort=True):
         current_filename = os.path.join("data", str(year) + "_" + filename)
         logging.info(f"Saving {current_filename}...")
         year_data.to_csv(current_filename, sep=";", encoding="utf-8", index=False)
         generated_filenames.append(current_filename)
 
+    logging.info(f"Generated {len(generated_filenames)} files for {filename} in {time.perf_counter() - start:.1f}s.")
     return generated_filenames
 
 
+def ensure_unique_index(conn, table_name):
+    """
+    Creates the unique index on KEY_COLUMNS and the table holding the high-water mark per source file.
+
+    Tables of earlier versions of this job, which appended every load or had no DateTimeFromUTC, are emptied once
+    and then filled again from the complete source files as an initial load.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS load_state (source_file TEXT PRIMARY KEY, high_water_mark TEXT)")
+    index_name = f"uq_{table_name.lower()}_count_utc"
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)).fetchone():
+        return
+    logging.info(f"Emptying {table_name} for a reload from the source files and creating unique index {index_name}...")
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    with conn:
+        conn.execute(f"DROP INDEX IF EXISTS uq_{table_name.lower()}_count")
+        if "DateTimeFromUTC" not in columns:
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN DateTimeFromUTC TEXT")
+        conn.execute(f"DELETE FROM {table_name}")
+        conn.execute("DELETE FROM load_state")
+        conn.execute(f"CREATE UNIQUE INDEX {index_name} ON {table_name} ({', '.join(KEY_COLUMNS)})")
+
+
+def add_utc_timestamp(df):
+    """
+    Returns df with the column DateTimeFromUTC. Of the two counts with the same local DateTimeFrom in the hour that
+    is repeated when daylight saving time ends, the first one in the source file is the one in daylight saving time.
+    """
+    local_key_columns = ["DateTimeFrom" if col == "DateTimeFromUTC" else col for col in KEY_COLUMNS]
+    is_first_occurrence = df.groupby(local_key_columns, observed=True, dropna=False).cumcount() == 0
+    localized = df["DateTimeFrom"].dt.tz_localize(
+        "Europe/Zurich", ambiguous=is_first_occurrence.to_numpy(), nonexistent="shift_forward"
+    )
+    return df.assign(DateTimeFromUTC=localized.dt.tz_convert(None))
+
+
+def upsert_into_database(df, table_name, source_file):
+    """
+    Upserts the counts of source_file into data/datasette/<table_name>.db.
+
+    Only rows newer than the high-water mark of the last load of source_file (minus HIGH_WATER_MARK_LOOKBACK) are
+    written, in one transaction with a single executemany.
+    """
+    if df.empty:
+        return
+    conn = sqlite3.connect(os.path.join("data", "datasette", f"{table_name}.db"))
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        ensure_unique_index(conn, table_name)
+        df = add_utc_timestamp(df)
+        row = conn.execute("SELECT high_water_mark FROM load_state WHERE source_file = ?", (source_file,)).fetchone()
+        if row:
+            high_water_mark = pd.Timestamp(row[0])
+            logging.info(f"Last load of {source_file} into {table_name} reached {high_water_mark}...")
+            df = df[df["DateTimeFrom"] > high_water_mark - HIGH_WATER_MARK_LOOKBACK]
+        logging.info(f"Upserting {len(df)} rows of {source_file} into database {table_name}...")
+        if df.empty:
+            return
+        df = df.astype({col: "object" for col in df.select_dtypes("category").columns})
+        for col in ["DateTimeFrom", "DateTimeTo", "DateTimeFromUTC"]:
+            # Same text representation as written by DataFrame.to_sql
+            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df = df.astype(object).where(df.notna(), None)
+        columns = ", ".join(f'"{col}"' for col in df.columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table_name} ({columns}) VALUES ({placeholders})",
+                df.itertuples(index=False, name=None),
+            )
+            conn.execute(
+                "INSERT INTO load_state VALUES (?, ?) ON CONFLICT(source_file) "
+                "DO UPDATE SET high_water_mark = MAX(high_water_mark, excluded.high_water_mark)",
+                (source_file, df["DateTimeFrom"].max()),
+            )
+    finally:
+        # Leave a self-contained database file behind for datasette
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+
 def create_databases():
     """
-    Idempotently ensures the three SQLite databases and tables exist.
-    Does NOT delete existing databases.
+    Idempotently ensures the three SQLite databases and tables exist, with their unique index.
+    Does NOT delete existing databases, but empties tables of earlier versions once (see ensure_unique_index).
     """
     os.makedirs(os.path.join("data", "datasette"), exist_ok=True)
 
@@ -236,6 +292,7 @@ def create_databases():
         SiteName TEXT, 
         DateTimeFrom TEXT, 
         DateTimeTo TEXT, 
+        DateTimeFromUTC TEXT,
         DirectionName TEXT, 
         LaneCode INT,
         LaneName TEXT, 
@@ -265,6 +322,7 @@ def create_databases():
         DayOfYear INT
     )
     """)
+    ensure_unique_index(conn, "MIV")
     conn.commit()
     conn.close()
 
@@ -278,6 +336,7 @@ def create_databases():
         SiteName TEXT,
         DateTimeFrom TEXT,
         DateTimeTo TEXT,
+        DateTimeFromUTC TEXT,
         DirectionName TEXT,
         LaneCode INT,
         LaneName TEXT,
@@ -296,6 +355,7 @@ def create_databases():
         DayOfYear INT
     )
     """)
+    ensure_unique_index(conn, "Velo_Fuss")
     conn.commit()
     conn.close()
 
@@ -309,6 +369,7 @@ def create_databases():
         SiteName TEXT,
         DateTimeFrom TEXT,
         DateTimeTo TEXT,
+        DateTimeFromUTC TEXT,
         DirectionName TEXT,
         LaneCode INT,
         LaneName TEXT,
@@ -340,6 +401,7 @@ def create_databases():
         DayOfYear INT
     )
     """)
+    ensure_unique_index(conn, "MIV_Geschwindigkeitsklassen")
     conn.commit()
     conn.close()
 
@@ -1,21 +1,39 @@
+import asyncio
 import logging
 import os
 import re
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import StringIO
+from urllib.parse import urlsplit
 
+import httpx
 import ods_utils_py as ods_utils
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from webdriver_manager.chrome import ChromeDriverManager
 
 from ods_check_urls import credentials
 
+METADATA_WORKERS = int(os.getenv("CHECK_URLS_METADATA_WORKERS", 8))
+MAX_CONCURRENT_CHECKS = int(os.getenv("CHECK_URLS_MAX_CONCURRENT", 50))
+MAX_CONCURRENT_PER_HOST = int(os.getenv("CHECK_URLS_MAX_CONCURRENT_PER_HOST", 4))
+BROWSER_POOL_SIZE = int(os.getenv("CHECK_URLS_BROWSER_POOL_SIZE", 2))
+CACHE_TTL_HOURS = float(os.getenv("CHECK_URLS_CACHE_TTL_HOURS", 24))
+URL_CACHE_FILE = os.path.join(credentials.data_path, "url_check_cache.db")
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0, pool=None)
+BROWSER_PAGE_LOAD_TIMEOUT = 15
+# Status codes that some servers return to clients that are not a browser running JavaScript
+BROWSER_FALLBACK_STATUS = {403, 406}
+
 
 # URL extraction functions
 def find_urls_excluding_description(obj):
@@ -63,32 +81,160 @@ def normalize_url(url):
     return "http://" + url
 
 
-# URL check: GET + Selenium fallback
-def check_url_selenium(url):
+def open_url_cache():
+    """Opens the cache of URLs that were reachable, with the time of the check."""
+    conn = sqlite3.connect(URL_CACHE_FILE)
+    conn.execute("CREATE TABLE IF NOT EXISTS url_checks (url TEXT PRIMARY KEY, status TEXT, checked_at REAL)")
+    conn.commit()
+    return conn
+
+
+def read_url_cache(conn):
+    cutoff = time.time() - CACHE_TTL_HOURS * 3600
+    return dict(conn.execute("SELECT url, status FROM url_checks WHERE checked_at >= ?", (cutoff,)))
+
+
+def write_url_cache(conn, statuses):
+    # Only reachable URLs are cached, broken ones are checked again on every run
+    checked_at = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT INTO url_checks VALUES (?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET status = excluded.status, checked_at = excluded.checked_at",
+            [(url, str(status), checked_at) for url, status in statuses.items() if is_ok(status)],
+        )
+
+
+def is_ok(status):
+    return str(status) in ("200", "OK")
+
+
+def start_browser():
     options = Options()
-    options.headless = True
+    options.add_argument("--headless=new")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu")
+    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+def load_page(driver, url):
+    """Returns the check result and whether the browser session can be reused."""
     try:
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-        driver.set_page_load_timeout(15)
         driver.get(url)
+        return "OK", True
+    except TimeoutException as e:
+        return type(e).__name__, True
+    except WebDriverException as e:
+        return type(e).__name__, False
+
+
+class BrowserPool:
+    """
+    At most size headless Chrome sessions, started on first use and reused for all URLs that need a browser.
+    A session that failed is quit, and the next check takes its slot with a new session.
+    """
+
+    def __init__(self, size):
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def check(self, url):
+        async with self.slots:
+            driver = self.idle.pop() if self.idle else None
+            try:
+                if driver is None:
+                    driver = await asyncio.to_thread(start_browser)
+                status, reusable = await asyncio.to_thread(load_page, driver, url)
+            except Exception as e:
+                status, reusable = type(e).__name__, False
+            if reusable:
+                self.idle.append(driver)
+            elif driver is not None:
+                await asyncio.to_thread(quit_browser, driver)
+            return status
+
+    def close(self):
+        while self.idle:
+            quit_browser(self.idle.pop())
+
+
+def quit_browser(driver):
+    try:
         driver.quit()
-        return "OK"
     except WebDriverException as e:
-        return type(e).__name__
-    except Exception as e:
-        return str(e)
+        logging.info(f"Could not quit browser session: {e}")
+
+
+async def probe_url(client, url):
+    """Returns the HTTP status of url, asking with HEAD first and with a GET of a single byte if HEAD is not answered
+    with a success status (some servers do not implement HEAD). Every success status is reported as 200."""
+    response = await client.head(url)
+    if response.is_success:
+        return 200
+    async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+        # The body is never read, so only the headers are downloaded
+        return 200 if response.is_success else response.status_code
 
 
-def check_url(url):
+async def check_url(client, url, semaphore, host_semaphores, browser_pool):
+    async with host_semaphores[urlsplit(url).hostname or ""], semaphore:
+        try:
+            status = await probe_url(client, url)
+        except (httpx.TimeoutException, httpx.UnsupportedProtocol, httpx.InvalidURL) as e:
+            # A browser cannot do better here
+            return type(e).__name__
+        except Exception as e:
+            status = type(e).__name__
+    if isinstance(status, str) or status in BROWSER_FALLBACK_STATUS:
+        # E.g. TLS errors or bot protection that only lets browsers with JavaScript through
+        return await browser_pool.check(url)
+    return status
+
+
+async def check_urls(urls):
+    """Checks all urls concurrently, at most MAX_CONCURRENT_PER_HOST at a time per host, and returns {url: status}."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(MAX_CONCURRENT_PER_HOST))
+    browser_pool = BrowserPool(BROWSER_POOL_SIZE)
+    limits = httpx.Limits(max_connections=MAX_CONCURRENT_CHECKS, max_keepalive_connections=MAX_CONCURRENT_CHECKS)
     try:
-        # resp = ods_utils.requests_get(url, allow_redirects=True)
-        resp = requests.get(url=url, allow_redirects=True)
-        return resp.status_code
-    except Exception:
-        return check_url_selenium(url)
+        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits, follow_redirects=True) as client:
+            tasks = [check_url(client, url, semaphore, host_semaphores, browser_pool) for url in urls]
+            statuses = await tqdm_asyncio.gather(*tasks, desc="Checking URLs")
+    finally:
+        await asyncio.to_thread(browser_pool.close)
+    return dict(zip(urls, statuses))
+
+
+def get_urls_of_dataset(dataset_id):
+    data = ods_utils.get_dataset_metadata(dataset_id=dataset_id)
+    # Extract <a href="..."> links from both description and custom_view_html
+    desc_html = data.get("default", {}).get("description", {}).get("value", "")
+    # vis_html = data.get("visualization", {}).get("custom_view_html", {}).get("value", "")
+    html_urls = extract_hrefs_from_html(desc_html)
+    # Extract everything else via regex
+    other_urls = find_urls_excluding_description(data)
+    return set(html_urls + other_urls)
+
+
+def collect_urls(dataset_ids):
+    rows = []
+    # List to store dataset_id and error message for failed fetch attempts
+    errors_dataset = []
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        futures = {executor.submit(get_urls_of_dataset, dataset_id): dataset_id for dataset_id in dataset_ids}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Collecting URLs"):
+            dataset_id = futures[future]
+            try:
+                urls = future.result()
+            except Exception as e:
+                errors_dataset.append({"dataset_id": dataset_id, "error": str(e)})
+                continue
+            rows.extend({"url": url, "dataset_id": dataset_id} for url in urls)
+    return pd.DataFrame(rows, columns=["url", "dataset_id"]), errors_dataset
 
 
 def main():
@@ -101,42 +247,29 @@ def main():
     df_csv = pd.read_csv(StringIO(response.text), delimiter=";")
     dataset_ids = df_csv["dataset_id"].tolist()
     # Collect all URLs across datasets
-    df_urls = pd.DataFrame(columns=["url", "dataset_id"])
-    datasets_checked = 0
-    # List to store dataset_id and error message for failed fetch attempts
-    errors_dataset = []
-    for dataset_id in tqdm(dataset_ids, desc="Collecting URLs"):
-        try:
-            data = ods_utils.get_dataset_metadata(dataset_id=dataset_id)
-            datasets_checked += 1  # ✅ Count only successful fetches
-        except Exception as e:
-            errors_dataset.append({"dataset_id": dataset_id, "error": str(e)})
-            continue
-
-        # Extract <a href="..."> links from both description and custom_view_html
-        desc_html = data.get("default", {}).get("description", {}).get("value", "")
-        # vis_html = data.get("visualization", {}).get("custom_view_html", {}).get("value", "")
-        html_urls = extract_hrefs_from_html(desc_html)
-
-        # Extract everything else via regex
-        other_urls = find_urls_excluding_description(data)
-
-        all_urls = set(html_urls + other_urls)
-
-        df_temp = pd.DataFrame({"url": list(all_urls), "dataset_id": dataset_id})
-        df_urls = pd.concat([df_urls, df_temp], ignore_index=True)
+    df_urls, errors_dataset = collect_urls(dataset_ids)
+    datasets_checked = len(dataset_ids) - len(errors_dataset)
 
     # Normalize and group URLs
     df_urls["url"] = df_urls["url"].apply(normalize_url)
     df_grouped = df_urls.groupby("url")["dataset_id"].apply(lambda ids: list(sorted(set(ids)))).reset_index()
-    # List to store all URLs that failed during the check
-    results = []  # Store dataset_id and error message for failed fetch attempts
-    for _, row in tqdm(df_grouped.iterrows(), total=len(df_grouped), desc="Checking URLs"):
-        url = row["url"]
-        status = check_url(url)
-
-        if str(status) not in ("200", "OK"):
-            results.append({"url": url, "dataset_ids": ", ".join(map(str, row["dataset_id"])), "status": status})
+
+    cache = open_url_cache()
+    statuses = read_url_cache(cache)
+    urls_to_check = [url for url in df_grouped["url"] if url not in statuses]
+    logging.info(f"{len(df_grouped) - len(urls_to_check)} URLs were reachable less than {CACHE_TTL_HOURS}h ago")
+    checked = asyncio.run(check_urls(urls_to_check))
+    write_url_cache(cache, checked)
+    cache.close()
+    statuses.update(checked)
+
+    # Store dataset_id and error message for all URLs that failed during the check
+    df_grouped["status"] = df_grouped["url"].map(statuses)
+    df_broken = df_grouped[~df_grouped["status"].map(is_ok)]
+    results = [
+        {"url": row.url, "dataset_ids": ", ".join(map(str, row.dataset_id)), "status": row.status}
+        for row in df_broken.itertuples()
+    ]
 
     # Export broken URLs to Excel
 
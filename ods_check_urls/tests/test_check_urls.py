@@ -0,0 +1,82 @@
+import asyncio
+
+import check_urls
+import httpx
+from selenium.common.exceptions import WebDriverException
+
+
+class FakeDriver:
+    def __init__(self, failing_urls):
+        self.failing_urls = failing_urls
+        self.quit_called = False
+
+    def get(self, url):
+        if url in self.failing_urls:
+            raise WebDriverException("net::ERR_NAME_NOT_RESOLVED")
+
+    def quit(self):
+        self.quit_called = True
+
+
+def check_with_pool(monkeypatch, urls, failing_urls, size):
+    drivers = []
+
+    def start_browser():
+        drivers.append(FakeDriver(failing_urls))
+        return drivers[-1]
+
+    monkeypatch.setattr(check_urls, "start_browser", start_browser)
+
+    async def check_all():
+        pool = check_urls.BrowserPool(size)
+        statuses = await asyncio.wait_for(asyncio.gather(*[pool.check(url) for url in urls]), timeout=10)
+        pool.close()
+        return statuses
+
+    return asyncio.run(check_all()), drivers
+
+
+def test_failing_sessions_are_replaced(monkeypatch):
+    urls = ["https://a.example", "https://b.example", "https://c.example"]
+    statuses, drivers = check_with_pool(monkeypatch, urls, failing_urls=set(urls), size=1)
+    assert statuses == ["WebDriverException"] * 3
+    assert len(drivers) == 3
+    assert all(driver.quit_called for driver in drivers)
+
+
+def test_sessions_are_reused(monkeypatch):
+    urls = [f"https://{i}.example" for i in range(6)]
+    statuses, drivers = check_with_pool(monkeypatch, urls, failing_urls={"https://2.example"}, size=2)
+    assert statuses == ["OK", "OK", "WebDriverException", "OK", "OK", "OK"]
+    assert len(drivers) == 3
+    assert all(driver.quit_called for driver in drivers)
+
+
+def probe_with_handler(handler):
+    async def probe():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await check_urls.probe_url(client, "https://example.com/file.csv")
+
+    return asyncio.run(probe())
+
+
+def test_probe_head_success():
+    assert probe_with_handler(lambda request: httpx.Response(204)) == 200
+
+
+def test_probe_falls_back_to_ranged_get():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.method == "HEAD":
+            return httpx.Response(405)
+        return httpx.Response(206, content=b"a")
+
+    assert probe_with_handler(handler) == 200
+    assert [request.method for request in requests] == ["HEAD", "GET"]
+    assert requests[1].headers["Range"] == "bytes=0-0"
+
+
+def test_probe_not_found():
+    assert probe_with_handler(lambda request: httpx.Response(404)) == 404
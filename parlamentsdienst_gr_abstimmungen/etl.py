@@ -1,6 +1,9 @@
+import fnmatch
+import ftplib
 import json
 import logging
 import os
+import sqlite3
 import xml.sax
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -25,6 +28,7 @@ FTP_USER_GR_POLLS = os.getenv("FTP_USER_GR_POLLS")
 FTP_PASS_GR_POLLS = os.getenv("FTP_PASS_GR_POLLS")
 FTP_USER_GR_POLLS_ARCHIVE = os.getenv("FTP_USER_GR_POLLS_ARCHIVE")
 FTP_PASS_GR_POLLS_ARCHIVE = os.getenv("FTP_PASS_GR_POLLS_ARCHIVE")
+ARCHIVE_LEDGER_FILENAME = os.path.join("data", "archive_ledger.db")
 
 
 def handle_tagesordnungen(process_archive=False):
@@ -360,43 +364,115 @@ def handle_congress_center_polls(df_unique_session_dates):
 
 
 def handle_polls_xml(df_unique_session_dates=None):
+    """
+    Processes the archive of polls of the old system in XML format incrementally.
+
+    The files of all folders are compared by size and modify fact with the ledger of the previous run, so only new or
+    changed XML files are downloaded, parsed, pushed and backed up. A new or renamed PDF file (e.g. a poll renamed to
+    type "un") changes the Traktanden of its folder, so in that case all XML files of the folder are processed again.
+    Returns the whole archive, read from the CSV files exported for each XML file.
+    """
     logging.info("Handling polls of old system in XML format...")
-    df_to_return = None
     ftp = {
         "server": FTP_SERVER_GR,
         "user": FTP_USER_GR_POLLS_ARCHIVE,
         "password": FTP_PASS_GR_POLLS_ARCHIVE,
     }
-    dir_ls_file = "data/ftp_listing_archive_dir.json"
-    # xml and pdf Files are located in folders "Amtsjahr_????-????/????.??.??", e.g. "Amtsjahr_2022-2023/2022.10.19", so we dive into a
-    # two folder deep file structure
-    dir_ls = utilities.get_ftp_ls(remote_path="", pattern="Amtsjahr_*", file_name=dir_ls_file, ftp=ftp)
-    all_df = pd.DataFrame()
-    for remote_file in dir_ls:
-        remote_path = remote_file["remote_file"]
-        subdir_ls_file = f"data/ftp_listing_archive_{remote_path}.json"
-        subdir_ls = utilities.get_ftp_ls(remote_path=remote_path, pattern="*.*.*", file_name=subdir_ls_file, ftp=ftp)
-        for subdir in subdir_ls:
-            if subdir["remote_file"] not in [".", ".."]:
-                remote_path_subdir = remote_path + "/" + subdir["remote_file"]
-                poll_df = handle_single_polls_folder_xml(df_unique_session_dates, ftp, remote_path_subdir)
-                all_df = pd.concat(objs=[all_df, poll_df], sort=False)
-    df_to_return = all_df
+    ledger = open_archive_ledger()
+    known_files = {
+        (remote_path, remote_file): (size, modify)
+        for remote_path, remote_file, size, modify in ledger.execute(
+            "SELECT remote_path, remote_file, size, modify FROM files"
+        )
+    }
+    for remote_path, files in list_archive_folders(ftp):
+        changed_files = [name for name, stat in files.items() if known_files.get((remote_path, name)) != stat]
+        xml_files = sorted(name for name in files if fnmatch.fnmatch(name, "*.xml"))
+        pdf_files = sorted(name for name in files if fnmatch.fnmatch(name, "*.pdf"))
+        if any(name in pdf_files for name in changed_files):
+            xml_files_to_process = xml_files
+        else:
+            xml_files_to_process = [name for name in xml_files if name in changed_files]
+        logging.info(
+            f"{len(changed_files)} new or changed files in {remote_path}, processing {xml_files_to_process}..."
+        )
+        if len(xml_files_to_process) > 0:
+            handle_single_polls_folder_xml(df_unique_session_dates, ftp, remote_path, xml_files_to_process, pdf_files)
+        with ledger:
+            ledger.execute("DELETE FROM files WHERE remote_path = ?", (remote_path,))
+            ledger.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?)",
+                [(remote_path, name, size, modify) for name, (size, modify) in files.items()],
+            )
+    export_files = [
+        get_xml_export_filename(os.path.join("data_orig", remote_file))
+        for (remote_file,) in ledger.execute(
+            "SELECT remote_file FROM files WHERE remote_file LIKE '%.xml' ORDER BY remote_path, remote_file"
+        )
+    ]
+    ledger.close()
+    poll_dfs = [
+        pd.read_csv(export_file, dtype=str, keep_default_na=False)
+        for export_file in export_files
+        if os.path.exists(export_file)
+    ]
+    return pd.concat(poll_dfs, sort=False) if len(poll_dfs) > 0 else pd.DataFrame()
 
-    return df_to_return
 
+def get_xml_export_filename(local_file):
+    return local_file.replace("data_orig", "data").replace(".xml", ".csv")
 
-def handle_single_polls_folder_xml(df_unique_session_dates, ftp, remote_path):
-    xml_ls_file = f"data/ftp_listing_xml_{remote_path.replace('/', '_')}.json"
-    utilities.get_ftp_ls(remote_path=remote_path, pattern="*.xml", file_name=xml_ls_file, ftp=ftp)
-    df_trakt_filenames = retrieve_traktanden_pdf_filenames(ftp, remote_path)
-    all_df = pd.DataFrame()
-    # todo: Parse every poll pdf file name to check for the new type "un" (ungültig) and set those polls' type correctly.
-    # todo: Check for changes in PDF files, only those change if a poll is invalid (xml file does not change)
-    # Renaming of a pdf file to type "un" can happen after session, so we have to check for
-    # changes in the poll pdf files even if no change to the poll xml file has happened.
+
+def open_archive_ledger():
+    """Opens the ledger of processed archive files (remote path, size and MLSD modify fact)."""
+    ledger = sqlite3.connect(ARCHIVE_LEDGER_FILENAME)
+    ledger.execute(
+        "CREATE TABLE IF NOT EXISTS files "
+        "(remote_path TEXT, remote_file TEXT, size INTEGER, modify TEXT, PRIMARY KEY (remote_path, remote_file))"
+    )
+    ledger.commit()
+    return ledger
+
+
+def list_ftp_entries(ftp_conn, path, pattern, entry_type):
+    return [
+        (name, facts)
+        for name, facts in ftp_conn.mlsd(path, facts=["type", "size", "modify"])
+        if facts.get("type") == entry_type and fnmatch.fnmatch(name, pattern)
+    ]
+
+
+@common.retry(common.ftp_errors_to_handle, tries=6, delay=10, backoff=1)
+def list_archive_folders(ftp):
+    """
+    Lists the session folders of the archive and their files over one FTP connection.
+
+    Every folder is listed, since overwriting a file in place does not change the modify fact of its folder.
+    Returns a list of (remote_path, {file name: (size, modify)}).
+    """
+    folders = []
+    with ftplib.FTP(ftp["server"], ftp["user"], ftp["password"]) as ftp_conn:
+        # xml and pdf Files are located in folders "Amtsjahr_????-????/????.??.??", e.g. "Amtsjahr_2022-2023/2022.10.19", so we dive into a
+        # two folder deep file structure
+        for amtsjahr, _ in list_ftp_entries(ftp_conn, "", "Amtsjahr_*", "dir"):
+            for session, _ in list_ftp_entries(ftp_conn, amtsjahr, "*.*.*", "dir"):
+                remote_path = f"{amtsjahr}/{session}"
+                files = {
+                    name: (int(file_facts.get("size", -1)), file_facts.get("modify"))
+                    for name, file_facts in list_ftp_entries(ftp_conn, remote_path, "*", "file")
+                }
+                folders.append((remote_path, files))
+    logging.info(f"Found {len(folders)} folders in the archive...")
+    return folders
+
+
+def handle_single_polls_folder_xml(df_unique_session_dates, ftp, remote_path, xml_file_names, pdf_file_names):
+    df_trakt_filenames = pd.DataFrame([{"remote_file": name, "remote_path": remote_path} for name in pdf_file_names])
+    poll_dfs = []
     # todo: handle xlsx files of polls during time at congress center
-    xml_files = common.download_ftp([], ftp["server"], ftp["user"], ftp["password"], remote_path, "data_orig*.xml")
+    xml_files = common.download_ftp(
+        xml_file_names, ftp["server"], ftp["user"], ftp["password"], remote_path, "data_orig", "*.xml"
+    )
     df_trakt = calc_traktanden_from_pdf_filenames(df_trakt_filenames)
     for i, file in enumerate(xml_files):
         local_file = file["local_file"]
@@ -425,13 +501,13 @@ def handle_single_polls_folder_xml(df_unique_session_dates, ftp, remote_path):
 
         common.batched_ods_realtime_push(curr_poll_df, ODS_PUSH_URL)
 
-        export_filename_csv = local_file.replace("data_orig", "data").replace(".xml", ".csv")
+        export_filename_csv = get_xml_export_filename(local_file)
         logging.info(f"Saving data files to FTP server as backup: {local_file}, {export_filename_csv}")
         common.upload_ftp(local_file, remote_path="parlamentsdienst/gr_abstimmungsergebnisse")
         curr_poll_df.to_csv(export_filename_csv, index=False)
         common.upload_ftp(export_filename_csv, remote_path="parlamentsdienst/gr_abstimmungsergebnisse")
-        all_df = pd.concat(objs=[all_df, curr_poll_df], sort=False)
-    return all_df
+        poll_dfs.append(curr_poll_df)
+    return pd.concat(poll_dfs, sort=False) if len(poll_dfs) > 0 else pd.DataFrame()
 
 
 def calc_details_from_single_xml_file(local_file):
@@ -581,14 +657,6 @@ def calc_traktanden_from_pdf_filenames(df_trakt):
     return df_trakt
 
 
-def retrieve_traktanden_pdf_filenames(ftp, remote_path):
-    logging.info("Retrieving traktanden PDF filenames")
-    pdf_ls_file = "data/ftp_listing_pdf.json"
-    pdf_ls = utilities.get_ftp_ls(remote_path=remote_path, pattern="*.pdf", file_name=pdf_ls_file, ftp=ftp)
-    df_trakt = pd.DataFrame(pdf_ls)
-    return df_trakt
-
-
 def handle_polls_json(process_archive=False, df_unique_session_dates=None):
     logging.info(f"Handling polls, value of process_archive: {process_archive}...")
     df_to_return = None
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -10,6 +11,7 @@ from zoneinfo import ZoneInfo
 import charset_normalizer
 import common
 import icalendar
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from rapidfuzz import fuzz, process
@@ -347,84 +349,101 @@ def create_name_combinations(row, surname_first=False):
     ]
 
 
-def fill_values_from_dataframe(df: pd.DataFrame, df_lookup: pd.DataFrame, index, index_lookup):
-    df.loc[index, "Mitglied_Nachname"] = df_lookup.loc[index_lookup, "name"]
-    df.loc[index, "Mitglied_Vorname"] = df_lookup.loc[index_lookup, "vorname"]
-    df.loc[index, "Mitglied_Name"] = df_lookup.loc[index_lookup, "name_vorname"]
-    df.loc[index, "GR_uni_nr"] = df_lookup.loc[index_lookup, "uni_nr"]
-    df.loc[index, "GR_url"] = df_lookup.loc[index_lookup, "url"]
-    df.loc[index, "GR_url_ods"] = (
-        ""
-        if df_lookup.loc[index_lookup, "name"] == "Vakanz"
-        else "https://data.bs.ch/explore/dataset/100307/?refine.uni_nr="
-        + df_lookup.loc[index_lookup, "uni_nr"].astype(int).astype(str)
-    )
-    return df
+LOOKUP_COLUMNS = [
+    "fuzzy_name",
+    "closest_combination",
+    "fuzz_score",
+    "name",
+    "vorname",
+    "name_vorname",
+    "uni_nr",
+    "url",
+]
 
 
-def get_closest_name_from_member_dataset(df: pd.DataFrame, surname_first=False):
-    # Create new columns
-    df["Mitglied_Vorname"] = ""
-    df["Mitglied_Nachname"] = ""
-    df["GR_uni_nr"] = ""
-    df["GR_url"] = ""
-    df["GR_url_ods"] = ""
-    # Download members of Grosser Rat from ods
+@functools.cache
+def get_members_of_grosser_rat():
+    # Download members of Grosser Rat from ods, once per run
     raw_data_file = os.path.join("data", "members_gr.csv")
     logging.info(f"Downloading Members of Grosser Rat from ods to file {raw_data_file}...")
     r = common.requests_get("https://data.bs.ch/api/records/1.0/download?dataset=100307")
     with open(raw_data_file, "wb") as f:
         f.write(r.content)
     df_gr_mitglieder = pd.read_csv(raw_data_file, sep=";")
-    df_names = df_gr_mitglieder[["name", "vorname", "name_vorname", "url", "uni_nr"]]
-    # Create all combinations of names
-    expanded_rows = [create_name_combinations(row, surname_first=surname_first) for index, row in df_names.iterrows()]
-    expanded_df = pd.DataFrame([item for sublist in expanded_rows for item in sublist])
-    name_list = expanded_df["comb_name_vorname"].tolist()
-    path_lookup_table = os.path.join(pathlib.Path(__file__).parents[0], "data", "lookup_grossrat.csv")
-    if os.path.exists(path_lookup_table):
-        logging.info(f"Loading lookup table from {path_lookup_table}...")
-        lookup_table = pd.read_csv(path_lookup_table)
-    else:
-        logging.info(f"Creating lookup table and saving to {path_lookup_table}...")
-        lookup_table = pd.DataFrame(
-            columns=[
-                "fuzzy_name",
-                "closest_combination",
-                "fuzz_score",
-                "name",
-                "vorname",
-                "name_vorname",
-                "uni_nr",
-                "url",
-            ]
+    return df_gr_mitglieder[["name", "vorname", "name_vorname", "url", "uni_nr"]]
+
+
+class MemberResolver:
+    """Maps the member names found in poll files to the members of the Grosser Rat (dataset 100307).
+
+    Names that have been matched before are looked up in a dict that is persisted to lookup_grossrat.csv between runs,
+    the unique names not seen before are matched to all name combinations of the members with one batched
+    rapidfuzz.process.cdist call.
+    """
+
+    def __init__(self, surname_first=False):
+        df_names = get_members_of_grosser_rat()
+        # Create all combinations of names
+        expanded_rows = [
+            create_name_combinations(row, surname_first=surname_first) for index, row in df_names.iterrows()
+        ]
+        self.expanded_df = pd.DataFrame([item for sublist in expanded_rows for item in sublist])
+        self.name_list = self.expanded_df["comb_name_vorname"].tolist()
+        self.path_lookup_table = os.path.join(pathlib.Path(__file__).parents[0], "data", "lookup_grossrat.csv")
+        self.lookup = {}
+        if os.path.exists(self.path_lookup_table):
+            logging.info(f"Loading lookup table from {self.path_lookup_table}...")
+            lookup_table = pd.read_csv(self.path_lookup_table).drop_duplicates(subset=["fuzzy_name"])
+            self.lookup = lookup_table.set_index("fuzzy_name").to_dict(orient="index")
+
+    def match_unseen_names(self, names):
+        unseen_names = [name for name in names if name not in self.lookup]
+        if len(unseen_names) == 0:
+            return
+        logging.info(f"Looking for closest names for {len(unseen_names)} names not seen before...")
+        scores = process.cdist(unseen_names, self.name_list, scorer=fuzz.WRatio, dtype=np.float64, workers=-1)
+        closest = scores.argmax(axis=1)
+        for name, index_gr_mitglieder, score in zip(unseen_names, closest, scores[np.arange(len(closest)), closest]):
+            logging.info(f"Closest name for {name} is {self.name_list[index_gr_mitglieder]} with score {score}...")
+            member = self.expanded_df.loc[index_gr_mitglieder]
+            self.lookup[name] = {
+                "closest_combination": self.name_list[index_gr_mitglieder],
+                "fuzz_score": score,
+                "name": member["name"],
+                "vorname": member["vorname"],
+                "name_vorname": member["name_vorname"],
+                "uni_nr": member["uni_nr"],
+                "url": member["url"],
+            }
+        self.save()
+
+    def save(self):
+        lookup_table = pd.DataFrame.from_dict(self.lookup, orient="index").rename_axis("fuzzy_name").reset_index()
+        lookup_table[LOOKUP_COLUMNS].to_csv(self.path_lookup_table, index=False)
+
+    def resolve(self, df: pd.DataFrame):
+        self.match_unseen_names(df["Mitglied_Name"].unique())
+        df_lookup = pd.DataFrame.from_dict(self.lookup, orient="index")
+        matches = df[["Mitglied_Name"]].join(df_lookup, on="Mitglied_Name")
+        uni_nr = pd.to_numeric(matches["uni_nr"], errors="coerce").astype("Int64").astype(str)
+        df["Mitglied_Vorname"] = matches["vorname"]
+        df["Mitglied_Nachname"] = matches["name"]
+        df["GR_uni_nr"] = matches["uni_nr"]
+        df["GR_url"] = matches["url"]
+        df["GR_url_ods"] = np.where(
+            matches["name"] == "Vakanz", "", "https://data.bs.ch/explore/dataset/100307/?refine.uni_nr=" + uni_nr
         )
-    for index, row in df.iterrows():
-        if row["Mitglied_Name"] in lookup_table["fuzzy_name"].tolist():
-            index_lookup = lookup_table.loc[lookup_table["fuzzy_name"] == row["Mitglied_Name"]].index[0]
-        else:
-            logging.info(f"Looking for closest name for {row['Mitglied_Name']}...")
-            closest_name, score, index_gr_mitglieder = process.extractOne(
-                row["Mitglied_Name"], name_list, scorer=fuzz.WRatio
-            )
-            logging.info(f"Closest name for {row['Mitglied_Name']} is {closest_name} with score {score}...")
-            lookup_table.loc[-1] = [
-                row["Mitglied_Name"],
-                closest_name,
-                score,
-                expanded_df.loc[index_gr_mitglieder, "name"],
-                expanded_df.loc[index_gr_mitglieder, "vorname"],
-                expanded_df.loc[index_gr_mitglieder, "name_vorname"],
-                expanded_df.loc[index_gr_mitglieder, "uni_nr"],
-                expanded_df.loc[index_gr_mitglieder, "url"],
-            ]
-            lookup_table.index = lookup_table.index + 1
-            lookup_table.sort_index(inplace=True)
-            index_lookup = lookup_table.index[0]
-        df = fill_values_from_dataframe(df, lookup_table, index, index_lookup)
-    # Save lookup table
-    lookup_table.to_csv(path_lookup_table, index=False)
-    return df
+        df["Mitglied_Name"] = matches["name_vorname"]
+        return df
+
+
+@functools.cache
+def get_member_resolver(surname_first=False):
+    return MemberResolver(surname_first=surname_first)
+
+
+def get_closest_name_from_member_dataset(df: pd.DataFrame, surname_first=False):
+    return get_member_resolver(surname_first=surname_first).resolve(df)
 
 
 def add_seat_99(df):
@@ -0,0 +1,58 @@
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+from etl_details import calculate_details
+from etl_kennzahlen import calculate_kennzahlen
+from workbook import load_workbooks
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+# Result files of a real vote are not checked in; copy them here or pass their paths as arguments
+DEFAULT_FILES = [
+    os.path.join(CURR_DIR, "tests", "fixtures", "Resultate_EID.xlsx"),
+    os.path.join(CURR_DIR, "tests", "fixtures", "Resultate_KAN.xlsx"),
+]
+
+
+def read_per_call(import_file_name):
+    # Previous reading pattern of calculate_details and calculate_kennzahlen, each opening the file anew per read
+    sheets = pd.read_excel(import_file_name, sheet_name=None, skiprows=4, index_col=None)
+    for sheet_name in [key for key in sheets if key.startswith("DAT ")]:
+        for skiprows in (4, 2, 6):
+            pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=skiprows, index_col=None)
+
+
+def main(data_files):
+    missing_files = [data_file for data_file in data_files if not os.path.isfile(data_file)]
+    if missing_files:
+        sys.exit(
+            f"Result files not found: {', '.join(missing_files)}. "
+            f"Pass the paths of Resultate_EID.xlsx and Resultate_KAN.xlsx or copy them to tests/fixtures."
+        )
+    t0 = time.perf_counter()
+    for data_file in data_files:
+        # Once for the details, once for the Kennzahlen
+        read_per_call(data_file)
+        read_per_call(data_file)
+    t_per_call = time.perf_counter() - t0
+
+    # Everything that happens between the drop of the result files and the push to ODS
+    file_dropped = time.time()
+    t0 = time.perf_counter()
+    workbooks = load_workbooks(data_files)
+    t_single_load = time.perf_counter() - t0
+    calculate_details(data_files, return_warnings=True, workbooks=workbooks)
+    calculate_kennzahlen(data_files, workbooks=workbooks)
+    t_calculate = time.perf_counter() - t0 - t_single_load
+
+    logging.info(f"Reading sheets with pd.read_excel per call: {t_per_call:.2f}s")
+    logging.info(f"Parsing each workbook once:                 {t_single_load:.2f}s")
+    logging.info(f"Details and Kennzahlen from parsed files:   {t_calculate:.2f}s")
+    logging.info(f"File drop to ready for the ODS push:        {time.time() - file_dropped:.2f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:] or DEFAULT_FILES)
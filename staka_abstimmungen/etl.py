@@ -3,6 +3,9 @@ import logging
 import os
 import re
 import smtplib
+import sys
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 
@@ -20,6 +23,7 @@ from etl_details import (
 )
 from etl_kennzahlen import apply_vote_consistency_rules as apply_kennzahlen_vote_consistency_rules
 from etl_kennzahlen import calculate_kennzahlen
+from workbook import Workbook, load_workbooks
 
 load_dotenv()
 
@@ -27,6 +31,8 @@ ODS_PUSH_URL_DETAILS_TEST = os.getenv("ODS_PUSH_URL_100343")
 ODS_PUSH_URL_KENNZ_TEST = os.getenv("ODS_PUSH_URL_100344")
 ODS_PUSH_URL_DETAILS_PUBLIC = os.getenv("ODS_PUSH_URL_100345")
 ODS_PUSH_URL_KENNZ_PUBLIC = os.getenv("ODS_PUSH_URL_100346")
+WATCH_INTERVAL_SECONDS = float(os.getenv("ABSTIMMUNGEN_WATCH_INTERVAL_SECONDS", 2))
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("ABSTIMMUNGEN_WATCH_DEBOUNCE_SECONDS", 3))
 
 
 def main():
@@ -35,15 +41,8 @@ def main():
     if push_past_abstimmungen:
         push_past_abstimmungen_to_ods()
         return
-    logging.info("Reading control.csv...")
-    df = pd.read_csv(
-        os.path.join("data", "control.csv"),
-        sep=";",
-        parse_dates=["Ignore_changes_before", "Embargo", "Ignore_changes_after"],
-    )
-    active_abst = df.query("Active == True").copy(deep=True)
+    active_abst = read_active_abstimmungen()
     active_active_size = active_abst.Active.size
-    what_changed = {"updated_ods_datasets": [], "send_update_email": False, "privacy_warnings": []}
     if active_active_size == 1:
         abst_date = active_abst.Abstimmungs_datum[0]
         logging.info(f"Processing Abstimmung for date {abst_date}...")
@@ -55,22 +54,7 @@ def main():
             logging.info(f"Have the data files changed? {data_files_changed}. ")
             logging.info(f"Is it time to make live datasets public? {make_live_public}. ")
             if data_files_changed or make_live_public:
-                df_details, details_changed, df_kennz, kennz_changed, privacy_warnings = calculate_and_upload(
-                    active_files
-                )
-                common.ods_realtime_push_df(df_details, ODS_PUSH_URL_DETAILS_TEST)
-                common.ods_realtime_push_df(df_kennz, ODS_PUSH_URL_KENNZ_TEST)
-                what_changed = publish_datasets(details_changed, kennz_changed, what_changed=what_changed)
-                what_changed["privacy_warnings"].extend(privacy_warnings)
-                for file in active_files:
-                    ct.update_hash_file(os.path.join("data", file))
-
-                if make_live_public:
-                    what_changed = make_datasets_public(active_files, what_changed)
-                    common.ods_realtime_push_df(df_details, ODS_PUSH_URL_DETAILS_PUBLIC)
-                    common.ods_realtime_push_df(df_kennz, ODS_PUSH_URL_KENNZ_PUBLIC)
-                if data_files_changed or len(what_changed["privacy_warnings"]) > 0:
-                    send_update_email(what_changed)
+                process_active_files(active_files, data_files_changed, make_live_public)
 
     elif active_active_size == 0:
         logging.info("No active Abstimmung, nothing to do for the moment. ")
@@ -79,6 +63,146 @@ def main():
     logging.info("Job Successful!")
 
 
+def read_active_abstimmungen():
+    logging.info("Reading control.csv...")
+    df = pd.read_csv(
+        os.path.join("data", "control.csv"),
+        sep=";",
+        parse_dates=["Ignore_changes_before", "Embargo", "Ignore_changes_after"],
+    )
+    return df.query("Active == True").copy(deep=True)
+
+
+def process_active_files(
+    active_files, data_files_changed, make_live_public, workbooks=None, sheet_cache=None, push_df=None
+):
+    push_df = push_df or common.ods_realtime_push_df
+    what_changed = {"updated_ods_datasets": [], "send_update_email": False, "privacy_warnings": []}
+    df_details, details_changed, df_kennz, kennz_changed, privacy_warnings = calculate_and_upload(
+        active_files, workbooks=workbooks, sheet_cache=sheet_cache
+    )
+    with timed("Pushing to the test datasets"):
+        push_df(df_details, ODS_PUSH_URL_DETAILS_TEST)
+        push_df(df_kennz, ODS_PUSH_URL_KENNZ_TEST)
+    log_latency_since_file_drop(active_files, "push to the test datasets")
+    what_changed = publish_datasets(details_changed, kennz_changed, what_changed=what_changed)
+    what_changed["privacy_warnings"].extend(privacy_warnings)
+    for file in active_files:
+        ct.update_hash_file(os.path.join("data", file))
+
+    if make_live_public:
+        what_changed = make_datasets_public(active_files, what_changed)
+        with timed("Pushing to the public datasets"):
+            push_df(df_details, ODS_PUSH_URL_DETAILS_PUBLIC)
+            push_df(df_kennz, ODS_PUSH_URL_KENNZ_PUBLIC)
+        log_latency_since_file_drop(active_files, "push to the public datasets")
+    if data_files_changed or len(what_changed["privacy_warnings"]) > 0:
+        send_update_email(what_changed)
+
+
+class AbstimmungWatcher:
+    """
+    Processes the active Abstimmung as soon as its result files change, for use in a long-running process.
+
+    A result file is only read once its size and modification time have not changed for WATCH_DEBOUNCE_SECONDS, so
+    that files that are still being written are skipped. Parsed workbooks and per-sheet results are kept between
+    changes, so only changed files are parsed and only changed sheets are recalculated. Only rows that differ from
+    the previous push are pushed again.
+    """
+
+    def __init__(self):
+        self.reset(abst_date=None)
+
+    def reset(self, abst_date):
+        self.abst_date = abst_date
+        self.seen_stats = {}
+        self.processed_stats = {}
+        self.workbooks = {}
+        self.sheet_cache = {}
+        self.pushed = {}
+        self.made_public = False
+
+    def poll(self):
+        active_abst = read_active_abstimmungen()
+        if active_abst.Active.size != 1:
+            return
+        abst_date = active_abst.Abstimmungs_datum[0]
+        if abst_date != self.abst_date:
+            logging.info(f"Watching result files for Abstimmung of {abst_date}...")
+            self.reset(abst_date)
+        do_process, make_live_public = check_embargos(active_abst, 1)
+        if not do_process:
+            return
+        active_files = find_data_files_for_active_abst(active_abst)
+        if len(active_files) == 0:
+            return
+        stats = {file: get_file_stat(file) for file in active_files}
+        seconds_since_last_write = time.time() - max(mtime for _, mtime in stats.values())
+        is_stable = stats == self.seen_stats and seconds_since_last_write >= WATCH_DEBOUNCE_SECONDS
+        self.seen_stats = stats
+        if not is_stable:
+            return
+        changed_files = [file for file in active_files if stats[file] != self.processed_stats.get(file)]
+        if len(changed_files) == 0 and not (make_live_public and not self.made_public):
+            return
+        logging.info(
+            f"Changed result files: {changed_files}. Is it time to make live datasets public? {make_live_public}."
+        )
+        with timed("Parsing the changed result files"):
+            for file in changed_files:
+                self.workbooks[file] = Workbook(os.path.join("data", file))
+        workbooks = {file: self.workbooks[file] for file in active_files}
+        process_active_files(
+            active_files,
+            data_files_changed=len(changed_files) > 0,
+            make_live_public=make_live_public,
+            workbooks=workbooks,
+            sheet_cache=self.sheet_cache,
+            push_df=self.push_changed_rows,
+        )
+        # Only recorded after a successful push, so that a failed one is retried with the next poll
+        self.processed_stats = stats
+        self.made_public = self.made_public or make_live_public
+
+    def push_changed_rows(self, df, url):
+        df_changed = get_changed_rows(df, self.pushed.get(url))
+        logging.info(f"Pushing {len(df_changed)} of {len(df)} rows that changed since the last push...")
+        if len(df_changed) > 0:
+            common.ods_realtime_push_df(df_changed, url)
+        self.pushed[url] = df
+
+
+def watch():
+    logging.info(f"Polling for result files every {WATCH_INTERVAL_SECONDS} seconds...")
+    watcher = AbstimmungWatcher()
+    while True:
+        try:
+            watcher.poll()
+        except Exception:
+            logging.exception("Processing the result files failed, retrying with the next poll...")
+        time.sleep(WATCH_INTERVAL_SECONDS)
+
+
+def get_file_stat(file):
+    stat = os.stat(os.path.join("data", file))
+    return stat.st_size, stat.st_mtime
+
+
+def get_changed_rows(df, df_pushed):
+    """Returns the rows of df that are not contained in df_pushed, or all rows if the columns have changed."""
+    if df_pushed is None or not df.dtypes.equals(df_pushed.dtypes):
+        return df
+    merged = df.merge(df_pushed.drop_duplicates(), how="left", indicator=True)
+    return df[(merged["_merge"] == "left_only").to_numpy()]
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    yield
+    logging.info(f"{stage} took {time.perf_counter() - start:.2f}s")
+
+
 def push_past_abstimmungen_to_ods():
     path_data_processing_output = os.path.join("data", "data-processing-output")
     files_details = glob.glob(os.path.join(path_data_processing_output, "Abstimmungen_Details_??????????.csv"))
@@ -172,18 +296,33 @@ def publish_datasets(details_changed, kennz_changed, what_changed):
     return what_changed
 
 
-def calculate_and_upload(active_files):
-    details_abst_date, df_details, privacy_warnings = calculate_details(active_files, return_warnings=True)
+def log_latency_since_file_drop(active_files, stage):
+    file_dropped = max(os.path.getmtime(os.path.join("data", file)) for file in active_files)
+    logging.info(f"Seconds from file drop to {stage}: {time.time() - file_dropped:.1f}")
+
+
+def calculate_and_upload(active_files, workbooks=None, sheet_cache=None):
+    if workbooks is None:
+        # Both calculations slice their sheets out of the same parsed workbooks
+        with timed("Parsing the result files"):
+            workbooks = load_workbooks(active_files)
+    with timed("Calculating details"):
+        details_abst_date, df_details, privacy_warnings = calculate_details(
+            active_files, return_warnings=True, workbooks=workbooks, sheet_cache=sheet_cache
+        )
     details_export_file_name = os.path.join(
         "data",
         "data-processing-output",
         f"Abstimmungen_Details_{details_abst_date}.csv",
     )
-    details_changed = upload_ftp_if_changed(df_details, details_export_file_name)
+    with timed("Uploading details"):
+        details_changed = upload_ftp_if_changed(df_details, details_export_file_name)
 
-    kennz_abst_date, df_kennz = calculate_kennzahlen(active_files)
+    with timed("Calculating Kennzahlen"):
+        kennz_abst_date, df_kennz = calculate_kennzahlen(active_files, workbooks=workbooks, sheet_cache=sheet_cache)
     kennz_file_name = os.path.join("data", "data-processing-output", f"Abstimmungen_{kennz_abst_date}.csv")
-    kennz_changed = upload_ftp_if_changed(df_kennz, kennz_file_name)
+    with timed("Uploading Kennzahlen"):
+        kennz_changed = upload_ftp_if_changed(df_kennz, kennz_file_name)
     return df_details, details_changed, df_kennz, kennz_changed, privacy_warnings
 
 
@@ -236,4 +375,7 @@ def get_latest_data_files():
 
 if __name__ == "__main__":
     print(f"Executing {__file__}...")
-    main()
+    if "--watch" in sys.argv[1:]:
+        watch()
+    else:
+        main()
@@ -6,6 +6,7 @@ import common
 import dateparser
 import numpy as np
 import pandas as pd
+from workbook import calculate_sheet, load_workbooks
 
 PHYSICAL_URNE_WAHLLOKALE = {
     "Bahnhof SBB",
@@ -181,11 +182,13 @@ def main():
     print("Job successful!")
 
 
-def calculate_details(data_file_names, return_warnings=False):
+def calculate_details(data_file_names, return_warnings=False, workbooks=None, sheet_cache=None):
     abst_date = ""
     appended_data = []
     privacy_warnings = []
     print(f"Starting to work with data file(s) {data_file_names}...")
+    if workbooks is None:
+        workbooks = load_workbooks(data_file_names)
     columns_to_keep = [
         "Wahllok_name",
         "Stimmr_Anz",
@@ -204,152 +207,14 @@ def calculate_details(data_file_names, return_warnings=False):
         "abst_typ",
     ]
     for data_file_name in data_file_names:
-        import_file_name = os.path.join("data", data_file_name)
-        print(f"Reading dataset from {import_file_name} to retrieve sheet names...")
-        sheets = pd.read_excel(import_file_name, sheet_name=None, skiprows=4, index_col=None)
-        dat_sheet_names = []
-        print('Determining "DAT n" sheets...')
-        for key in sheets:
-            if key.startswith("DAT "):
-                dat_sheet_names.append(key)
-
-        valid_wahllokale = [
-            "Bahnhof SBB",
-            "Rathaus",
-            "Polizeiwache Clara",
-            "Basel brieflich Stimmende",
-            "Riehen Gemeindehaus",
-            "Riehen brieflich Stimmende",
-            "Bettingen Gemeindehaus",
-            "Bettingen brieflich Stimmende",
-            "Persönlich an der Urne Stimmende AS",
-            "Brieflich Stimmende AS",
-        ]
-
-        # from 2023-06-18 onwards "Basel brieflich Stimmende" becomes "Basel briefl. & elektr. Stimmende (Total)"
-        valid_wahllokale_ab_20230618 = [
-            "Bahnhof SBB",
-            "Rathaus",
-            "Polizeiwache Clara",
-            "Basel briefl. & elektr. Stimmende (Total)",
-            "Riehen Gemeindehaus",
-            "Riehen briefl. & elektr. Stimmende (Total)",
-            "Bettingen Gemeindehaus",
-            "Bettingen briefl. & elektr. Stimmende (Total)",
-            "Persönlich an der Urne Stimmende AS",
-            "Brieflich Stimmende AS",
-            "Elektronisch Stimmende AS",
-        ]
-
-        # from 2025-09-01 onwards Kleinbasel as separate Wahllokal
-        valid_wahllokale_ab_20250901 = [
-            "Bahnhof SBB",
-            "Rathaus",
-            "Kleinbasel",
-            "Basel briefl. & elektr. Stimmende (Total)",
-            "Riehen Gemeindehaus",
-            "Riehen briefl. & elektr. Stimmende (Total)",
-            "Bettingen Gemeindehaus",
-            "Bettingen briefl. & elektr. Stimmende (Total)",
-            "Persönlich an der Urne Stimmende AS",
-            "Brieflich Stimmende AS",
-            "Elektronisch Stimmende AS",
-        ]
-
+        workbook = workbooks[data_file_name]
         dat_sheets = []
-        for sheet_name in dat_sheet_names:
-            print(f"Reading Abstimmungstitel from {sheet_name}...")
-            df_title = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=4, index_col=None)
-            abst_title_raw = df_title.columns[1]
-            # Get String that starts form ')' plus space + 1 characters to the right
-            abst_title = abst_title_raw[abst_title_raw.find(")") + 2 :]
-
-            print(f"Reading Abstimmungsart and Date from {sheet_name}...")
-            df_meta = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=2, index_col=None)
-            title_string = df_meta.columns[1]
-            abst_type = "kantonal" if title_string.startswith("Kantonal") else "national"
-            abst_date_raw = title_string[title_string.find("vom ") + 4 :]
-            abst_date = dateparser.parse(abst_date_raw).strftime("%Y-%m-%d")
-
-            print(f"Reading data from {sheet_name}...")
-            df = pd.read_excel(
-                import_file_name, sheet_name=sheet_name, skiprows=6, index_col=None
-            )  # , header=[0, 1, 2])
-            df.reset_index(inplace=True)
-            gegen_col = get_counterproposal_column(df.columns)
-            is_gegenvorschlag = has_counterproposal(abst_title, df.columns)
-            if is_gegenvorschlag and gegen_col is None:
-                print(f"No counter-proposal column found in {sheet_name}; treating this as non-counterproposal case.")
-                is_gegenvorschlag = False
-
-            print("Filtering out Wahllokale...")
-            if abst_date < "2023-06-18":
-                valid_wahllokale = valid_wahllokale
-            elif abst_date < "2025-09-01":
-                valid_wahllokale = valid_wahllokale_ab_20230618
-            else:
-                valid_wahllokale = valid_wahllokale_ab_20250901
-            df = df[df["Wahllokale"].isin(valid_wahllokale)]
-
-            print("Renaming columns...")
-            df.rename(
-                columns={
-                    "Wahllokale": "Wahllok_name",
-                    "Unnamed: 2": "Stimmr_Anz",
-                    "eingelegte": "Eingel_Anz",
-                    "leere": "Leer_Anz",
-                    "ungültige": "Unguelt_Anz",
-                    "Total gültige": "Guelt_Anz",
-                    "Ja": "Ja_Anz",
-                    "Nein": "Nein_Anz",
-                },
-                inplace=True,
+        for sheet_name in workbook.dat_sheet_names:
+            abst_date, df, is_gegenvorschlag, warnings = calculate_sheet(
+                calculate_details_of_sheet, workbook, sheet_name, sheet_cache
             )
-
-            print("Setting cell values retrieved earlier...")
-            df["Abst_Titel"] = abst_title
-            df["Abst_Art"] = abst_type
-            df["Abst_Datum"] = abst_date
-            df["Abst_ID"] = sheet_name[sheet_name.find("DAT ") + 4]
-            df["abst_typ"] = "Abstimmung ohne Gegenvorschlag / Stichfrage"
-
-            df.Guelt_Anz.replace(0, pd.NA, inplace=True)  # Prevent division by zero errors
-
+            privacy_warnings.extend(warnings)
             if is_gegenvorschlag:
-                print("Adding Gegenvorschlag data...")
-                result_type = df_meta.columns[15] if len(df_meta.columns) > 15 else df_meta.columns[-1]
-                if abst_type == "national":
-                    df.abst_typ = "Initiative mit Gegenentwurf und Stichfrage"
-                else:
-                    df.abst_typ = "Initiative mit Gegenvorschlag und Stichfrage"
-                rename_columns = {
-                    "Ja.1": "Gege_Ja_Anz",
-                    "Nein.1": "Gege_Nein_Anz",
-                    "Initiative": "Sti_Initiative_Anz",
-                    "ohne gültige Antwort": "Init_OGA_Anz",
-                    "ohne gültige Antwort.1": "Gege_OGA_Anz",
-                    "ohne gültige Antwort.2": "Sti_OGA_Anz",
-                }
-                if gegen_col is not None:
-                    rename_columns[gegen_col] = "Sti_Gegenvorschlag_Anz"
-                df.rename(columns=rename_columns, inplace=True)
-
-                print("Calculating anteil_ja_stimmen for Gegenvorschlag case...")
-                for column in [
-                    df.Ja_Anz,
-                    df.Nein_Anz,
-                    df.Gege_Ja_Anz,
-                    df.Gege_Nein_Anz,
-                    df.Sti_Initiative_Anz,
-                    df.Sti_Gegenvorschlag_Anz,
-                ]:
-                    column.replace(0, pd.NA, inplace=True)  # Prevent division by zero errors
-
-                df["anteil_ja_stimmen"] = df.Ja_Anz / (df.Ja_Anz + df.Nein_Anz)
-                df["gege_anteil_ja_Stimmen"] = df.Gege_Ja_Anz / (df.Gege_Ja_Anz + df.Gege_Nein_Anz)
-                df["sti_anteil_init_stimmen"] = df.Sti_Initiative_Anz / (
-                    df.Sti_Initiative_Anz + df.Sti_Gegenvorschlag_Anz
-                )
                 columns_to_keep = columns_to_keep + [
                     "Gege_Ja_Anz",
                     "Gege_Nein_Anz",
@@ -361,17 +226,6 @@ def calculate_details(data_file_names, return_warnings=False):
                     "Gege_OGA_Anz",
                     "Sti_OGA_Anz",
                 ]
-            else:
-                print("Adding data for case that is not with Gegenvorschlag...")
-                result_type = df_meta.columns[8] if len(df_meta.columns) > 8 else df_meta.columns[-1]
-                print("Calculating anteil_ja_stimmen for case that is not with Gegenvorschlag...")
-                df["anteil_ja_stimmen"] = df["Ja_Anz"] / df["Guelt_Anz"]
-
-            apply_vote_consistency_rules(df, is_gegenvorschlag)
-            clear_counterproposal_fields_for_non_counterproposal(df, is_gegenvorschlag)
-            set_elektronisch_as_to_na_if_all_zero(df)
-            privacy_warnings.extend(detect_physical_urne_warnings(df))
-            df["Result_Art"] = result_type
             dat_sheets.append(df)
 
         print("Creating one dataframe for all Abstimmungen...")
@@ -410,6 +264,153 @@ def calculate_details(data_file_names, return_warnings=False):
     return abst_date, concatenated_df
 
 
+def calculate_details_of_sheet(workbook, sheet_name):
+    """Returns the Abstimmungsdatum, the rows, the counter-proposal flag and the privacy warnings of one "DAT n" sheet."""
+    valid_wahllokale = [
+        "Bahnhof SBB",
+        "Rathaus",
+        "Polizeiwache Clara",
+        "Basel brieflich Stimmende",
+        "Riehen Gemeindehaus",
+        "Riehen brieflich Stimmende",
+        "Bettingen Gemeindehaus",
+        "Bettingen brieflich Stimmende",
+        "Persönlich an der Urne Stimmende AS",
+        "Brieflich Stimmende AS",
+    ]
+
+    # from 2023-06-18 onwards "Basel brieflich Stimmende" becomes "Basel briefl. & elektr. Stimmende (Total)"
+    valid_wahllokale_ab_20230618 = [
+        "Bahnhof SBB",
+        "Rathaus",
+        "Polizeiwache Clara",
+        "Basel briefl. & elektr. Stimmende (Total)",
+        "Riehen Gemeindehaus",
+        "Riehen briefl. & elektr. Stimmende (Total)",
+        "Bettingen Gemeindehaus",
+        "Bettingen briefl. & elektr. Stimmende (Total)",
+        "Persönlich an der Urne Stimmende AS",
+        "Brieflich Stimmende AS",
+        "Elektronisch Stimmende AS",
+    ]
+
+    # from 2025-09-01 onwards Kleinbasel as separate Wahllokal
+    valid_wahllokale_ab_20250901 = [
+        "Bahnhof SBB",
+        "Rathaus",
+        "Kleinbasel",
+        "Basel briefl. & elektr. Stimmende (Total)",
+        "Riehen Gemeindehaus",
+        "Riehen briefl. & elektr. Stimmende (Total)",
+        "Bettingen Gemeindehaus",
+        "Bettingen briefl. & elektr. Stimmende (Total)",
+        "Persönlich an der Urne Stimmende AS",
+        "Brieflich Stimmende AS",
+        "Elektronisch Stimmende AS",
+    ]
+
+    print(f"Reading Abstimmungstitel from {sheet_name}...")
+    df_title = workbook.read_sheet(sheet_name, skiprows=4)
+    abst_title_raw = df_title.columns[1]
+    # Get String that starts form ')' plus space + 1 characters to the right
+    abst_title = abst_title_raw[abst_title_raw.find(")") + 2 :]
+
+    print(f"Reading Abstimmungsart and Date from {sheet_name}...")
+    df_meta = workbook.read_sheet(sheet_name, skiprows=2)
+    title_string = df_meta.columns[1]
+    abst_type = "kantonal" if title_string.startswith("Kantonal") else "national"
+    abst_date_raw = title_string[title_string.find("vom ") + 4 :]
+    abst_date = dateparser.parse(abst_date_raw).strftime("%Y-%m-%d")
+
+    print(f"Reading data from {sheet_name}...")
+    df = workbook.read_sheet(sheet_name, skiprows=6)
+    df.reset_index(inplace=True)
+    gegen_col = get_counterproposal_column(df.columns)
+    is_gegenvorschlag = has_counterproposal(abst_title, df.columns)
+    if is_gegenvorschlag and gegen_col is None:
+        print(f"No counter-proposal column found in {sheet_name}; treating this as non-counterproposal case.")
+        is_gegenvorschlag = False
+
+    print("Filtering out Wahllokale...")
+    if abst_date < "2023-06-18":
+        valid_wahllokale = valid_wahllokale
+    elif abst_date < "2025-09-01":
+        valid_wahllokale = valid_wahllokale_ab_20230618
+    else:
+        valid_wahllokale = valid_wahllokale_ab_20250901
+    df = df[df["Wahllokale"].isin(valid_wahllokale)]
+
+    print("Renaming columns...")
+    df.rename(
+        columns={
+            "Wahllokale": "Wahllok_name",
+            "Unnamed: 2": "Stimmr_Anz",
+            "eingelegte": "Eingel_Anz",
+            "leere": "Leer_Anz",
+            "ungültige": "Unguelt_Anz",
+            "Total gültige": "Guelt_Anz",
+            "Ja": "Ja_Anz",
+            "Nein": "Nein_Anz",
+        },
+        inplace=True,
+    )
+
+    print("Setting cell values retrieved earlier...")
+    df["Abst_Titel"] = abst_title
+    df["Abst_Art"] = abst_type
+    df["Abst_Datum"] = abst_date
+    df["Abst_ID"] = sheet_name[sheet_name.find("DAT ") + 4]
+    df["abst_typ"] = "Abstimmung ohne Gegenvorschlag / Stichfrage"
+
+    df.Guelt_Anz.replace(0, pd.NA, inplace=True)  # Prevent division by zero errors
+
+    if is_gegenvorschlag:
+        print("Adding Gegenvorschlag data...")
+        result_type = df_meta.columns[15] if len(df_meta.columns) > 15 else df_meta.columns[-1]
+        if abst_type == "national":
+            df.abst_typ = "Initiative mit Gegenentwurf und Stichfrage"
+        else:
+            df.abst_typ = "Initiative mit Gegenvorschlag und Stichfrage"
+        rename_columns = {
+            "Ja.1": "Gege_Ja_Anz",
+            "Nein.1": "Gege_Nein_Anz",
+            "Initiative": "Sti_Initiative_Anz",
+            "ohne gültige Antwort": "Init_OGA_Anz",
+            "ohne gültige Antwort.1": "Gege_OGA_Anz",
+            "ohne gültige Antwort.2": "Sti_OGA_Anz",
+        }
+        if gegen_col is not None:
+            rename_columns[gegen_col] = "Sti_Gegenvorschlag_Anz"
+        df.rename(columns=rename_columns, inplace=True)
+
+        print("Calculating anteil_ja_stimmen for Gegenvorschlag case...")
+        for column in [
+            df.Ja_Anz,
+            df.Nein_Anz,
+            df.Gege_Ja_Anz,
+            df.Gege_Nein_Anz,
+            df.Sti_Initiative_Anz,
+            df.Sti_Gegenvorschlag_Anz,
+        ]:
+            column.replace(0, pd.NA, inplace=True)  # Prevent division by zero errors
+
+        df["anteil_ja_stimmen"] = df.Ja_Anz / (df.Ja_Anz + df.Nein_Anz)
+        df["gege_anteil_ja_Stimmen"] = df.Gege_Ja_Anz / (df.Gege_Ja_Anz + df.Gege_Nein_Anz)
+        df["sti_anteil_init_stimmen"] = df.Sti_Initiative_Anz / (df.Sti_Initiative_Anz + df.Sti_Gegenvorschlag_Anz)
+    else:
+        print("Adding data for case that is not with Gegenvorschlag...")
+        result_type = df_meta.columns[8] if len(df_meta.columns) > 8 else df_meta.columns[-1]
+        print("Calculating anteil_ja_stimmen for case that is not with Gegenvorschlag...")
+        df["anteil_ja_stimmen"] = df["Ja_Anz"] / df["Guelt_Anz"]
+
+    apply_vote_consistency_rules(df, is_gegenvorschlag)
+    clear_counterproposal_fields_for_non_counterproposal(df, is_gegenvorschlag)
+    set_elektronisch_as_to_na_if_all_zero(df)
+    privacy_warnings = detect_physical_urne_warnings(df)
+    df["Result_Art"] = result_type
+    return abst_date, df, is_gegenvorschlag, privacy_warnings
+
+
 if __name__ == "__main__":
     print(f"Executing {__file__}...")
     main()
@@ -0,0 +1,51 @@
+import etl
+import numpy as np
+import pandas as pd
+import pytest
+from etl import get_changed_rows
+
+
+def test_all_rows_are_pushed_first():
+    df = pd.DataFrame({"id": ["a", "b"], "Ja_Anz": [1.0, 2.0]})
+    assert get_changed_rows(df, None) is df
+
+
+def test_only_changed_rows_are_pushed():
+    df_pushed = pd.DataFrame({"id": ["a", "b", "c"], "Ja_Anz": [1.0, np.nan, 3.0], "Result_Art": ["x", None, "z"]})
+    df = df_pushed.copy()
+    df.loc[2, "Ja_Anz"] = 4.0
+    assert get_changed_rows(df, df_pushed)["id"].tolist() == ["c"]
+    assert len(get_changed_rows(df_pushed.copy(), df_pushed)) == 0
+
+
+def test_all_rows_are_pushed_if_columns_change():
+    df_pushed = pd.DataFrame({"id": ["a"], "Ja_Anz": [1.0]})
+    df = df_pushed.assign(Gege_Ja_Anz=2.0)
+    assert len(get_changed_rows(df, df_pushed)) == 1
+
+
+def test_failed_push_is_retried_with_next_poll(monkeypatch):
+    active_abst = pd.DataFrame({"Active": [True], "Abstimmungs_datum": ["2026-11-29"]})
+    monkeypatch.setattr(etl, "read_active_abstimmungen", lambda: active_abst)
+    monkeypatch.setattr(etl, "check_embargos", lambda active_abst, active_active_size: (True, False))
+    monkeypatch.setattr(etl, "find_data_files_for_active_abst", lambda active_abst: ["20261129_KAN.xlsx"])
+    monkeypatch.setattr(etl, "get_file_stat", lambda file: (1000, 0.0))
+    monkeypatch.setattr(etl, "Workbook", lambda file_name: file_name)
+    df = pd.DataFrame({"id": ["a", "b"], "Ja_Anz": [1.0, 2.0]})
+    monkeypatch.setattr(etl, "process_active_files", lambda *args, push_df, **kwargs: push_df(df, "url"))
+    pushes = []
+
+    def ods_realtime_push_df(df, url):
+        pushes.append(len(df))
+        if len(pushes) == 1:
+            raise ConnectionError("ODS is not reachable")
+
+    monkeypatch.setattr(etl.common, "ods_realtime_push_df", ods_realtime_push_df)
+    watcher = etl.AbstimmungWatcher()
+    # The first poll only sees the file, the second one processes it once it is stable
+    watcher.poll()
+    with pytest.raises(ConnectionError):
+        watcher.poll()
+    watcher.poll()
+    watcher.poll()
+    assert pushes == [2, 2]
@@ -0,0 +1,41 @@
+import openpyxl
+import pandas as pd
+import pytest
+from workbook import Workbook
+
+
+@pytest.fixture
+def workbook_file(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = "DAT 1"
+    sheet.append([None, "Kantonale Volksabstimmung vom 13. Juni 2021"])
+    sheet.append([])
+    sheet.append([None, "1) Titel der Vorlage"])
+    sheet.append([None, "Wahllokale", None, "eingelegte", "Ja", "Nein", "Ja", "Nein"])
+    sheet.append([None, "Bahnhof SBB", 1200, 801.0, 400, 399.5, "=1/0", None])
+    sheet.append([None, "Total Kanton", 120000, 80100, 40000, 39000])
+    stimmber_sheet = book.create_sheet("Stimmberechtigte (Details)")
+    for row in (
+        [],
+        [],
+        [None, "Gemeinde", "Stimmberechtigte"],
+        [None, "Riehen", 15000],
+        [None, "Total Kanton", 120000],
+    ):
+        stimmber_sheet.append(row)
+    book.create_sheet("Leer")
+    file_name = tmp_path / "Resultate_KAN.xlsx"
+    book.save(file_name)
+    return file_name
+
+
+def test_dat_sheet_names(workbook_file):
+    assert Workbook(workbook_file).dat_sheet_names == ["DAT 1"]
+
+
+@pytest.mark.parametrize("sheet_name", ["DAT 1", "Stimmberechtigte (Details)", "Leer"])
+@pytest.mark.parametrize("skiprows", [None, 0, 2, 3])
+def test_read_sheet_equals_read_excel(workbook_file, sheet_name, skiprows):
+    expected = pd.read_excel(workbook_file, sheet_name=sheet_name, skiprows=skiprows, index_col=None)
+    pd.testing.assert_frame_equal(Workbook(workbook_file).read_sheet(sheet_name, skiprows=skiprows), expected)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+
+def convert_cell(cell):
+    # Same conversion as pandas' openpyxl reader, so that the parsed frames are identical to pd.read_excel
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def read_grid(worksheet):
+    worksheet.reset_dimensions()
+    grid = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(worksheet.rows):
+        values = [convert_cell(cell) for cell in row]
+        while values and values[-1] == "":
+            values.pop()
+        if values:
+            last_row_with_data = row_number
+        grid.append(values)
+    grid = grid[: last_row_with_data + 1]
+    width = max((len(values) for values in grid), default=0)
+    return [values + [""] * (width - len(values)) for values in grid]
+
+
+class Workbook:
+    """Cell grids of all sheets of an Excel file, parsed once and sliced into DataFrames as often as needed."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        print(f"Parsing all sheets of {file_name}...")
+        book = openpyxl.load_workbook(file_name, read_only=True, data_only=True, keep_links=False)
+        try:
+            self.grids = {worksheet.title: read_grid(worksheet) for worksheet in book.worksheets}
+        finally:
+            book.close()
+        self.digests = {
+            sheet_name: hashlib.blake2b(repr(grid).encode("utf-8")).hexdigest()
+            for sheet_name, grid in self.grids.items()
+        }
+
+    @property
+    def sheet_names(self):
+        return list(self.grids)
+
+    @property
+    def dat_sheet_names(self):
+        return [sheet_name for sheet_name in self.grids if sheet_name.startswith("DAT ")]
+
+    def read_sheet(self, sheet_name, skiprows=None):
+        """Equivalent of pd.read_excel(file_name, sheet_name=sheet_name, skiprows=skiprows, index_col=None)."""
+        grid = self.grids[sheet_name]
+        if not grid:
+            return pd.DataFrame()
+        parser = TextParser(grid, header=0, index_col=None, skiprows=skiprows, skip_blank_lines=False)
+        return parser.read()
+
+
+def calculate_sheet(calculate, workbook, sheet_name, sheet_cache=None):
+    """
+    Returns calculate(workbook, sheet_name). With a sheet_cache dict, the result is reused for as long as the cells
+    of the sheet stay the same, so that only changed sheets are recalculated.
+    """
+    if sheet_cache is None:
+        return calculate(workbook, sheet_name)
+    key = (calculate.__module__, calculate.__name__, sheet_name, workbook.digests[sheet_name])
+    if key not in sheet_cache:
+        sheet_cache[key] = calculate(workbook, sheet_name)
+    else:
+        print(f"Sheet {sheet_name} of {workbook.file_name} has not changed, reusing its {calculate.__name__} result...")
+    return sheet_cache[key]
+
+
+def load_workbooks(data_file_names):
+    """Parses each data file in data/ exactly once, keyed by file name."""
+    return {data_file_name: Workbook(os.path.join("data", data_file_name)) for data_file_name in data_file_names}
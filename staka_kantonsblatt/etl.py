@@ -2,6 +2,7 @@ import datetime
 import io
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import common
 import pandas as pd
@@ -10,6 +11,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 EXCEL_PATH = os.getenv("EXCEL_PATH_BAUPUBLIKATIONEN_FOR_MAIL")
+# One pickle per year-month, months older than the previous month get a .complete marker and are not fetched again
+MONTHS_DIR = os.path.join("data", "months")
+FETCH_WORKERS = int(os.getenv("KANTONSBLATT_FETCH_WORKERS", "4"))
 
 # References:
 # https://www.amtsblattportal.ch/docs/api/
@@ -71,17 +75,43 @@ def main():
     common.update_ftp_and_odsp(path_export, "staka/kantonsblatt", "100352")
 
 
+def get_month_files(year, month):
+    name = f"{year}-{month:02d}"
+    return os.path.join(MONTHS_DIR, f"{name}.pkl"), os.path.join(MONTHS_DIR, f"{name}.complete")
+
+
+def fetch_month(year, month, closed):
+    """Downloads a month and stores it in MONTHS_DIR, marking it as complete if the month is closed."""
+    logging.info(f"Getting data for {year}-{month}...")
+    df_month = iterate_over_pages(year, month)
+    path_month, path_complete = get_month_files(year, month)
+    df_month.to_pickle(path_month)
+    if closed:
+        open(path_complete, "w").close()
+    return df_month
+
+
 def iterate_over_years():
+    """
+    Returns all publications since 2019. Closed months are read from MONTHS_DIR, only the current and the
+    previous month as well as months that were never fetched completely are downloaded (concurrently).
+    """
     start_year = 2019
-    df = pd.DataFrame()
-    for year in range(start_year, datetime.datetime.now().year + 1):
-        for month in range(1, 13):
-            if year == datetime.datetime.now().year and month > datetime.datetime.now().month:
-                break
-            logging.info(f"Getting data for {year}-{month}...")
-            df_month = iterate_over_pages(year, month)
-            df = pd.concat([df, df_month])
-    return df
+    now = datetime.datetime.now()
+    previous_month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    months = [
+        (year, month)
+        for year in range(start_year, now.year + 1)
+        for month in range(1, 13)
+        if (year, month) <= (now.year, now.month)
+    ]
+    os.makedirs(MONTHS_DIR, exist_ok=True)
+    months_to_fetch = [(year, month) for year, month in months if not os.path.exists(get_month_files(year, month)[1])]
+    logging.info(f"Fetching {len(months_to_fetch)} of {len(months)} months with {FETCH_WORKERS} workers...")
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = {ym: executor.submit(fetch_month, *ym, closed=ym < previous_month) for ym in months_to_fetch}
+    dfs = [futures[ym].result() if ym in futures else pd.read_pickle(get_month_files(*ym)[0]) for ym in months]
+    return pd.concat(dfs, ignore_index=True)
 
 
 def iterate_over_pages(year, month):
@@ -91,7 +121,7 @@ def iterate_over_pages(year, month):
     url = f"{base_url}{start_date}{end_date}"
     page = 0
     next_page = f"{url}&pageRequest.page={page}"
-    df = pd.DataFrame()
+    dfs = []
     while True:
         logging.info(f"Getting data from {next_page}...")
         r = common.requests_get(next_page)
@@ -99,11 +129,10 @@ def iterate_over_pages(year, month):
         df_curr_page = pd.read_csv(io.StringIO(r.content.decode("utf-8")), sep=";")
         if df_curr_page.empty:
             break
-        df_curr_page = add_columns(df_curr_page)
-        df = pd.concat([df, df_curr_page])
+        dfs.append(add_columns(df_curr_page))
         page = page + 1
         next_page = f"{url}&pageRequest.page={page}"
-    return df
+    return pd.concat(dfs) if dfs else pd.DataFrame()
 
 
 def add_columns(df):
@@ -3,7 +3,11 @@ import json
 import logging
 import os
 import pathlib
+import re
+import sqlite3
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import common
 import common.change_tracking as ct
@@ -13,22 +17,33 @@ from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 from rapidfuzz import process
 from shapely.geometry import Point
-from SPARQLWrapper import JSON, SPARQLWrapper
+from shapely.prepared import prep
+
+# Addresses Nominatim did not find are only queried again after this time
+NOMINATIM_RETRY_DAYS = datetime.timedelta(days=30)
+CANTON_QUERY_WORKERS = int(os.getenv("ZEFIX_CANTON_QUERY_WORKERS", "4"))
+# Minimal similarity (0-100) of a fuzzy matched street to use its coordinates from the Gebäudeeingänge directly
+STREET_SCORE_CUTOFF = 90
 
 
 def main():
     # Get NOGA data (Temporarily deactivated)
     # df_burweb = get_noga_data()
     # Get Zefix and BurWeb data for all cantons
-    get_data_of_all_cantons()
-
-    # Extract data for Basel-Stadt and make ready for data.bs.ch
-    file_name = "100330_zefix_firmen_BS.csv"
-    path_export = os.path.join(pathlib.Path(__file__).parents[0], "data", "export", file_name)
-    df_BS = work_with_BS_data()
-    df_BS.to_csv(path_export, index=False)
-    common.update_ftp_and_odsp(path_export, "zefix_handelsregister", "100330")
-    create_diff_files(path_export)
+    changed_cantons = get_data_of_all_cantons()
+
+    # Extract data for Basel-Stadt and make ready for data.bs.ch, unless it has not changed
+    if "BS" in changed_cantons:
+        file_name = "100330_zefix_firmen_BS.csv"
+        path_export = os.path.join(pathlib.Path(__file__).parents[0], "data", "export", file_name)
+        df_BS = work_with_BS_data()
+        df_BS.to_csv(path_export, index=False)
+        common.update_ftp_and_odsp(path_export, "zefix_handelsregister", "100330")
+        create_diff_files(path_export)
+    else:
+        logging.info("Data of Basel-Stadt has not changed, skipping geocoding and diff files.")
+    for path_export in changed_cantons.values():
+        ct.update_hash_file(path_export)
 
 
 def create_diff_files(path_to_new):
@@ -83,117 +98,127 @@ def upload_rows_to_ftp(df, path_export):
 
 
 def get_data_of_all_cantons():
-    sparql = SPARQLWrapper("https://lindas.admin.ch/query")
-    sparql.setReturnFormat(JSON)
-    # Iterate over all cantons
-    for i in range(1, 27):
-        logging.info(f"Getting data for canton {i}...")
-        # Query can be tested and adjusted here: https://ld.admin.ch/sparql/#
-        sparql.setQuery(
-            """
-                PREFIX schema: <http://schema.org/>
-                PREFIX admin: <https://schema.ld.admin.ch/>
-                SELECT ?canton_id ?canton ?short_name_canton ?district_id ?district_de ?district_fr ?district_it ?district_en ?muni_id ?municipality ?company_uri ?company_uid ?company_legal_name ?type_id ?company_type_de ?company_type_fr ?adresse ?plz ?locality 
-                WHERE {
-                    # Get information of the company
-                    ?company_uri a admin:ZefixOrganisation ;
-                        schema:legalName ?company_legal_name ;
-                        admin:municipality ?muni_id ;
-                        schema:identifier ?company_identifiers ;
-                        schema:address ?adr ;
-                        schema:additionalType ?type_id .
-                    # Get Identifier UID, but filter by CompanyUID, since there are three types of ID's
-                    ?company_identifiers schema:value ?company_uid .
-                    ?company_identifiers schema:name "CompanyUID" .
-                    ?muni_id schema:name ?municipality .
-                    ?type_id schema:name ?company_type_de .
-                    # Get address-information (do not take c/o-information in, since we get fewer results)
-                    ?adr schema:streetAddress ?adresse ;
-                        schema:addressLocality ?locality ;
-                        schema:postalCode ?plz .
-                    # Finally filter by Companies that are in a certain canton
-                    <https://ld.admin.ch/canton/"""
-            + str(i)
-            + """> schema:containsPlace ?muni_id ;
-                        schema:legalName ?canton ;
-                        schema:alternateName ?short_name_canton ;
-                        schema:identifier ?canton_id .
+    """
+    Queries the companies of all cantons concurrently (CANTON_QUERY_WORKERS at a time), exports and uploads the
+    cantons whose data changed and returns {short_name_canton: path_export} of those. The hash files of the
+    returned files are not updated yet, so that a failing later stage is repeated in the next run.
+    """
+    with ThreadPoolExecutor(max_workers=CANTON_QUERY_WORKERS) as executor:
+        results = list(executor.map(get_data_of_canton, range(1, 27)))
+    changed_exports = {short_name_canton: path_export for short_name_canton, path_export in results if path_export}
+    # Uploaded here on the main thread, since common.upload_ftp changes the working directory of the process
+    for short_name_canton, path_export in changed_exports.items():
+        logging.info(f"Exporting {os.path.basename(path_export)} to FTP server")
+        common.upload_ftp(path_export, remote_path="zefix_handelsregister/all_cantons")
+    return changed_exports
+
+
+def get_data_of_canton(i):
+    logging.info(f"Getting data for canton {i}...")
+    # Query can be tested and adjusted here: https://ld.admin.ch/sparql/#
+    query = (
+        """
+            PREFIX schema: <http://schema.org/>
+            PREFIX admin: <https://schema.ld.admin.ch/>
+            SELECT ?canton_id ?canton ?short_name_canton ?district_id ?district_de ?district_fr ?district_it ?district_en ?muni_id ?municipality ?company_uri ?company_uid ?company_legal_name ?type_id ?company_type_de ?company_type_fr ?adresse ?plz ?locality 
+            WHERE {
+                # Get information of the company
+                ?company_uri a admin:ZefixOrganisation ;
+                    schema:legalName ?company_legal_name ;
+                    admin:municipality ?muni_id ;
+                    schema:identifier ?company_identifiers ;
+                    schema:address ?adr ;
+                    schema:additionalType ?type_id .
+                # Get Identifier UID, but filter by CompanyUID, since there are three types of ID's
+                ?company_identifiers schema:value ?company_uid .
+                ?company_identifiers schema:name "CompanyUID" .
+                ?muni_id schema:name ?municipality .
+                ?type_id schema:name ?company_type_de .
+                # Get address-information (do not take c/o-information in, since we get fewer results)
+                ?adr schema:streetAddress ?adresse ;
+                    schema:addressLocality ?locality ;
+                    schema:postalCode ?plz .
+                # Finally filter by Companies that are in a certain canton
+                <https://ld.admin.ch/canton/"""
+        + str(i)
+        + """> schema:containsPlace ?muni_id ;
+                    schema:legalName ?canton ;
+                    schema:alternateName ?short_name_canton ;
+                    schema:identifier ?canton_id .
+                ?district_id schema:containsPlace ?muni_id ;
+                    schema:name ?district_de .
+
+                # Optional to get district names in French
+                OPTIONAL {
                     ?district_id schema:containsPlace ?muni_id ;
-                        schema:name ?district_de .
-
-                    # Optional to get district names in French
-                    OPTIONAL {
-                        ?district_id schema:containsPlace ?muni_id ;
-                            schema:name ?district_fr .
-                        FILTER langMatches(lang(?district_fr), "fr")
-                    }
-
-                    # Optional to get district names in Italian
-                    OPTIONAL {
-                        ?district_id schema:containsPlace ?muni_id ;
-                            schema:name ?district_it .
-                        FILTER langMatches(lang(?district_it), "it")
-                    }
-
-                    # Optional to get district names in English
-                    OPTIONAL {
-                        ?district_id schema:containsPlace ?muni_id ;
-                            schema:name ?district_en .
-                        FILTER langMatches(lang(?district_en), "en")
-                    }
-
-                    # Optional to get company types in French
-                    OPTIONAL {
-                        ?type_id schema:name ?company_type_fr .
-                        FILTER langMatches(lang(?company_type_fr), "fr")
-                    }
-
-                    # Filter by company-types that are german (otherwise result is much bigger)
-                    FILTER langMatches(lang(?district_de), "de") .
-                    FILTER langMatches(lang(?company_type_de), "de") .
+                        schema:name ?district_fr .
+                    FILTER langMatches(lang(?district_fr), "fr")
                 }
-                ORDER BY ?company_legal_name
-            """
-        )
 
-        results = sparql.query().convert()
-        results_df = pd.json_normalize(results["results"]["bindings"])
-        results_df = results_df.filter(regex="value$", axis=1)
-        new_column_names = {col: col.replace(".value", "") for col in results_df.columns}
-        results_df = results_df.rename(columns=new_column_names)
-        # Split the column 'address' into zusatz and street,
-        # but if there is no zusatz, then street is in the first column
-        temp_df = results_df["adresse"].str.split("\n", expand=True)
-        results_df.loc[results_df["adresse"].str.contains("\n"), "zusatz"] = temp_df[0]
-        results_df.loc[results_df["adresse"].str.contains("\n"), "street"] = temp_df[1]
-        results_df.loc[~results_df["adresse"].str.contains("\n"), "street"] = temp_df[0]
-        results_df = results_df.drop(columns=["adresse"])
-
-        short_name_canton = results_df["short_name_canton"][0]
-        # Add url to cantonal company register
-        # Transform UID in format CHE123456789 to format CHE-123.456.789
-        company_uid_str = results_df["company_uid"].str.replace(
-            "CHE([0-9]{3})([0-9]{3})([0-9]{3})", "CHE-\\1.\\2.\\3", regex=True
-        )
-        results_df["url_cantonal_register"] = (
-            "https://"
-            + short_name_canton.lower()
-            + ".chregister.ch/cr-portal/auszug/auszug.xhtml?uid="
-            + company_uid_str
-        )
+                # Optional to get district names in Italian
+                OPTIONAL {
+                    ?district_id schema:containsPlace ?muni_id ;
+                        schema:name ?district_it .
+                    FILTER langMatches(lang(?district_it), "it")
+                }
 
+                # Optional to get district names in English
+                OPTIONAL {
+                    ?district_id schema:containsPlace ?muni_id ;
+                        schema:name ?district_en .
+                    FILTER langMatches(lang(?district_en), "en")
+                }
+
+                # Optional to get company types in French
+                OPTIONAL {
+                    ?type_id schema:name ?company_type_fr .
+                    FILTER langMatches(lang(?company_type_fr), "fr")
+                }
+
+                # Filter by company-types that are german (otherwise result is much bigger)
+                FILTER langMatches(lang(?district_de), "de") .
+                FILTER langMatches(lang(?company_type_de), "de") .
+            }
+            ORDER BY ?company_legal_name
         """
-        # Get noga data
-        results_df = pd.merge(results_df, df_burweb, on='company_uid', how='left')
-        """
+    )
 
-        file_name = f"companies_{short_name_canton}.csv"
-        path_export = os.path.join(pathlib.Path(__file__).parents[0], "data", "all_cantons", file_name)
-        results_df.to_csv(path_export, index=False)
-        if ct.has_changed(path_export):
-            logging.info(f"Exporting {file_name} to FTP server")
-            common.upload_ftp(path_export, remote_path="zefix_handelsregister/all_cantons")
-            ct.update_hash_file(path_export)
+    # Request the results as CSV and parse the response stream directly, all values stay strings as in JSON
+    r = common.requests_post(
+        "https://lindas.admin.ch/query", data={"query": query}, headers={"Accept": "text/csv"}, stream=True
+    )
+    r.raw.decode_content = True
+    results_df = pd.read_csv(r.raw, dtype=str, keep_default_na=False, na_values=[""])
+    # Split the column 'address' into zusatz and street,
+    # but if there is no zusatz, then street is in the first column
+    temp_df = results_df["adresse"].str.split("\n", expand=True)
+    results_df.loc[results_df["adresse"].str.contains("\n"), "zusatz"] = temp_df[0]
+    results_df.loc[results_df["adresse"].str.contains("\n"), "street"] = temp_df[1]
+    results_df.loc[~results_df["adresse"].str.contains("\n"), "street"] = temp_df[0]
+    results_df = results_df.drop(columns=["adresse"])
+
+    short_name_canton = results_df["short_name_canton"][0]
+    # Add url to cantonal company register
+    # Transform UID in format CHE123456789 to format CHE-123.456.789
+    company_uid_str = results_df["company_uid"].str.replace(
+        "CHE([0-9]{3})([0-9]{3})([0-9]{3})", "CHE-\\1.\\2.\\3", regex=True
+    )
+    results_df["url_cantonal_register"] = (
+        "https://" + short_name_canton.lower() + ".chregister.ch/cr-portal/auszug/auszug.xhtml?uid=" + company_uid_str
+    )
+
+    """
+    # Get noga data
+    results_df = pd.merge(results_df, df_burweb, on='company_uid', how='left')
+    """
+
+    file_name = f"companies_{short_name_canton}.csv"
+    path_export = os.path.join(pathlib.Path(__file__).parents[0], "data", "all_cantons", file_name)
+    results_df.to_csv(path_export, index=False)
+    if not ct.has_changed(path_export):
+        logging.info(f"Data of canton {short_name_canton} has not changed.")
+        return short_name_canton, None
+    return short_name_canton, path_export
 
 
 def get_gebaeudeeingaenge():
@@ -205,92 +230,165 @@ def get_gebaeudeeingaenge():
     return pd.read_csv(raw_data_file, sep=";")
 
 
-def get_coordinates_from_gwr(df, df_geb_eing):
-    df_geb_eing["address"] = (
-        df_geb_eing["strname"]
-        + " "
-        + df_geb_eing["deinr"].astype(str)
-        + ", "
-        + df_geb_eing["dplz4"].astype(str)
-        + " "
-        + df_geb_eing["dplzname"]
-    )
-    df = df.merge(df_geb_eing[["address", "eingang_koordinaten"]], on="address", how="left")
-    df.rename(columns={"eingang_koordinaten": "coordinates"}, inplace=True)
-    return df
-
-
-def get_coordinates_from_nominatim(df, cached_coordinates, use_rapidfuzz=False, street_series=None):
-    geolocator = Nominatim(user_agent="zefix_handelsregister")
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-    shp_file_path = os.path.join(pathlib.Path(__file__).parents[0], "data", "shp_bs", "bs.shp")
-    gdf_bs = gpd.read_file(shp_file_path)
-    missing_coords = df[df["coordinates"].isna()]
-    for index, row in missing_coords.iterrows():
-        if use_rapidfuzz:
-            closest_streetname = find_closest_streetname(row["street"], street_series)
-            address = closest_streetname + ", " + row["plz"] + " " + row["locality"].split(" ")[0]
-        else:
-            address = row["address"]
-        if address not in cached_coordinates:
-            try:
-                location = geocode(address)
-                if location:
-                    point = Point(location.longitude, location.latitude)
-                    is_in_bs = (
-                        "Basel" in row["locality"] or "Riehen" in row["locality"] or "Bettingen" in row["locality"]
-                    )
-                    if is_in_bs != gdf_bs.contains(point).any():
-                        logging.info(f"Location {location} is not in Basel-Stadt")
-                        continue
-                    cached_coordinates[address] = (
-                        location.latitude,
-                        location.longitude,
-                    )
-                    df.at[index, "coordinates"] = cached_coordinates[address]
-                else:
-                    logging.info(f"Location not found for address: {address}")
-            except Exception as e:
-                logging.info(f"Error occurred for address {address}: {e}")
-                time.sleep(5)
-        else:
-            logging.info(f"Using cached coordinates for address: {address}")
-            df.at[index, "coordinates"] = cached_coordinates[address]
-    return df, cached_coordinates
-
-
-def get_coordinates_from_nomatim_and_gwr(df, df_geb_eing):
-    # Get lookup table for addresses that could not be found
+def normalize_street(street):
+    """Normalises a street name for matching, e.g. "St.Alban-Vorstadt" and "St. Alban Vorstadt" -> "st alban vorstadt"."""
+    street = street.lower().replace("str.", "strasse")
+    return " ".join(re.sub(r"[^\w]", " ", street).split())
+
+
+def split_street(street):
+    """Splits "Freie Strasse 10a" into ("Freie Strasse", "10a"), returns (street, None) without house number."""
+    match = re.match(r"^(.*?)[\s,]*(\d+\s*[a-zA-Z]?)$", street.strip())
+    if not match:
+        return street, None
+    return match.group(1), match.group(2).replace(" ", "").lower()
+
+
+def _trigrams(text):
+    text = f"  {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class GebaeudeeingangIndex:
+    """
+    Address index built once from the Gebäudeeingänge (https://data.bs.ch/explore/dataset/100231):
+    exact lookups by normalised (street, house number, plz) and fuzzy street lookups via a trigram index,
+    which only scores the street names sharing the most trigrams with the query.
+    """
+
+    def __init__(self, df_geb_eing):
+        df = pd.DataFrame(
+            {
+                "strname": df_geb_eing["strname"],
+                "street": df_geb_eing["strname"].map(normalize_street),
+                "nr": df_geb_eing["deinr"].astype(str).str.replace(" ", "").str.lower(),
+                "plz": df_geb_eing["dplz4"].astype(str),
+                "coordinates": df_geb_eing["eingang_koordinaten"],
+            }
+        ).drop_duplicates(subset=["street", "nr", "plz"])
+        self.coordinates = dict(zip(zip(df["street"], df["nr"], df["plz"]), df["coordinates"]))
+        self.street_names = df.drop_duplicates(subset="street").set_index("street")["strname"].to_dict()
+        self.streets = sorted(self.street_names)
+        self.trigrams = defaultdict(set)
+        for i, street in enumerate(self.streets):
+            for trigram in _trigrams(street):
+                self.trigrams[trigram].add(i)
+
+    def lookup(self, street, nr, plz):
+        return self.coordinates.get((normalize_street(street), nr, plz))
+
+    def closest_street(self, street, num_candidates=20):
+        """
+        Returns the normalised street name most similar to street and its similarity score (0-100),
+        or (None, 0) if no street shares a trigram.
+        """
+        street = normalize_street(street)
+        if street in self.street_names:
+            return street, 100
+        hits = Counter(i for trigram in _trigrams(street) for i in self.trigrams.get(trigram, ()))
+        candidates = [self.streets[i] for i, _ in hits.most_common(num_candidates)]
+        if not candidates:
+            return None, 0
+        closest, score, _ = process.extractOne(street, candidates)
+        return closest, score
+
+
+def open_geocode_cache():
+    """Opens the SQLite cache of Nominatim results, importing the former JSON lookup table once."""
+    path_cache = os.path.join(pathlib.Path(__file__).parents[0], "data", "nominatim_cache.db")
     path_lookup_table = os.path.join(pathlib.Path(__file__).parents[0], "data", "addr_to_coords_lookup_table.json")
-    if os.path.exists(path_lookup_table):
+    is_new = not os.path.exists(path_cache)
+    cache = sqlite3.connect(path_cache)
+    cache.execute("CREATE TABLE IF NOT EXISTS geocode (address TEXT PRIMARY KEY, lat REAL, lon REAL, queried_at TEXT)")
+    if is_new and os.path.exists(path_lookup_table):
         with open(path_lookup_table, "r") as f:
             cached_coordinates = json.load(f)
-    else:  # Create empty lookup table since it does not exist yet
-        cached_coordinates = {}
-
-    df, cached_coordinates = get_coordinates_from_nominatim(df, cached_coordinates)
+        logging.info(f"Importing {len(cached_coordinates)} addresses from {path_lookup_table}...")
+        with cache:
+            cache.executemany(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+                [(address, lat, lon, None) for address, (lat, lon) in cached_coordinates.items()],
+            )
+    return cache
+
+
+def geocode_with_nominatim(address, locality, geocode, cache, bs_area):
+    """
+    Returns (lat, lon) of address from the cache or else from Nominatim, or None if not found.
+    Addresses Nominatim did not find are cached as well and only queried again after NOMINATIM_RETRY_DAYS.
+    """
+    row = cache.execute("SELECT lat, lon, queried_at FROM geocode WHERE address = ?", (address,)).fetchone()
+    if row is not None:
+        lat, lon, queried_at = row
+        if lat is not None:
+            logging.info(f"Using cached coordinates for address: {address}")
+            return lat, lon
+        if datetime.datetime.fromisoformat(queried_at) > datetime.datetime.now() - NOMINATIM_RETRY_DAYS:
+            return None
+    try:
+        location = geocode(address)
+    except Exception as e:
+        logging.info(f"Error occurred for address {address}: {e}")
+        time.sleep(5)
+        return None
+    coordinates = None
+    if not location:
+        logging.info(f"Location not found for address: {address}")
+    else:
+        is_in_bs = "Basel" in locality or "Riehen" in locality or "Bettingen" in locality
+        if is_in_bs != bs_area.contains(Point(location.longitude, location.latitude)):
+            logging.info(f"Location {location} is not in Basel-Stadt")
+        else:
+            coordinates = (location.latitude, location.longitude)
+    with cache:
+        cache.execute(
+            "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+            (address, *(coordinates or (None, None)), datetime.datetime.now().isoformat()),
+        )
+    return coordinates
 
-    # Last resort: Find closest street in Gebäudeeingänge (https://data.bs.ch/explore/dataset/100231)
-    # with help of rapidfuzz and then get coordinates from Nominatim
-    street_series = df_geb_eing["strname"] + " " + df_geb_eing["deinr"].astype(str)
-    df, cached_coordinates = get_coordinates_from_nominatim(
-        df, cached_coordinates, use_rapidfuzz=True, street_series=street_series
-    )
 
-    # Save lookup table
-    with open(path_lookup_table, "w") as f:
-        json.dump(cached_coordinates, f)
+def get_coordinates(df, df_geb_eing):
+    """
+    Adds the column coordinates to df. Addresses are looked up in the Gebäudeeingänge, first as they are and then
+    with the street name corrected by fuzzy matching. Only addresses not found there are geocoded with Nominatim
+    (cached in SQLite), first as they are and then with the corrected street name.
+    """
+    index = GebaeudeeingangIndex(df_geb_eing)
+    shp_file_path = os.path.join(pathlib.Path(__file__).parents[0], "data", "shp_bs", "bs.shp")
+    bs_area = prep(gpd.read_file(shp_file_path).union_all())
+    geolocator = Nominatim(user_agent="zefix_handelsregister")
+    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    cache = open_geocode_cache()
+
+    coordinates = {}
+    addresses = df[["address", "street", "plz", "locality"]].dropna(subset=["address"]).drop_duplicates("address")
+    for address, street, plz, locality in addresses.itertuples(index=False):
+        street_name, nr = split_street(street) if isinstance(street, str) else (None, None)
+        closest_street, score = index.closest_street(street_name) if street_name else (None, 0)
+        if nr is not None:
+            coords = index.lookup(street_name, nr, plz)
+            if coords is None and closest_street is not None and score >= STREET_SCORE_CUTOFF:
+                # Only near-certain matches, anything else is checked by Nominatim and the Basel-Stadt area below
+                coords = index.coordinates.get((closest_street, nr, plz))
+            if coords is not None:
+                coordinates[address] = coords
+                continue
+        coords = geocode_with_nominatim(address, locality, geocode, cache, bs_area)
+        if coords is None and closest_street is not None:
+            # Last resort: Nominatim with the closest street name of the Gebäudeeingänge
+            closest_address = f"{index.street_names[closest_street]} {nr or ''}".strip()
+            logging.info(f"Closest address for {street} according to fuzzy matching is: {closest_address}")
+            closest_address = closest_address + ", " + plz + " " + locality.split(" ")[0]
+            coords = geocode_with_nominatim(closest_address, locality, geocode, cache, bs_area)
+        if coords is not None:
+            coordinates[address] = coords
+    cache.close()
+    df["coordinates"] = df["address"].map(coordinates)
+    logging.info(f"Found coordinates for {df['coordinates'].notna().sum()} of {len(df)} companies.")
     return df
 
 
-def find_closest_streetname(street, street_series):
-    if street:
-        closest_address, _, _ = process.extractOne(street, street_series)
-        logging.info(f"Closest address for {street} according to fuzzy matching is: {closest_address}")
-        return closest_address
-    return street
-
-
 def work_with_BS_data():
     path_BS = os.path.join(pathlib.Path(__file__).parents[0], "data", "all_cantons", "companies_BS.csv")
     df_BS = pd.read_csv(path_BS)
@@ -304,10 +402,8 @@ def work_with_BS_data():
     # Get data of Gebäudeeingänge https://data.bs.ch/explore/dataset/100231
     df_geb_eing = get_gebaeudeeingaenge()
 
-    # First try to get coordinates from Gebäudeeingänge directly
-    df_BS = get_coordinates_from_gwr(df_BS, df_geb_eing)
-    # Then try to get coordinates from Nominatim
-    df_BS = get_coordinates_from_nomatim_and_gwr(df_BS, df_geb_eing)
+    # Get coordinates from Gebäudeeingänge, Nominatim only for addresses not found there
+    df_BS = get_coordinates(df_BS, df_geb_eing)
 
     return df_BS[
         [